@@ -1,18 +1,442 @@
+import csv
+import fcntl
+import gzip
+import hashlib
+import json
 import logging
+import os
+import queue
+import random
+import re
 import sys
-from contextlib import closing
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import quote
 
 import prestodb
+import requests
+from requests.adapters import HTTPAdapter
+from airflow.hooks.S3_hook import S3Hook
 from airflow.hooks.presto_hook import PrestoHook
-from typing import List
+from typing import Dict, Iterator, List, NamedTuple, Tuple
 
 from airflow.contrib.hooks.aws_hook import AwsHook
+from airflow.exceptions import AirflowException
+from airflow.settings import Stats
 from botocore.exceptions import ClientError
 
 
+class HookRegistry(object):
+    """Caches hooks in the process so that one task run reuses the same clients and sessions."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hooks: Dict[str, object] = {}
+        self.created_clients: Dict[str, int] = defaultdict(int)
+
+    def get_hook(self, hook_class, **kwargs):
+        key = json.dumps([hook_class.__module__, hook_class.__name__, kwargs], sort_keys=True, default=str)
+        with self._lock:
+            if key not in self._hooks:
+                self._hooks[key] = hook_class(**kwargs)
+            return self._hooks[key]
+
+    def count_created_client(self, name: str) -> None:
+        with self._lock:
+            self.created_clients[name] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            for hook in self._hooks.values():
+                if isinstance(hook, PrestoHook):
+                    hook.close()
+            self._hooks.clear()
+
+
+hook_registry = HookRegistry()
+
+
+class CallCounter(object):
+    """Counts external API calls in the process by `<service>.<operation>`.
+
+    The calls are also counted in the scope of the thread that `open_scope` starts for one operator run, so that
+    the concurrent runs in the process (e.g. the partitions of a backfill) do not mix their counts. The threads
+    working for the run join its scope by `bind`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = defaultdict(int)
+        self._local = threading.local()
+
+    def count(self, name: str, n: int = 1) -> None:
+        scope = getattr(self._local, 'scope', None)
+        with self._lock:
+            self._counts[name] += n
+            if scope is not None:
+                scope[name] += n
+
+    def open_scope(self) -> Dict[str, int]:
+        """Counts the calls of the current thread in a new scope from now, and returns the scope."""
+        self._local.scope = defaultdict(int)
+        return self._local.scope
+
+    def bind(self, fn):
+        """Returns `fn` that counts the calls in the scope of the current thread even if it runs in another thread."""
+        scope = getattr(self._local, 'scope', None)
+
+        def bound(*args, **kwargs):
+            previous = getattr(self._local, 'scope', None)
+            self._local.scope = scope
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._local.scope = previous
+
+        return bound
+
+    def snapshot(self, scope: Dict[str, int] = None) -> Dict[str, int]:
+        """Returns the counts of `scope`, or the counts in the process if it is None."""
+        with self._lock:
+            return dict(self._counts if scope is None else scope)
+
+    def diff(self, since: Dict[str, int], scope: Dict[str, int] = None) -> Dict[str, int]:
+        return {k: v - since.get(k, 0) for k, v in self.snapshot(scope).items() if v - since.get(k, 0) > 0}
+
+
+call_counter = CallCounter()
+# NOTE: Throttled responses and milliseconds waited for the rate limiter by `<service>.throttled` and
+#       `<service>.wait_millis`.
+throttle_counter = CallCounter()
+
+
+def _count_boto_call(model, **kwargs) -> None:
+    call_counter.count(f"{model.service_model.endpoint_prefix}.{model.name}")
+
+
+def bind_run_scope(fn):
+    """Returns `fn` that counts the calls and the throttling in the run of the current thread in another thread."""
+    return throttle_counter.bind(call_counter.bind(fn))
+
+
+class RunMetrics(object):
+    """Records the wall time and the external API calls per phase of one operator run.
+
+    NOTE: The calls are counted in the scope of the thread that creates this, so calls in other threads are
+          not counted unless they run by `bind_run_scope`.
+    """
+
+    def __init__(self):
+        self.phases: Dict[str, dict] = {}
+        self._started_at = time.monotonic()
+        self._calls = call_counter.open_scope()
+        self._throttling = throttle_counter.open_scope()
+
+    @contextmanager
+    def phase(self, name: str):
+        started_at = time.monotonic()
+        calls_before = call_counter.snapshot(self._calls)
+        try:
+            yield
+        finally:
+            p = self.phases.setdefault(name, {'seconds': 0.0, 'calls': {}})
+            p['seconds'] += time.monotonic() - started_at
+            for k, v in call_counter.diff(calls_before, self._calls).items():
+                p['calls'][k] = p['calls'].get(k, 0) + v
+
+    def summary(self) -> dict:
+        return {
+            'seconds': time.monotonic() - self._started_at,
+            'phases': self.phases,
+            'calls': call_counter.diff({}, self._calls),
+            'throttling': throttle_counter.diff({}, self._throttling),
+        }
+
+    def emit(self, prefix: str) -> dict:
+        """Sends the metrics as StatsD timers and counters, and returns the summary."""
+        summary = self.summary()
+        for name, p in summary['phases'].items():
+            Stats.timing(f"{prefix}.phase.{name}", p['seconds'] * 1000)
+        for name, count in summary['calls'].items():
+            Stats.incr(f"{prefix}.calls.{name}", count)
+        for name, count in summary['throttling'].items():
+            Stats.incr(f"{prefix}.throttling.{name}", count)
+        logging.info(f"Metrics of the run: {summary}")
+        return summary
+
+
+# NOTE: The limits of the number of entries in one request of Glue batch APIs.
+BatchGetPartitionLimit = 1000
+BatchCreatePartitionLimit = 100
+BatchUpdatePartitionLimit = 100
+BatchDeletePartitionLimit = 25
+UpdateColumnStatisticsLimit = 25
+# NOTE: The limit of the number of keys in one DeleteObjects request.
+DeleteObjectsLimit = 1000
+# NOTE: The limit of the length of the expression of GetPartitions.
+GetPartitionsExpressionLimit = 2048
+# NOTE: Partition key types whose values are not quoted in the expression of GetPartitions.
+NumericPartitionKeyTypes = ['tinyint', 'smallint', 'int', 'integer', 'bigint']
+
+
+# NOTE: The default number of idle connections that PrestoHook keeps.
+DefaultPrestoPoolSize = 4
+
+# NOTE: The backoff to poll the query again after an unavailable response of the coordinator.
+PollBaseBackoffSeconds = 0.1
+PollMaxBackoffSeconds = 5
+
+# NOTE: The default number of rows in one batch of the streamed results, and in one exported file.
+DefaultPrestoBatchSize = 10000
+DefaultExportRowsPerFile = 1000000
+CsvExportFormat = 'csv'
+ParquetExportFormat = 'parquet'
+AvailableExportFormats = [
+    CsvExportFormat,
+    ParquetExportFormat,
+]
+# NOTE: Types of pyarrow for Presto types. Values of other types are exported as strings.
+ParquetTypes = {
+    'boolean': 'bool_',
+    'tinyint': 'int8',
+    'smallint': 'int16',
+    'integer': 'int32',
+    'bigint': 'int64',
+    'real': 'float32',
+    'double': 'float64',
+    'varchar': 'string',
+    'char': 'string',
+    'varbinary': 'binary',
+}
+
+# NOTE: Optional keys of the table storage descriptor that partitions inherit.
+PartitionStorageDescriptorKeys = [
+    'BucketColumns',
+    'SortColumns',
+    'NumberOfBuckets',
+    'Parameters',
+]
+
+# NOTE: Keys of a table that can be passed to TableInput of UpdateTable.
+TableInputKeys = [
+    'Name',
+    'Description',
+    'Owner',
+    'LastAccessTime',
+    'LastAnalyzedTime',
+    'Retention',
+    'StorageDescriptor',
+    'PartitionKeys',
+    'ViewOriginalText',
+    'ViewExpandedText',
+    'TableType',
+    'Parameters',
+]
+
+# NOTE: Units of io.airlift.units.DataSize that Presto uses in the query info.
+DataSizeUnits = {
+    'B': 1,
+    'kB': 1 << 10,
+    'MB': 1 << 20,
+    'GB': 1 << 30,
+    'TB': 1 << 40,
+    'PB': 1 << 50,
+}
+
+
+# NOTE: Error codes of AWS APIs for throttled requests.
+ThrottlingErrorCodes = [
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'SlowDown',
+]
+# NOTE: The default max attempts of a throttled request, and the base and the cap of its backoff.
+DefaultThrottleMaxAttempts = 10
+ThrottleBaseBackoffSeconds = 0.5
+ThrottleMaxBackoffSeconds = 30
+# NOTE: The rate limiter halves the rate on throttling down to this ratio of the configured rate,
+#       and recovers the configured rate linearly in these seconds.
+ThrottleMinRateRatio = 0.1
+ThrottleRecoverySeconds = 60
+
+# NOTE: AwsHook assumes `role_arn` of the connection once, and the credentials are not refreshed. A cached client of
+#       an assumed role is rebuilt after this ratio of the duration of the credentials (1 hour by default).
+DefaultAssumeRoleDurationSeconds = 3600
+AssumedRoleClientTtlRatio = 0.75
+
+
+def _parse_data_size(value) -> int:
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    m = re.match(r'^\s*([\d.]+)\s*([a-zA-Z]+)\s*$', value)
+    if not m or m.group(2) not in DataSizeUnits:
+        return None
+    return int(float(m.group(1)) * DataSizeUnits[m.group(2)])
+
+
+def _chunks(seq: list, size: int):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+@contextmanager
+def _locked_json_file(path: str, default: dict):
+    """Yields the JSON object in `path` that is locked among processes, and writes it back."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            content = f.read()
+            state = json.loads(content) if content else default
+            yield state
+            f.seek(0)
+            f.truncate()
+            json.dump(state, f)
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class RateLimiter(object):
+    """Token buckets that limit the request rate of the clients per service and region.
+
+    A throttled response halves the rate of the bucket, and the rate recovers linearly to the configured
+    rate in `ThrottleRecoverySeconds`. The buckets live in the process, or in files under `limiter_dir`
+    to be shared among processes on the same host.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, dict] = {}
+
+    @staticmethod
+    def _new_state() -> dict:
+        return {'tokens': 0.0, 'updated_at': 0, 'throttled_rate': None, 'throttled_at': 0}
+
+    @contextmanager
+    def _state(self, key: str, limiter_dir: str = None):
+        if not limiter_dir:
+            with self._lock:
+                yield self._buckets.setdefault(key, self._new_state())
+            return
+        path = os.path.join(limiter_dir, f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.json")
+        with _locked_json_file(path, self._new_state()) as state:
+            yield state
+
+    @staticmethod
+    def _current_rate(state: dict, rate: float, now: float) -> float:
+        if state['throttled_rate'] is None:
+            return rate
+        return min(rate, state['throttled_rate'] + rate * (now - state['throttled_at']) / ThrottleRecoverySeconds)
+
+    def acquire(self, key: str, rate: float, limiter_dir: str = None) -> float:
+        """Takes a token of the bucket, and returns the seconds waited for it."""
+        waited = 0.0
+        while True:
+            with self._state(key, limiter_dir) as state:
+                now = time.time()
+                current_rate = self._current_rate(state, rate, now)
+                burst = max(1.0, current_rate)
+                if state['updated_at']:
+                    state['tokens'] = min(burst, state['tokens'] + (now - state['updated_at']) * current_rate)
+                else:
+                    state['tokens'] = burst
+                state['updated_at'] = now
+                if state['tokens'] >= 1:
+                    state['tokens'] -= 1
+                    return waited
+                wait_seconds = (1 - state['tokens']) / current_rate
+            time.sleep(wait_seconds)
+            waited += wait_seconds
+
+    def throttle(self, key: str, rate: float, limiter_dir: str = None) -> None:
+        """Slows down the bucket because a request is throttled."""
+        with self._state(key, limiter_dir) as state:
+            now = time.time()
+            state['throttled_rate'] = max(rate * ThrottleMinRateRatio, self._current_rate(state, rate, now) / 2)
+            state['throttled_at'] = now
+            state['tokens'] = min(state['tokens'], 0.0)
+
+
+rate_limiter = RateLimiter()
+
+
+def _register_throttling_handlers(client, extras: dict) -> None:
+    """Registers handlers that limit the request rate of `client` and retry throttled requests with jitter.
+
+    The rate of a service is `rate_limits.<service>` requests per second in the extras of the AWS connection.
+    """
+    service = client.meta.service_model.endpoint_prefix
+    rate = extras.get('rate_limits', {}).get(service)
+    limiter_dir = extras.get('rate_limiter_dir')
+    max_attempts = int(extras.get('throttle_max_attempts', DefaultThrottleMaxAttempts))
+    key = f"{service}.{client.meta.region_name}"
+
+    def limit_rate(**kwargs) -> None:
+        waited = rate_limiter.acquire(key, rate=float(rate), limiter_dir=limiter_dir)
+        if waited:
+            throttle_counter.count(f"{service}.wait_millis", int(waited * 1000))
+
+    def retry_throttled(response=None, attempts: int = 0, operation=None, **kwargs) -> float:
+        if not response or response[1].get('Error', {}).get('Code') not in ThrottlingErrorCodes:
+            return None
+        throttle_counter.count(f"{service}.throttled")
+        if rate:
+            rate_limiter.throttle(key, rate=float(rate), limiter_dir=limiter_dir)
+        if attempts >= max_attempts:
+            return None
+        # NOTE: Full jitter spreads the retries of the concurrent tasks.
+        delay = random.uniform(0, min(ThrottleMaxBackoffSeconds, ThrottleBaseBackoffSeconds * 2 ** attempts))
+        logging.info(f"{service}.{operation.name if operation else ''} is throttled,"
+                     f" retry in {delay:.2f}s (attempts: {attempts}/{max_attempts}).")
+        return delay
+
+    if rate:
+        client.meta.events.register('before-call', limit_rate)
+    # NOTE: Handle throttling before the retry handler of botocore for the service whose max attempts are fixed.
+    client.meta.events.register_first(f"needs-retry.{service}", retry_throttled)
+
+
+def _aws_conn_extras(hook: AwsHook) -> dict:
+    try:
+        return hook.get_connection(hook.aws_conn_id).extra_dejson
+    except AirflowException:
+        return {}
+
+
+def _client_expires_at(extras: dict) -> float:
+    """Returns the monotonic time to rebuild a client created now, or None if its credentials are refreshed."""
+    if not extras.get('role_arn'):
+        return None
+    duration = extras.get('assume_role_kwargs', {}).get('DurationSeconds', DefaultAssumeRoleDurationSeconds)
+    return time.monotonic() + int(duration) * AssumedRoleClientTtlRatio
+
+
 class GlueDataCatalogHook(AwsHook):
     def get_conn(self):
-        self.conn = self.get_client_type('glue', self.region_name)
+        with self._conn_lock:
+            if self.conn and self._conn_expires_at and time.monotonic() >= self._conn_expires_at:
+                logging.info("Rebuild the Glue client before the credentials of the assumed role expire.")
+                self.conn = None
+            if not self.conn:
+                extras = _aws_conn_extras(self)
+                self.conn = self.get_client_type('glue', self.region_name)
+                self.conn.meta.events.register('before-call', _count_boto_call)
+                _register_throttling_handlers(self.conn, extras)
+                self._conn_expires_at = _client_expires_at(extras)
+                hook_registry.count_created_client('glue')
         return self.conn
 
     def get_records(self, sql):
@@ -33,7 +457,33 @@ class GlueDataCatalogHook(AwsHook):
             **kwargs):
         self.region_name = region_name
         self.catalog_id = catalog_id
+        # NOTE: Table metadata snapshots that live while one operator run, by the thread of the run because
+        #       the hook is shared by the concurrent runs (e.g. the partitions of a backfill). The snapshots are
+        #       invalidated when this hook mutates the catalog, and the caller must invalidate them when the catalog
+        #       is mutated outside this hook (e.g. `CREATE TABLE` or `INSERT` on Presto).
+        self._table_snapshots: Dict[int, Dict[Tuple[str, str], dict]] = {}
+        self._snapshots_lock = threading.Lock()
         super().__init__(aws_conn_id=aws_conn_id, *args, **kwargs)
+        self.conn = None
+        self._conn_expires_at: float = None
+        self._conn_lock = threading.Lock()
+
+    def _snapshots(self) -> Dict[Tuple[str, str], dict]:
+        with self._snapshots_lock:
+            return self._table_snapshots.setdefault(threading.get_ident(), {})
+
+    def clear_snapshots(self) -> None:
+        """Clears the snapshots of the current thread, and the ones of the finished threads."""
+        alive = {t.ident for t in threading.enumerate()}
+        with self._snapshots_lock:
+            for ident in list(self._table_snapshots):
+                if ident == threading.get_ident() or ident not in alive:
+                    del self._table_snapshots[ident]
+
+    def invalidate_table(self, db: str, name: str) -> None:
+        with self._snapshots_lock:
+            for snapshots in self._table_snapshots.values():
+                snapshots.pop((db, name), None)
 
     def get_database(self, name: str) -> dict:
         args = {
@@ -54,13 +504,18 @@ class GlueDataCatalogHook(AwsHook):
             raise ex
 
     def get_table(self, db: str, name: str) -> dict:
+        snapshots = self._snapshots()
+        if (db, name) in snapshots:
+            return snapshots[(db, name)]
         args = {
             'DatabaseName': db,
             'Name': name,
         }
         if self.catalog_id:
             args['CatalogId'] = self.catalog_id
-        return self.get_conn().get_table(**args)['Table']
+        table = self.get_conn().get_table(**args)['Table']
+        snapshots[(db, name)] = table
+        return table
 
     def does_table_exists(self, db: str, name: str) -> bool:
         try:
@@ -84,6 +539,25 @@ class GlueDataCatalogHook(AwsHook):
             raise GlueDataCatalogError(f"Table[{db}.{table}] does not have Location")
         return table['StorageDescriptor']['Location']
 
+    def update_table_parameters(self, db: str, name: str, parameters: Dict[str, str]) -> None:
+        """Merges `parameters` into the table parameters."""
+        self.invalidate_table(db=db, name=name)
+        table = self.get_table(db=db, name=name)
+        table_input = {k: v for k, v in table.items() if k in TableInputKeys}
+        table_input['Parameters'] = dict(table.get('Parameters', {}), **parameters)
+        # NOTE: The parameters are updated in every run, so do not archive the previous versions of the table.
+        args = {
+            'DatabaseName': db,
+            'TableInput': table_input,
+            'SkipArchive': True,
+        }
+        if self.catalog_id:
+            args['CatalogId'] = self.catalog_id
+        try:
+            self.get_conn().update_table(**args)
+        finally:
+            self.invalidate_table(db=db, name=name)
+
     def delete_table(self, db: str, name: str) -> None:
         args = {
             'DatabaseName': db,
@@ -91,7 +565,24 @@ class GlueDataCatalogHook(AwsHook):
         }
         if self.catalog_id:
             args['CatalogId'] = self.catalog_id
-        self.get_conn().delete_table(**args)
+        try:
+            self.get_conn().delete_table(**args)
+        finally:
+            self.invalidate_table(db=db, name=name)
+
+    def get_tables(self, db: str, expression: str = '') -> List[dict]:
+        """Returns tables whose names match the regular expression `expression` (all tables if empty)."""
+        args = {
+            'DatabaseName': db,
+        }
+        if expression:
+            args['Expression'] = expression
+        if self.catalog_id:
+            args['CatalogId'] = self.catalog_id
+        tables: List[dict] = []
+        for page in self.get_conn().get_paginator('get_tables').paginate(**args):
+            tables.extend(page['TableList'])
+        return tables
 
     def get_partition(self, db: str, table_name: str, partition_values: List[str]) -> dict:
         args = {
@@ -112,6 +603,49 @@ class GlueDataCatalogHook(AwsHook):
                 return False
             raise ex
 
+    def get_partitions(self, db: str, table_name: str, expression: str = '') -> List[dict]:
+        """Returns partitions that match `expression` of GetPartitions (all partitions if empty)."""
+        args = {
+            'DatabaseName': db,
+            'TableName': table_name,
+            'Expression': expression,
+        }
+        if self.catalog_id:
+            args['CatalogId'] = self.catalog_id
+        partitions: List[dict] = []
+        for page in self.get_conn().get_paginator('get_partitions').paginate(**args):
+            partitions.extend(page['Partitions'])
+        return partitions
+
+    def _partition_values_expression(self, db: str, table_name: str, partition_values: List[str]) -> str:
+        conditions: List[str] = []
+        for k, v in zip(self.get_table(db=db, name=table_name)['PartitionKeys'], partition_values):
+            if k['Type'].lower() in NumericPartitionKeyTypes:
+                conditions.append(f"{k['Name']} = {v}")
+            else:
+                escaped = v.replace("'", "''")
+                conditions.append(f"{k['Name']} = '{escaped}'")
+        return f"({' AND '.join(conditions)})"
+
+    def get_partitions_by_values(self, db: str, table_name: str,
+                                 partition_values_list: List[List[str]]) -> List[dict]:
+        """Returns existing partitions in `partition_values_list` by GetPartitions with OR-ed expressions.
+
+        The expressions are split only when they exceed the length limit, so the partitions are usually
+        returned by one paginated GetPartitions call.
+        """
+        expressions: List[str] = []
+        for values in partition_values_list:
+            e = self._partition_values_expression(db=db, table_name=table_name, partition_values=values)
+            if expressions and len(expressions[-1]) + len(e) + len(' OR ') <= GetPartitionsExpressionLimit:
+                expressions[-1] = f"{expressions[-1]} OR {e}"
+            else:
+                expressions.append(e)
+        partitions: List[dict] = []
+        for e in expressions:
+            partitions.extend(self.get_partitions(db=db, table_name=table_name, expression=e))
+        return partitions
+
     def delete_partition(self, db: str, table_name: str, partition_values: List[str]) -> None:
         args = {
             'DatabaseName': db,
@@ -122,56 +656,173 @@ class GlueDataCatalogHook(AwsHook):
             args['CatalogId'] = self.catalog_id
         self.get_conn().delete_partition(**args)
 
+    def _partition_input(self, db: str, table_name: str, partition_values: List[str], location: str) -> dict:
+        sd = self.get_table(db=db, name=table_name)['StorageDescriptor']
+        partition_sd = {
+            'Location': location,
+            'Columns': sd['Columns'],
+            'InputFormat': sd['InputFormat'],
+            'OutputFormat': sd['OutputFormat'],
+            'Compressed': sd['Compressed'],
+            'SerdeInfo': sd['SerdeInfo'],
+        }
+        # NOTE: Keep the bucketing and the sorting not to lose bucket pruning and bucketed joins on the partition.
+        for k in PartitionStorageDescriptorKeys:
+            if k in sd:
+                partition_sd[k] = sd[k]
+        return {
+            'Values': partition_values,
+            'StorageDescriptor': partition_sd,
+        }
+
     def create_partition(self, db: str, table_name: str, partition_values: List[str], location: str) -> None:
-        table = self.get_table(db=db, name=table_name)
-        sd = table['StorageDescriptor']
         args = {
             'DatabaseName': db,
             'TableName': table_name,
-            'PartitionInput': {
-                'Values': partition_values,
-                'StorageDescriptor': {
-                    'Location': location,
-                    'Columns': sd['Columns'],
-                    'InputFormat': sd['InputFormat'],
-                    'OutputFormat': sd['OutputFormat'],
-                    'Compressed': sd['Compressed'],
-                    'SerdeInfo': sd['SerdeInfo'],
-                },
-            },
+            'PartitionInput': self._partition_input(db=db,
+                                                    table_name=table_name,
+                                                    partition_values=partition_values,
+                                                    location=location),
         }
         if self.catalog_id:
             args['CatalogId'] = self.catalog_id
         self.get_conn().create_partition(**args)
 
     def update_partition(self, db: str, table_name: str, partition_values: List[str], location: str) -> None:
-        table = self.get_table(db=db, name=table_name)
-        sd = table['StorageDescriptor']
         args = {
             'DatabaseName': db,
             'TableName': table_name,
             'PartitionValueList': partition_values,
-            'PartitionInput': {
-                'Values': partition_values,
-                'StorageDescriptor': {
-                    'Location': location,
-                    'Columns': sd['Columns'],
-                    'InputFormat': sd['InputFormat'],
-                    'OutputFormat': sd['OutputFormat'],
-                    'Compressed': sd['Compressed'],
-                    'SerdeInfo': sd['SerdeInfo'],
-                },
-            },
+            'PartitionInput': self._partition_input(db=db,
+                                                    table_name=table_name,
+                                                    partition_values=partition_values,
+                                                    location=location),
         }
         if self.catalog_id:
             args['CatalogId'] = self.catalog_id
         self.get_conn().update_partition(**args)
 
+    @staticmethod
+    def _batch_errors(errors: List[dict], values_key: str) -> List[dict]:
+        return [
+            {
+                'values': e[values_key],
+                'error': f"{e['ErrorDetail'].get('ErrorCode')}: {e['ErrorDetail'].get('ErrorMessage')}",
+            }
+            for e in errors
+        ]
+
+    def batch_get_partitions(self, db: str, table_name: str, partition_values_list: List[List[str]]) -> List[dict]:
+        """Returns existing partitions in `partition_values_list`."""
+        partitions: List[dict] = []
+        for chunk in _chunks(partition_values_list, BatchGetPartitionLimit):
+            keys = [{'Values': v} for v in chunk]
+            while keys:
+                args = {
+                    'DatabaseName': db,
+                    'TableName': table_name,
+                    'PartitionsToGet': keys,
+                }
+                if self.catalog_id:
+                    args['CatalogId'] = self.catalog_id
+                r = self.get_conn().batch_get_partition(**args)
+                partitions.extend(r['Partitions'])
+                keys = r.get('UnprocessedKeys', [])
+        return partitions
+
+    def batch_create_partitions(self, db: str, table_name: str, values_n_locations: List[Tuple[List[str], str]]) -> List[dict]:
+        """Creates partitions and returns errors of the entries."""
+        return self.batch_create_partition_inputs(db=db, table_name=table_name, partition_inputs=[
+            self._partition_input(db=db, table_name=table_name, partition_values=v, location=l)
+            for v, l in values_n_locations
+        ])
+
+    def batch_create_partition_inputs(self, db: str, table_name: str, partition_inputs: List[dict]) -> List[dict]:
+        """Creates partitions by PartitionInput of Glue and returns errors of the entries."""
+        errors: List[dict] = []
+        for chunk in _chunks(partition_inputs, BatchCreatePartitionLimit):
+            args = {
+                'DatabaseName': db,
+                'TableName': table_name,
+                'PartitionInputList': chunk,
+            }
+            if self.catalog_id:
+                args['CatalogId'] = self.catalog_id
+            r = self.get_conn().batch_create_partition(**args)
+            errors.extend(self._batch_errors(r.get('Errors', []), values_key='PartitionValues'))
+        return errors
+
+    def batch_update_partitions(self, db: str, table_name: str, values_n_locations: List[Tuple[List[str], str]]) -> List[dict]:
+        """Updates partitions and returns errors of the entries."""
+        return self.batch_update_partition_inputs(db=db, table_name=table_name, partition_inputs=[
+            self._partition_input(db=db, table_name=table_name, partition_values=v, location=l)
+            for v, l in values_n_locations
+        ])
+
+    def batch_update_partition_inputs(self, db: str, table_name: str, partition_inputs: List[dict]) -> List[dict]:
+        """Updates partitions of `Values` in PartitionInput of Glue and returns errors of the entries."""
+        errors: List[dict] = []
+        for chunk in _chunks(partition_inputs, BatchUpdatePartitionLimit):
+            args = {
+                'DatabaseName': db,
+                'TableName': table_name,
+                'Entries': [{'PartitionValueList': i['Values'], 'PartitionInput': i} for i in chunk],
+            }
+            if self.catalog_id:
+                args['CatalogId'] = self.catalog_id
+            r = self.get_conn().batch_update_partition(**args)
+            errors.extend(self._batch_errors(r.get('Errors', []), values_key='PartitionValueList'))
+        return errors
+
+    def batch_delete_partitions(self, db: str, table_name: str, partition_values_list: List[List[str]]) -> List[dict]:
+        """Deletes partitions and returns errors of the entries."""
+        errors: List[dict] = []
+        for chunk in _chunks(partition_values_list, BatchDeletePartitionLimit):
+            args = {
+                'DatabaseName': db,
+                'TableName': table_name,
+                'PartitionsToDelete': [{'Values': v} for v in chunk],
+            }
+            if self.catalog_id:
+                args['CatalogId'] = self.catalog_id
+            r = self.get_conn().batch_delete_partition(**args)
+            errors.extend(self._batch_errors(r.get('Errors', []), values_key='PartitionValues'))
+        return errors
+
+    def update_partition_column_statistics(self, db: str, table_name: str, partition_values: List[str],
+                                           column_statistics: List[dict]) -> List[dict]:
+        """Updates ColumnStatistics of Glue of the partition and returns errors of the columns."""
+        errors: List[dict] = []
+        for chunk in _chunks(column_statistics, UpdateColumnStatisticsLimit):
+            args = {
+                'DatabaseName': db,
+                'TableName': table_name,
+                'PartitionValues': partition_values,
+                'ColumnStatisticsList': chunk,
+            }
+            if self.catalog_id:
+                args['CatalogId'] = self.catalog_id
+            r = self.get_conn().update_column_statistics_for_partition(**args)
+            errors.extend({
+                'column': e['ColumnStatistics']['ColumnName'],
+                'error': f"{e['Error'].get('ErrorCode')}: {e['Error'].get('ErrorMessage')}",
+            } for e in r.get('Errors', []))
+        return errors
+
     def convert_table_to_partition(
             self,
             src_db: str, src_table: str,
             dst_db: str, dst_table: str,
-            partition_values: List[str]):
+            partition_values: List[str],
+            replace: bool = False,
+            parameters: Dict[str, str] = None):
+        """Registers the location of the source table as the partition, and deletes the source table.
+
+        If `replace`, the existing partition is switched to the location by one UpdatePartition,
+        so readers never see the partition missing. `parameters` are set to the partition parameters.
+        """
+        # NOTE: The source table may be modified by Presto after the snapshot is taken.
+        self.invalidate_table(db=src_db, name=src_table)
         sd = self.get_table(db=src_db, name=src_table)['StorageDescriptor']
         args = {
             'DatabaseName': dst_db,
@@ -179,47 +830,445 @@ class GlueDataCatalogHook(AwsHook):
             'PartitionInput': {
                 'Values': partition_values,
                 'StorageDescriptor': sd,
+                'Parameters': parameters or {},
             }
         }
         if self.catalog_id:
             args['CatalogId'] = self.catalog_id
-        self.get_conn().create_partition(**args)
+        if replace:
+            args['PartitionValueList'] = partition_values
+            self.get_conn().update_partition(**args)
+        else:
+            self.get_conn().create_partition(**args)
         self.delete_table(db=src_db, name=src_table)
 
 
+class PartitionIndex(object):
+    """Shares GetPartitions calls among waiters for partitions of the same table.
+
+    Waiters register the partition values that they wait for, and a lookup that finds the index expired
+    or missing its values fetches the partitions of all registered waiters at once. The result is served
+    for `ttl` seconds. The index lives in the process, or in a file under `index_dir` to be shared among
+    processes on the same host, e.g. sensors in `reschedule` mode.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._table_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._tables: Dict[str, dict] = {}
+
+    @staticmethod
+    def _new_state() -> dict:
+        return {'waiters': {}, 'fetched_at': 0, 'covered': [], 'existing': []}
+
+    @contextmanager
+    def _state(self, key: str, index_dir: str = None):
+        with self._lock:
+            table_lock = self._table_locks[key]
+        with table_lock:
+            if not index_dir:
+                yield self._tables.setdefault(key, self._new_state())
+                return
+            path = os.path.join(index_dir, f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.json")
+            # NOTE: Hold the lock while fetching so that the other processes wait for the result.
+            with _locked_json_file(path, self._new_state()) as state:
+                yield state
+
+    @staticmethod
+    def _key(glue: GlueDataCatalogHook, db: str, table_name: str) -> str:
+        return json.dumps([glue.catalog_id, glue.region_name, db, table_name])
+
+    def lookup(self, glue: GlueDataCatalogHook, db: str, table_name: str, partition_values_list: List[List[str]],
+               ttl: float = 60, waiter_ttl: float = 600, index_dir: str = None) -> List[bool]:
+        """Returns whether each partition in `partition_values_list` exists.
+
+        The partitions are registered as waiters for `waiter_ttl` seconds, so the lookups of the other
+        waiters fetch them together.
+        """
+        with self._state(self._key(glue, db, table_name), index_dir) as state:
+            now = time.time()
+            for values in partition_values_list:
+                state['waiters'][json.dumps(list(values))] = now + waiter_ttl
+            state['waiters'] = {w: e for w, e in state['waiters'].items() if e > now}
+            covered = set(tuple(v) for v in state['covered'])
+            if now - state['fetched_at'] > ttl or any(tuple(v) not in covered for v in partition_values_list):
+                waiters = [json.loads(w) for w in state['waiters']]
+                logging.info(f"Fetch partitions of {len(waiters)} waiters for Table[{db}.{table_name}].")
+                partitions = glue.get_partitions_by_values(db=db, table_name=table_name,
+                                                           partition_values_list=waiters)
+                state['existing'] = [p['Values'] for p in partitions]
+                state['covered'] = waiters
+                state['fetched_at'] = now
+            existing = set(tuple(v) for v in state['existing'])
+            return [tuple(v) in existing for v in partition_values_list]
+
+    def unregister(self, glue: GlueDataCatalogHook, db: str, table_name: str,
+                   partition_values_list: List[List[str]], index_dir: str = None) -> None:
+        with self._state(self._key(glue, db, table_name), index_dir) as state:
+            for values in partition_values_list:
+                state['waiters'].pop(json.dumps(list(values)), None)
+
+
+partition_index = PartitionIndex()
+
+
+class S3DeletionSummary(NamedTuple):
+    deleted_count: int
+    deleted_bytes: int
+    elapsed_seconds: float
+
+    def __str__(self):
+        elapsed = max(self.elapsed_seconds, 1e-6)
+        return f"{self.deleted_count} objects ({self.deleted_bytes} bytes) in {self.elapsed_seconds:.1f}s" \
+            f" ({self.deleted_count / elapsed:.1f} objects/s, {self.deleted_bytes / elapsed / 1024 / 1024:.1f} MiB/s)"
+
+
+class S3ObjectsSummary(NamedTuple):
+    file_count: int
+    total_bytes: int
+    newest_last_modified: datetime
+
+    def __str__(self):
+        return f"{self.file_count} objects ({self.total_bytes} bytes), the newest is at {self.newest_last_modified}"
+
+    def to_dict(self) -> dict:
+        return {
+            'file_count': self.file_count,
+            'total_bytes': self.total_bytes,
+            'newest_last_modified': self.newest_last_modified.isoformat() if self.newest_last_modified else None,
+        }
+
+
+class S3Hook(S3Hook):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.conn = None
+        self._conn_expires_at: float = None
+        self._conn_lock = threading.Lock()
+
+    def get_conn(self):
+        with self._conn_lock:
+            if self.conn and self._conn_expires_at and time.monotonic() >= self._conn_expires_at:
+                logging.info("Rebuild the S3 client before the credentials of the assumed role expire.")
+                self.conn = None
+            if not self.conn:
+                extras = _aws_conn_extras(self)
+                self.conn = self.get_client_type('s3')
+                self.conn.meta.events.register('before-call', _count_boto_call)
+                _register_throttling_handlers(self.conn, extras)
+                self._conn_expires_at = _client_expires_at(extras)
+                hook_registry.count_created_client('s3')
+        return self.conn
+
+    def iter_objects(self, bucket_name: str, prefix: str, delimiter: str = '') -> Iterator[dict]:
+        """Yields objects of ListObjectsV2 page by page."""
+        paginator = self.get_conn().get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter=delimiter):
+            for obj in page.get('Contents', []):
+                yield obj
+
+    def iter_prefixes(self, bucket_name: str, prefix: str, delimiter: str = '/',
+                      start_after: str = None) -> Iterator[str]:
+        """Yields common prefixes just under the prefix of ListObjectsV2 page by page."""
+        args = {
+            'Bucket': bucket_name,
+            'Prefix': prefix,
+            'Delimiter': delimiter,
+        }
+        if start_after:
+            args['StartAfter'] = start_after
+        paginator = self.get_conn().get_paginator('list_objects_v2')
+        for page in paginator.paginate(**args):
+            for p in page.get('CommonPrefixes', []):
+                yield p['Prefix']
+
+    def summarize_objects(self, bucket_name: str, prefix: str, delimiter: str = '',
+                          obj_filter=lambda obj: True) -> S3ObjectsSummary:
+        """Summarizes objects that `obj_filter` accepts only from the listing (without HEAD requests)."""
+        file_count = 0
+        total_bytes = 0
+        newest_last_modified = None
+        for obj in self.iter_objects(bucket_name=bucket_name, prefix=prefix, delimiter=delimiter):
+            if not obj_filter(obj):
+                logging.debug(f"Skip a Object[s3://{bucket_name}/{obj['Key']}"
+                              f", last_modified:{obj['LastModified']}, length:{obj['Size']}].")
+                continue
+            file_count += 1
+            total_bytes += obj['Size']
+            if not newest_last_modified or newest_last_modified < obj['LastModified']:
+                newest_last_modified = obj['LastModified']
+        return S3ObjectsSummary(file_count=file_count,
+                                total_bytes=total_bytes,
+                                newest_last_modified=newest_last_modified)
+
+    def _delete_batch(self, bucket_name: str, objects: List[dict]) -> Tuple[int, int]:
+        r = self.get_conn().delete_objects(Bucket=bucket_name,
+                                           Delete={
+                                               'Objects': [{'Key': obj['Key']} for obj in objects],
+                                               'Quiet': True,
+                                           })
+        errors = r.get('Errors', [])
+        if errors:
+            raise S3Error(f"Failed to delete {len(errors)} objects in s3://{bucket_name}/: "
+                          f"{[(e['Key'], e['Code']) for e in errors[:10]]}")
+        return len(objects), sum(obj.get('Size', 0) for obj in objects)
+
+    def delete_prefix(self, bucket_name: str, prefix: str, concurrency: int = 8,
+                      delimiter: str = '') -> S3DeletionSummary:
+        """Deletes all objects under the prefix including nested prefixes unless `delimiter` is given.
+
+        Keys are streamed from the paginated listing and deleted in batches of DeleteObjects
+        by `concurrency` workers, so the memory usage does not depend on the number of objects.
+        """
+        started_at = time.monotonic()
+        deleted_count = 0
+        deleted_bytes = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            in_flight = set()
+            batch: List[dict] = []
+
+            def collect(futures):
+                nonlocal deleted_count, deleted_bytes
+                for f in futures:
+                    count, size = f.result()
+                    deleted_count += count
+                    deleted_bytes += size
+
+            for obj in self.iter_objects(bucket_name=bucket_name, prefix=prefix, delimiter=delimiter):
+                batch.append(obj)
+                if len(batch) < DeleteObjectsLimit:
+                    continue
+                in_flight.add(executor.submit(bind_run_scope(self._delete_batch), bucket_name, batch))
+                batch = []
+                if len(in_flight) >= concurrency * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+            if batch:
+                in_flight.add(executor.submit(bind_run_scope(self._delete_batch), bucket_name, batch))
+            collect(wait(in_flight).done)
+        return S3DeletionSummary(deleted_count=deleted_count,
+                                 deleted_bytes=deleted_bytes,
+                                 elapsed_seconds=time.monotonic() - started_at)
+
+
+class PrestoQueryProgress(NamedTuple):
+    query_id: str
+    state: str
+    completed_splits: int
+    total_splits: int
+    processed_rows: int
+    processed_bytes: int
+    cpu_time_millis: int
+    peak_memory_bytes: int
+
+    @classmethod
+    def from_stats(cls, stats: dict) -> 'PrestoQueryProgress':
+        """Builds the progress from `stats` of the client protocol."""
+        return cls(query_id=stats.get('queryId'),
+                   state=stats.get('state'),
+                   completed_splits=stats.get('completedSplits', 0),
+                   total_splits=stats.get('totalSplits', 0),
+                   processed_rows=stats.get('processedRows', 0),
+                   processed_bytes=stats.get('processedBytes', 0),
+                   cpu_time_millis=stats.get('cpuTimeMillis', 0),
+                   peak_memory_bytes=stats.get('peakMemoryBytes', 0))
+
+    def __str__(self):
+        return f"Query[{self.query_id}] {self.state}: splits {self.completed_splits}/{self.total_splits}" \
+            f", processed {self.processed_rows} rows ({self.processed_bytes} bytes)" \
+            f", cpu {self.cpu_time_millis}ms, peak memory {self.peak_memory_bytes} bytes"
+
+
+class _CsvExportWriter(object):
+    extension = 'csv.gz'
+
+    def __init__(self, path: str, columns: List[dict]):
+        self.rows = 0
+        self._file = gzip.open(path, 'wt', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([c['name'] for c in columns])
+
+    def write(self, batch: List[tuple]) -> None:
+        self._writer.writerows(batch)
+        self.rows += len(batch)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _ParquetExportWriter(object):
+    extension = 'parquet'
+
+    def __init__(self, path: str, columns: List[dict]):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise PrestoError("pyarrow is required to export the results as parquet.")
+        self._pa = pyarrow
+        self.rows = 0
+        fields = []
+        self._stringified: List[bool] = []
+        for c in columns:
+            type_name = ParquetTypes.get(re.sub(r'\(.*\)$', '', c['type'].lower()))
+            fields.append(pyarrow.field(c['name'], getattr(pyarrow, type_name or 'string')()))
+            self._stringified.append(type_name is None)
+        self._schema = pyarrow.schema(fields)
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+
+    def write(self, batch: List[tuple]) -> None:
+        arrays = []
+        for i, field in enumerate(self._schema):
+            values = [r[i] for r in batch]
+            if self._stringified[i]:
+                values = [None if v is None else str(v) for v in values]
+            arrays.append(self._pa.array(values, type=field.type))
+        self._writer.write_table(self._pa.Table.from_arrays(arrays, schema=self._schema))
+        self.rows += len(batch)
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+class PrestoClusterStats(NamedTuple):
+    running_queries: int
+    blocked_queries: int
+    queued_queries: int
+    active_workers: int
+
+    @classmethod
+    def from_cluster(cls, cluster: dict) -> 'PrestoClusterStats':
+        """Builds the stats from the response of `/v1/cluster` of the coordinator."""
+        return cls(running_queries=cluster.get('runningQueries', 0),
+                   blocked_queries=cluster.get('blockedQueries', 0),
+                   queued_queries=cluster.get('queuedQueries', 0),
+                   active_workers=cluster.get('activeWorkers', 0))
+
+    @property
+    def load(self) -> float:
+        """Returns the running and queued queries per active worker."""
+        return (self.running_queries + self.queued_queries) / max(1, self.active_workers)
+
+    def __str__(self):
+        return f"{self.running_queries} running, {self.blocked_queries} blocked and {self.queued_queries} queued" \
+            f" queries on {self.active_workers} workers"
+
+
 class PrestoHook(PrestoHook):
-    def __init__(self, query_header_comment='', *args, **kwargs):
+    def __init__(self, query_header_comment='', session_properties: Dict[str, str] = None,
+                 client_tags: List[str] = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.query_header_comment = query_header_comment
+        self.session_properties = session_properties or {}
+        self.client_tags = client_tags or []
+        self._connection = None
+        self._session: requests.Session = None
+        self._pool: queue.LifoQueue = None
+        self._lock = threading.RLock()
 
-    def get_conn(self):
-        """Returns a connection object"""
-        db = self.get_connection(self.presto_conn_id)
-        user = db.login
+    def _get_presto_connection(self):
+        # NOTE: Avoid looking up the airflow metadata DB for every query.
+        with self._lock:
+            if not self._connection:
+                self._connection = self.get_connection(self.presto_conn_id)
+        return self._connection
+
+    def _get_extra(self, name: str, default=None):
+        return self._get_presto_connection().extra_dejson.get(name, default)
+
+    @property
+    def catalog(self) -> str:
+        """Returns the catalog of the connection that the queries run on."""
+        return self._get_extra('catalog', 'hive')
+
+    def _get_pool_size(self) -> int:
+        return int(self._get_extra('pool_size', DefaultPrestoPoolSize))
+
+    def _get_request_timeout(self) -> float:
+        return float(self._get_extra('request_timeout', prestodb.constants.DEFAULT_REQUEST_TIMEOUT))
+
+    def _get_user(self) -> str:
+        user = self._get_presto_connection().login
         if not user:
             user = "airflow"
+        return user
+
+    def _client_tags_headers(self) -> Dict[str, str]:
+        if not self.client_tags:
+            return {}
+        return {'X-Presto-Client-Tags': ','.join(self.client_tags)}
+
+    def get_conn(self):
+        """Returns a connection object"""
+        db = self._get_presto_connection()
+        hook_registry.count_created_client('presto')
         return prestodb.dbapi.connect(
             host=db.host,
             port=db.port,
-            user=user,
+            user=self._get_user(),
             source=db.extra_dejson.get('source', 'airflow'),
             http_scheme=db.extra_dejson.get('http_scheme', 'http'),
-            catalog=db.extra_dejson.get('catalog', 'hive'),
+            catalog=self.catalog,
             schema=db.schema,
-            max_attempts=db.extra_dejson.get('max_attempts', prestodb.constants.DEFAULT_MAX_ATTEMPTS),
-            request_timeout=db.extra_dejson.get('max_attempts', prestodb.constants.DEFAULT_REQUEST_TIMEOUT), )
+            session_properties=dict(self.session_properties),
+            http_headers=self._client_tags_headers(),
+            max_attempts=int(db.extra_dejson.get('max_attempts', prestodb.constants.DEFAULT_MAX_ATTEMPTS)),
+            request_timeout=self._get_request_timeout(), )
+
+    @contextmanager
+    def _pooled_conn(self):
+        """Borrows a connection from the pool that keeps its HTTP session alive among queries.
+
+        Connections are created when the pool is empty and closed with their HTTP sessions when the pool
+        is full, so the pool holds at most `pool_size` idle connections in the extras of the connection.
+        """
+        with self._lock:
+            if not self._pool:
+                self._pool = queue.LifoQueue(maxsize=self._get_pool_size())
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self.get_conn()
+        try:
+            yield conn
+        except BaseException:
+            # NOTE: Do not reuse a connection that may be in an unknown state.
+            self._close_conn(conn)
+            raise
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            self._close_conn(conn)
+
+    @staticmethod
+    def _close_conn(conn) -> None:
+        conn.close()
+        # NOTE: `Connection.close()` of presto-python-client does nothing, so close its HTTP session explicitly.
+        http_session = getattr(conn, '_http_session', None)
+        if http_session:
+            http_session.close()
+
+    def close(self) -> None:
+        """Closes the pooled connections with their HTTP sessions and the HTTP session of the REST calls."""
+        with self._lock:
+            while self._pool and not self._pool.empty():
+                self._close_conn(self._pool.get_nowait())
+            if self._session:
+                self._session.close()
+                self._session = None
 
     def _with_header_comment(self, hql):
         return f"{self.query_header_comment}\n\n{hql}"
 
     def get_records(self, hql, parameters=None):
+        call_counter.count('presto.get_records')
         hql = self._with_header_comment(hql)
         logging.info(hql)
         hql = self._strip_sql(hql)
         if sys.version_info[0] < 3:
             hql = hql.encode('utf-8')
 
-        with closing(self.get_conn()) as conn:
+        with self._pooled_conn() as conn:
             cur = conn.cursor()
             if parameters is not None:
                 cur.execute(hql, parameters)
@@ -227,20 +1276,312 @@ class PrestoHook(PrestoHook):
                 cur.execute(hql)
             return cur.fetchall()
 
-    def get_first(self, hql, parameters=None):
+    def iter_batches(self, hql, parameters=None, batch_size: int = DefaultPrestoBatchSize) -> Iterator[List[tuple]]:
+        """Yields the rows of the query in lists of `batch_size` rows as the result pages arrive.
+
+        Only one batch and one result page are held in memory. The query is cancelled if the iteration stops
+        before the end of the results.
+        """
+        for batch, _ in self._iter_batches_n_columns(hql, parameters, batch_size):
+            yield batch
+
+    def iter_records(self, hql, parameters=None, batch_size: int = DefaultPrestoBatchSize) -> Iterator[tuple]:
+        """Yields the rows of the query one by one as the result pages arrive."""
+        for batch in self.iter_batches(hql, parameters, batch_size):
+            yield from batch
+
+    def _iter_batches_n_columns(self, hql, parameters=None,
+                                batch_size: int = DefaultPrestoBatchSize) -> Iterator[Tuple[List[tuple], List[dict]]]:
+        call_counter.count('presto.iter_batches')
+        hql = self._with_header_comment(hql)
+        logging.info(hql)
+        hql = self._strip_sql(hql)
+
+        with self._pooled_conn() as conn:
+            cur = conn.cursor()
+            if parameters is not None:
+                cur.execute(hql, parameters)
+            else:
+                cur.execute(hql)
+            finished = False
+            try:
+                while True:
+                    batch = cur.fetchmany(batch_size)
+                    if not batch:
+                        finished = True
+                        return
+                    # NOTE: The description is available after the first page of the results is fetched.
+                    yield batch, [{'name': d[0], 'type': d[1]} for d in cur.description or []]
+            finally:
+                if not finished:
+                    try:
+                        cur.cancel()
+                    except Exception:
+                        logging.exception("Failed to cancel the query.")
+
+    def export(self, hql, path_prefix: str, fmt: str = CsvExportFormat, parameters=None,
+               rows_per_file: int = DefaultExportRowsPerFile, batch_size: int = DefaultPrestoBatchSize) -> List[str]:
+        """Streams the result of the query to local files `<path_prefix>-<5 digits>.csv.gz` or `.parquet`,
+        and returns their paths.
+
+        A file is switched to the next one when it has `rows_per_file` rows, and the rows are written by
+        `batch_size` rows, so the memory usage does not depend on the size of the result. `parquet` requires
+        pyarrow.
+        """
+        if fmt not in AvailableExportFormats:
+            raise PrestoError(f"Export format[{fmt}] is unsupported. Supported formats are {AvailableExportFormats}.")
+        writer_class = _CsvExportWriter if fmt == CsvExportFormat else _ParquetExportWriter
+        paths: List[str] = []
+        writer = None
+        rows = 0
+        try:
+            for batch, columns in self._iter_batches_n_columns(hql, parameters, batch_size):
+                while batch:
+                    if writer is None:
+                        paths.append(f"{path_prefix}-{len(paths):05d}.{writer_class.extension}")
+                        writer = writer_class(paths[-1], columns)
+                    n = min(len(batch), rows_per_file - writer.rows)
+                    writer.write(batch[:n])
+                    batch = batch[n:]
+                    rows += n
+                    if writer.rows >= rows_per_file:
+                        writer.close()
+                        writer = None
+        finally:
+            if writer is not None:
+                writer.close()
+        logging.info(f"Exported {rows} rows to {len(paths)} files: {paths}")
+        return paths
+
+    def _get_first_n_stats(self, hql, parameters=None,
+                           progress_callback=None, progress_interval: float = 30) -> Tuple[tuple, dict]:
+        call_counter.count('presto.get_first')
         hql = self._with_header_comment(hql)
         logging.info(hql)
         hql = self._strip_sql(hql)
         if sys.version_info[0] < 3:
             hql = hql.encode('utf-8')
 
-        with closing(self.get_conn()) as conn:
+        with self._pooled_conn() as conn:
             cur = conn.cursor()
             if parameters is not None:
                 cur.execute(hql, parameters)
             else:
                 cur.execute(hql)
-            return cur.fetchone()
+            if not progress_callback:
+                return cur.fetchone(), dict(cur.stats or {})
+
+            # NOTE: `cur.stats` is updated while `fetchone` follows the results, so read it from another thread.
+            finished = threading.Event()
+
+            def report():
+                while not finished.wait(progress_interval):
+                    try:
+                        progress_callback(PrestoQueryProgress.from_stats(cur.stats or {}))
+                    except Exception:
+                        logging.exception("Failed to report the query progress.")
+
+            reporter = threading.Thread(target=report, daemon=True)
+            reporter.start()
+            try:
+                row = cur.fetchone()
+            finally:
+                finished.set()
+                reporter.join()
+            stats = dict(cur.stats or {})
+            progress_callback(PrestoQueryProgress.from_stats(stats))
+            return row, stats
+
+    def get_first(self, hql, parameters=None):
+        return self._get_first_n_stats(hql, parameters)[0]
+
+    def get_result_columns(self, hql) -> List[Dict[str, str]]:
+        """Returns the names and the types of the result columns without reading any rows."""
+        call_counter.count('presto.get_result_columns')
+        # NOTE: Wrap with newlines, or a trailing `--` comment of `hql` comments out the closing parenthesis.
+        hql = f"SELECT * FROM (\n{hql.strip().rstrip(';')}\n) LIMIT 0"
+        hql = self._with_header_comment(hql)
+        logging.info(hql)
+        hql = self._strip_sql(hql)
+
+        with self._pooled_conn() as conn:
+            cur = conn.cursor()
+            cur.execute(hql)
+            cur.fetchall()
+            if not cur.description:
+                raise PrestoError(f"No columns are returned: {hql}")
+            return [{'name': d[0], 'type': d[1]} for d in cur.description]
+
+    def _explain_io(self, hql) -> dict:
+        row = self.get_first(f"EXPLAIN (TYPE IO, FORMAT JSON) {hql.strip().rstrip(';')}")
+        return json.loads(row[0]) if row else {}
+
+    @staticmethod
+    def _estimated_size(estimate: dict) -> float:
+        size = estimate.get('outputSizeInBytes')
+        # NOTE: Presto returns NaN when the statistics are unavailable.
+        if not isinstance(size, (int, float)) or size != size:
+            return None
+        return size
+
+    def estimate_output_bytes(self, hql) -> float:
+        """Returns the estimated output bytes of the query by `EXPLAIN (TYPE IO, FORMAT JSON)`, or None if unknown."""
+        return self._estimated_size(self._explain_io(hql).get('estimate', {}))
+
+    def estimate_input_bytes(self, hql) -> float:
+        """Returns the estimated bytes that the query reads from the input tables, or None if unknown.
+
+        NOTE: Old Presto versions do not estimate the input tables, and then this returns None.
+        """
+        infos = self._explain_io(hql).get('inputTableColumnInfos', [])
+        sizes = [self._estimated_size(i.get('estimate', {})) for i in infos]
+        if not sizes or None in sizes:
+            return None
+        return sum(sizes)
+
+    def get_first_with_query_id(self, hql, parameters=None,
+                                progress_callback=None, progress_interval: float = 30) -> Tuple[tuple, str]:
+        """Returns the first row and the query id.
+
+        `progress_callback` is called with `PrestoQueryProgress` every `progress_interval` seconds
+        while the query runs, and once when the first row is returned.
+        """
+        row, stats = self._get_first_n_stats(hql, parameters,
+                                             progress_callback=progress_callback,
+                                             progress_interval=progress_interval)
+        return row, stats.get('queryId')
+
+    def _http_session(self) -> requests.Session:
+        with self._lock:
+            if not self._session:
+                pool_size = self._get_pool_size()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                self._session = requests.Session()
+                self._session.mount('http://', adapter)
+                self._session.mount('https://', adapter)
+        return self._session
+
+    def _coordinator_url(self, path: str) -> str:
+        db = self._get_presto_connection()
+        return f"{db.extra_dejson.get('http_scheme', 'http')}://{db.host}:{db.port}{path}"
+
+    def _statement_headers(self) -> Dict[str, str]:
+        db = self._get_presto_connection()
+        headers = {
+            'X-Presto-User': self._get_user(),
+            'X-Presto-Source': db.extra_dejson.get('source', 'airflow'),
+            'X-Presto-Catalog': db.extra_dejson.get('catalog', 'hive'),
+        }
+        if db.schema:
+            headers['X-Presto-Schema'] = db.schema
+        if self.session_properties:
+            headers['X-Presto-Session'] = ','.join(f"{k}={quote(str(v))}" for k, v in self.session_properties.items())
+        headers.update(self._client_tags_headers())
+        return headers
+
+    @staticmethod
+    def _raise_for_query_error(body: dict) -> None:
+        if 'error' in body:
+            error = body['error']
+            raise PrestoError(f"Query[{body.get('id')}] failed: {error.get('errorName')}: {error.get('message')}")
+
+    def submit(self, hql) -> Dict[str, str]:
+        """Submits the query and returns its id and next uri without waiting for the completion."""
+        call_counter.count('presto.submit')
+        hql = self._with_header_comment(hql)
+        logging.info(hql)
+        hql = self._strip_sql(hql)
+        r = self._http_session().post(self._coordinator_url('/v1/statement'),
+                                      data=hql.encode('utf-8'),
+                                      headers=self._statement_headers(),
+                                      timeout=self._get_request_timeout())
+        r.raise_for_status()
+        body = r.json()
+        self._raise_for_query_error(body)
+        logging.info(f"Query[{body['id']}] is submitted: {body.get('infoUri')}")
+        return {
+            'query_id': body['id'],
+            'next_uri': body.get('nextUri'),
+        }
+
+    def poll(self, next_uri: str, timeout: float) -> dict:
+        """Follows `next_uri` of a submitted query until it finishes or `timeout` seconds pass.
+
+        Fetching `next_uri` also tells the coordinator that the client is alive, so this must be called
+        more frequently than `query.client.timeout` of the cluster not to abandon the query.
+        Unavailable responses of the coordinator are retried up to `max_attempts` in the connection extras.
+        """
+        deadline = time.monotonic() + timeout
+        max_attempts = int(self._get_extra('max_attempts', prestodb.constants.DEFAULT_MAX_ATTEMPTS))
+        failures = 0
+        rows: List[list] = []
+        stats: dict = {}
+        # NOTE: Drain the rest of the results once rows arrive not to lose them.
+        while next_uri and (rows or time.monotonic() < deadline):
+            call_counter.count('presto.poll')
+            r = self._http_session().get(next_uri,
+                                         headers=self._statement_headers(),
+                                         timeout=self._get_request_timeout())
+            if r.status_code in (502, 503, 504):
+                failures += 1
+                if failures >= max_attempts:
+                    raise PrestoError(f"The coordinator responded {r.status_code} to {next_uri}"
+                                      f" {failures} times in a row.")
+                time.sleep(min(PollMaxBackoffSeconds, PollBaseBackoffSeconds * 2 ** (failures - 1)))
+                continue
+            failures = 0
+            r.raise_for_status()
+            body = r.json()
+            self._raise_for_query_error(body)
+            rows.extend(body.get('data', []))
+            stats = body.get('stats', stats)
+            next_uri = body.get('nextUri')
+        return {
+            'finished': next_uri is None,
+            'next_uri': next_uri,
+            'rows': rows,
+            'stats': stats,
+        }
+
+    def get_cluster_stats(self) -> PrestoClusterStats:
+        """Returns the queries and the workers of the cluster from `/v1/cluster` of the coordinator."""
+        call_counter.count('presto.get_cluster_stats')
+        r = self._http_session().get(self._coordinator_url('/v1/cluster'),
+                                     headers={'X-Presto-User': self._get_user()},
+                                     timeout=self._get_request_timeout())
+        r.raise_for_status()
+        return PrestoClusterStats.from_cluster(r.json())
+
+    def get_query_info(self, query_id: str) -> dict:
+        """Returns the query info from `/v1/query/{query_id}` of the coordinator."""
+        call_counter.count('presto.get_query_info')
+        r = self._http_session().get(self._coordinator_url(f"/v1/query/{query_id}"),
+                                     headers={'X-Presto-User': self._get_user()},
+                                     timeout=self._get_request_timeout())
+        r.raise_for_status()
+        return r.json()
+
+    def get_write_stats(self, query_id: str) -> dict:
+        """Returns the state, output rows, written rows and written bytes of the query.
+
+        NOTE: The stats names differ among Presto versions, so a missing stat is None.
+        """
+        info = self.get_query_info(query_id)
+        stats = info.get('queryStats', {})
+
+        def first_present(*names):
+            for n in names:
+                if n in stats:
+                    return stats[n]
+            return None
+
+        return {
+            'state': info.get('state'),
+            'output_rows': first_present('outputPositions'),
+            'written_rows': first_present('writtenOutputPositions', 'writtenPositions'),
+            'written_bytes': _parse_data_size(first_present('writtenOutputPhysicalDataSize',
+                                                            'physicalWrittenDataSize')),
+        }
 
 
 class Error(Exception):
@@ -253,3 +1594,7 @@ class GlueDataCatalogError(Error):
 
 class PrestoError(Error):
     pass
+
+
+class S3Error(Error):
+    pass
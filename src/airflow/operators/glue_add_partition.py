@@ -1,11 +1,15 @@
 import logging
 import re
-from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
 
-from airflow.hooks.S3_hook import S3Hook
 from airflow.models import BaseOperator
 
 from airflow.hooks.glue_presto_apas import GlueDataCatalogHook
+from airflow.hooks.glue_presto_apas import RunMetrics
+from airflow.hooks.glue_presto_apas import S3Hook
+from airflow.hooks.glue_presto_apas import bind_run_scope
+from airflow.hooks.glue_presto_apas import hook_registry
 
 OverwriteMode = "overwrite"
 ErrorIfExistsMode = "error_if_exists"
@@ -17,6 +21,8 @@ AvailableModes = [
     SkipIfExistsMode,
 ]
 
+BatchLocationCheckConcurrency = 16
+
 
 class GlueAddPartitionOperator(BaseOperator):
     template_fields = [
@@ -24,6 +30,7 @@ class GlueAddPartitionOperator(BaseOperator):
         'table',
         'partition_keys',
         'partition_values',
+        'partition_kvs',
         'location',
     ]
 
@@ -31,7 +38,8 @@ class GlueAddPartitionOperator(BaseOperator):
             self,
             db: str,
             table: str,
-            partition_kv: Dict[str, str],
+            partition_kv: Dict[str, str] = None,
+            partition_kvs: List[Dict[str, str]] = None,
             location: str = None,
             mode: str = 'overwrite',
             follow_location: bool = True,
@@ -45,66 +53,81 @@ class GlueAddPartitionOperator(BaseOperator):
         self.db = db
         self.table = table
         self.location = location
-        self.partition_keys = list(partition_kv.keys())
-        self.partition_values = list(partition_kv.values())
+        self.partition_keys = list(partition_kv.keys()) if partition_kv else []
+        self.partition_values = list(partition_kv.values()) if partition_kv else []
+        self.partition_kvs = partition_kvs
         self.mode = mode
         self.follow_location = follow_location
         self.catalog_id = catalog_id
         self.catalog_region_name = catalog_region_name
         self.presto_conn_id = presto_conn_id
         self.aws_conn_id = aws_conn_id
+        self._metrics: RunMetrics = None
 
         if mode not in AvailableModes:
             raise ConfigError(f"Save mode[{mode}] is unsupported."
                               f" Supported save modes are {AvailableModes}.")
+        if (partition_kv is None) == (partition_kvs is None):
+            raise ConfigError("Either 'partition_kv' or 'partition_kvs' must be set.")
+        if partition_kvs is not None and location:
+            raise ConfigError("'location' cannot be set with 'partition_kvs'.")
 
     def _glue_data_catalog_hook(self) -> GlueDataCatalogHook:
-        return GlueDataCatalogHook(aws_conn_id=self.aws_conn_id,
-                                   catalog_id=self.catalog_id,
-                                   region_name=self.catalog_region_name)
+        return hook_registry.get_hook(GlueDataCatalogHook,
+                                      aws_conn_id=self.aws_conn_id,
+                                      catalog_id=self.catalog_id,
+                                      region_name=self.catalog_region_name)
 
     def _s3_hook(self) -> S3Hook:
-        return S3Hook(aws_conn_id=self.aws_conn_id)
+        return hook_registry.get_hook(S3Hook, aws_conn_id=self.aws_conn_id)
+
+    def _partition_kv(self, partition_kv: Dict[str, str] = None) -> Dict[str, str]:
+        if partition_kv is not None:
+            return partition_kv
+        return dict(zip(self.partition_keys, self.partition_values))
 
-    def _is_sufficient_partition_kv(self) -> bool:
+    def _is_sufficient_partition_kv(self, partition_kv: Dict[str, str] = None) -> bool:
         glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        partition_keys = list(self._partition_kv(partition_kv).keys())
         glue_pks = glue.get_partition_keys(db=self.db, name=self.table)
-        if len(glue_pks) != len(self.partition_keys):
+        if len(glue_pks) != len(partition_keys):
             logging.error(f"partition_kv must includes keys[{glue_pks}]")
             return False
         for pk in glue_pks:
-            if pk not in self.partition_keys:
+            if pk not in partition_keys:
                 logging.error(f"Partition keys in Glue{glue_pks}")
                 return False
         return True
 
-    def _get_ordered_partition_kv(self):
+    def _get_ordered_partition_kv(self, partition_kv: Dict[str, str] = None):
         glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        partition_kv = self._partition_kv(partition_kv)
         ordered_partition_values = []
         for pk in glue.get_partition_keys(db=self.db, name=self.table):
             ordered_partition_values.append({
                 'key': pk,
-                'value': self.partition_values[self.partition_keys.index(pk)],
+                'value': partition_kv[pk],
             })
         return ordered_partition_values
 
-    def _gen_partition_location(self):
+    def _gen_partition_location(self, partition_kv: Dict[str, str] = None):
         glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
         table_location = glue.get_table_location(db=self.db, name=self.table)
         if not table_location.endswith('/'):
             table_location = table_location + '/'
 
         partition_elems: List[str] = []
-        for h in self._get_ordered_partition_kv():
+        for h in self._get_ordered_partition_kv(partition_kv):
             partition_elems.append(f"{h['key']}={h['value']}")
 
         return table_location + '/'.join(partition_elems)
 
-    def _does_location_exists(self):
+    def _does_location_exists(self, location: str = None):
         s3: S3Hook = self._s3_hook()
-        if not self.location:
+        location = location or self.location
+        if not location:
             raise ConfigError(f"'location' is not set")
-        bucket, prefix = self._extract_s3_uri(self.location)
+        bucket, prefix = self._extract_s3_uri(location)
         return s3.check_for_prefix(bucket_name=bucket, prefix=prefix, delimiter='/')
 
     @staticmethod
@@ -117,22 +140,39 @@ class GlueAddPartitionOperator(BaseOperator):
         return bucket, prefix
 
     def pre_execute(self, context):
-        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
-
-        if not glue.does_database_exists(name=self.db):
-            raise ConfigError(f"DB[{self.db}] does not exist.")
-        if not glue.does_table_exists(db=self.db, name=self.table):
-            raise ConfigError(f"Table[{self.db}.{self.table}] does not exist.")
-        if not glue.get_partition_keys(db=self.db, name=self.table):
-            raise ConfigError(f"Table[{self.db}.{self.table}] does not have partition keys.")
-        if not self._is_sufficient_partition_kv():
-            raise ConfigError(f"partition keys{self.partition_keys} and partition values{self.partition_values} are insufficient.")
-        if not self.location:
-            self.location = self._gen_partition_location()
-        if not self.location.endswith('/'):
-            self.location = self.location + '/'
+        self._metrics = RunMetrics()
+        with self._metrics.phase('validation'):
+            glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+            glue.clear_snapshots()
+            if not glue.does_database_exists(name=self.db):
+                raise ConfigError(f"DB[{self.db}] does not exist.")
+            if not glue.does_table_exists(db=self.db, name=self.table):
+                raise ConfigError(f"Table[{self.db}.{self.table}] does not exist.")
+            if not glue.get_partition_keys(db=self.db, name=self.table):
+                raise ConfigError(f"Table[{self.db}.{self.table}] does not have partition keys.")
+            if self.partition_kvs is not None:
+                for kv in self.partition_kvs:
+                    if not self._is_sufficient_partition_kv(kv):
+                        raise ConfigError(f"partition_kv{kv} is insufficient.")
+                return
+            if not self._is_sufficient_partition_kv():
+                raise ConfigError(f"partition keys{self.partition_keys} and partition values{self.partition_values} are insufficient.")
+            if not self.location:
+                self.location = self._gen_partition_location()
+            if not self.location.endswith('/'):
+                self.location = self.location + '/'
 
     def execute(self, context):
+        try:
+            return self._execute(context)
+        finally:
+            self._emit_metrics(context)
+
+    def _execute(self, context):
+        if self.partition_kvs is not None:
+            self._execute_batch()
+            return
+
         glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
         ordered_partition_kv = self._get_ordered_partition_kv()
         ordered_partition_values = []
@@ -140,26 +180,34 @@ class GlueAddPartitionOperator(BaseOperator):
             ordered_partition_values.append(h["value"])
 
         if self.follow_location:
-            if not self._does_location_exists():
-                if not glue.does_partition_exists(db=self.db,
-                                                  table_name=self.table,
-                                                  partition_values=ordered_partition_values):
+            with self._metrics.phase('location_check'):
+                location_exists = self._does_location_exists()
+            if not location_exists:
+                with self._metrics.phase('existence_check'):
+                    partition_exists = glue.does_partition_exists(db=self.db,
+                                                                  table_name=self.table,
+                                                                  partition_values=ordered_partition_values)
+                if not partition_exists:
                     logging.info(f"Skip partitioning because Location[{self.location}] does not exist.")
                     return
                 logging.info(f"Delete Partition{ordered_partition_kv}"
                              f" because Location[{self.location}] does not exist.")
-                glue.delete_partition(db=self.db,
-                                      table_name=self.table,
-                                      partition_values=ordered_partition_values)
+                with self._metrics.phase('mutation'):
+                    glue.delete_partition(db=self.db,
+                                          table_name=self.table,
+                                          partition_values=ordered_partition_values)
                 return
 
-        if not glue.does_partition_exists(db=self.db,
-                                          table_name=self.table,
-                                          partition_values=ordered_partition_values):
-            glue.create_partition(db=self.db,
-                                  table_name=self.table,
-                                  partition_values=ordered_partition_values,
-                                  location=self.location)
+        with self._metrics.phase('existence_check'):
+            partition_exists = glue.does_partition_exists(db=self.db,
+                                                          table_name=self.table,
+                                                          partition_values=ordered_partition_values)
+        if not partition_exists:
+            with self._metrics.phase('mutation'):
+                glue.create_partition(db=self.db,
+                                      table_name=self.table,
+                                      partition_values=ordered_partition_values,
+                                      location=self.location)
             logging.info(f"Partition{ordered_partition_kv} is created.")
             return
 
@@ -169,14 +217,90 @@ class GlueAddPartitionOperator(BaseOperator):
             logging.info(f"Partition{ordered_partition_kv} already exists. Skip to add a partition.")
             return
         elif self.mode == OverwriteMode:
-            glue.update_partition(db=self.db,
-                                  table_name=self.table,
-                                  partition_values=ordered_partition_values,
-                                  location=self.location)
+            with self._metrics.phase('mutation'):
+                glue.update_partition(db=self.db,
+                                      table_name=self.table,
+                                      partition_values=ordered_partition_values,
+                                      location=self.location)
         else:
             raise UnknownError()
         logging.info(f"Partition{ordered_partition_kv}, Location[{self.location}] is updated.")
 
+    def _execute_batch(self) -> None:
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        values_n_locations: List[Tuple[List[str], str]] = []
+        for kv in self.partition_kvs:
+            values = [h['value'] for h in self._get_ordered_partition_kv(kv)]
+            location = self._gen_partition_location(kv)
+            if not location.endswith('/'):
+                location = location + '/'
+            values_n_locations.append((values, location))
+        with self._metrics.phase('existence_check'):
+            existing_values = set(
+                tuple(p['Values'])
+                for p in glue.batch_get_partitions(db=self.db,
+                                                   table_name=self.table,
+                                                   partition_values_list=[v for v, _ in values_n_locations])
+            )
+
+        to_delete: List[List[str]] = []
+        if self.follow_location:
+            with self._metrics.phase('location_check'):
+                with ThreadPoolExecutor(max_workers=BatchLocationCheckConcurrency) as executor:
+                    location_exists = list(executor.map(bind_run_scope(self._does_location_exists),
+                                                        [l for _, l in values_n_locations]))
+            followed: List[Tuple[List[str], str]] = []
+            for (values, location), exists in zip(values_n_locations, location_exists):
+                if exists:
+                    followed.append((values, location))
+                elif tuple(values) in existing_values:
+                    logging.info(f"Delete Partition{values} because Location[{location}] does not exist.")
+                    to_delete.append(values)
+                else:
+                    logging.info(f"Skip partitioning{values} because Location[{location}] does not exist.")
+            values_n_locations = followed
+
+        to_create = [(v, l) for v, l in values_n_locations if tuple(v) not in existing_values]
+        to_update = [(v, l) for v, l in values_n_locations if tuple(v) in existing_values]
+        if to_update:
+            if self.mode == ErrorIfExistsMode:
+                raise ConfigError(f"Partitions{[v for v, _ in to_update]} already exist.")
+            elif self.mode == SkipIfExistsMode:
+                logging.info(f"Partitions{[v for v, _ in to_update]} already exist. Skip to add the partitions.")
+                to_update = []
+            elif self.mode != OverwriteMode:
+                raise UnknownError()
+
+        errors: List[dict] = []
+        with self._metrics.phase('mutation'):
+            if to_delete:
+                errors.extend(glue.batch_delete_partitions(db=self.db, table_name=self.table,
+                                                           partition_values_list=to_delete))
+            if to_create:
+                errors.extend(glue.batch_create_partitions(db=self.db, table_name=self.table,
+                                                           values_n_locations=to_create))
+            if to_update:
+                errors.extend(glue.batch_update_partitions(db=self.db, table_name=self.table,
+                                                           values_n_locations=to_update))
+        for e in errors:
+            logging.error(f"Partition{e['values']} is failed: {e['error']}")
+        logging.info(f"Partitions are deleted: {len(to_delete)}, created: {len(to_create)},"
+                     f" updated: {len(to_update)}, failed: {len(errors)}.")
+        if errors:
+            raise StateError(f"{len(errors)} partitions are failed: {[e['values'] for e in errors]}")
+
+    def _emit_metrics(self, context) -> None:
+        """Emits the metrics of the run whether it succeeds or not, and pushes them to XCom."""
+        logging.info(f"Created clients in this process: {dict(hook_registry.created_clients)}")
+        if not self._metrics:
+            return
+        try:
+            metrics = self._metrics.emit(f"glue_presto_apas.{self.dag_id}.{self.task_id}")
+            self.xcom_push(context, key='metrics', value=metrics)
+        except Exception as ex:
+            # NOTE: Do not hide the error of the run by the error of the metrics.
+            logging.warning(f"Cannot emit the metrics of the run: {ex}")
+
 
 class Error(Exception):
     pass
@@ -186,5 +310,9 @@ class ConfigError(Error):
     pass
 
 
+class StateError(Error):
+    pass
+
+
 class UnknownError(Error):
     pass
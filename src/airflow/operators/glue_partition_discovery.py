@@ -0,0 +1,238 @@
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from airflow.models import BaseOperator, Variable
+from airflow.utils.decorators import apply_defaults
+from typing import Dict, List, Tuple
+
+from airflow.hooks.glue_presto_apas import GlueDataCatalogHook
+from airflow.hooks.glue_presto_apas import NumericPartitionKeyTypes
+from airflow.hooks.glue_presto_apas import RunMetrics
+from airflow.hooks.glue_presto_apas import S3Hook
+from airflow.hooks.glue_presto_apas import bind_run_scope
+from airflow.hooks.glue_presto_apas import hook_registry
+
+
+class GluePartitionDiscoveryOperator(BaseOperator):
+    """Registers Hive-style partitions (`<key>=<value>/`) under the table location that Glue does not have.
+
+    The prefixes are crawled level by level of the partition keys in parallel, the existing partitions are
+    read by one paginated listing, and only the missing partitions are created by Glue batch APIs.
+    """
+    template_fields = [
+        'db',
+        'table',
+        'checkpoint_variable',
+    ]
+
+    @apply_defaults
+    def __init__(
+            self,
+            db: str,
+            table: str,
+            crawl_concurrency: int = 16,
+            checkpoint_variable: str = None,
+            catalog_id: str = None,
+            catalog_region_name: str = None,
+            aws_conn_id: str = 'aws_default',
+            *args,
+            **kwargs):
+        super().__init__(*args, **kwargs)
+        self.db = db
+        self.table = table
+        self.crawl_concurrency = crawl_concurrency
+        self.checkpoint_variable = checkpoint_variable
+        self.catalog_id = catalog_id
+        self.catalog_region_name = catalog_region_name
+        self.aws_conn_id = aws_conn_id
+        self._metrics: RunMetrics = None
+
+        if crawl_concurrency < 1:
+            raise ConfigError(f"crawl_concurrency[{crawl_concurrency}] must be positive.")
+
+    def _glue_data_catalog_hook(self) -> GlueDataCatalogHook:
+        return hook_registry.get_hook(GlueDataCatalogHook,
+                                      aws_conn_id=self.aws_conn_id,
+                                      region_name=self.catalog_region_name,
+                                      catalog_id=self.catalog_id)
+
+    def _s3_hook(self) -> S3Hook:
+        return hook_registry.get_hook(S3Hook, aws_conn_id=self.aws_conn_id)
+
+    @staticmethod
+    def _extract_s3_uri(uri) -> (str, str):
+        m = re.search('^s3://([^/]+)/(.*)', uri)
+        if not m:
+            raise Error(f"URI[{uri}] is invalid for S3.")
+        bucket = m.group(1)
+        prefix = m.group(2)
+        return bucket, prefix
+
+    def pre_execute(self, context) -> None:
+        self._metrics = RunMetrics()
+        with self._metrics.phase('validation'):
+            glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+            glue.clear_snapshots()
+            if not glue.does_table_exists(db=self.db, name=self.table):
+                raise ConfigError(f"Table[{self.db}.{self.table}] does not exist.")
+            if not glue.get_partition_keys(db=self.db, name=self.table):
+                raise ConfigError(f"Table[{self.db}.{self.table}] does not have partition keys.")
+
+    def _load_checkpoint(self, location: str) -> str:
+        """Returns the greatest value of the first partition key that the last run found."""
+        if not self.checkpoint_variable:
+            return None
+        checkpoint = Variable.get(self.checkpoint_variable, default_var=None, deserialize_json=True)
+        if not checkpoint:
+            return None
+        if checkpoint.get('location') != location:
+            logging.warning(f"Ignore the checkpoint{checkpoint} because the location[{location}] is changed.")
+            return None
+        return checkpoint.get('last_value')
+
+    def _save_checkpoint(self, location: str, last_value: str) -> None:
+        if not self.checkpoint_variable or last_value is None:
+            return
+        Variable.set(self.checkpoint_variable, {'location': location, 'last_value': last_value}, serialize_json=True)
+        logging.info(f"Save the checkpoint[{last_value}] to Variable[{self.checkpoint_variable}].")
+
+    def _list_partition_prefixes(self, bucket: str, prefix: str, key: str,
+                                 start_after: str = None) -> List[Tuple[str, str]]:
+        """Returns prefixes `<prefix><key>=<value>/` and their values."""
+        s3: S3Hook = self._s3_hook()
+        pattern = re.compile(f"^{re.escape(prefix + key)}=([^/]+)/$", re.IGNORECASE)
+        found: List[Tuple[str, str]] = []
+        for p in s3.iter_prefixes(bucket_name=bucket, prefix=prefix, delimiter='/', start_after=start_after):
+            m = pattern.match(p)
+            if m:
+                found.append((p, unquote(m.group(1))))
+        return found
+
+    def _crawl(self, location: str, partition_keys: List[str], checkpoint: str) -> List[Tuple[List[str], str]]:
+        bucket, table_prefix = self._extract_s3_uri(location)
+        # NOTE: `<key>=<checkpoint>/` is listed again because new partitions may be added under it.
+        start_after = f"{table_prefix}{partition_keys[0]}={checkpoint}" if checkpoint else None
+        prefixes_n_values: List[Tuple[str, List[str]]] = [(table_prefix, [])]
+        with ThreadPoolExecutor(max_workers=self.crawl_concurrency) as executor:
+            for level, key in enumerate(partition_keys):
+                futures = [
+                    executor.submit(bind_run_scope(self._list_partition_prefixes), bucket, p, key,
+                                    start_after if level == 0 else None)
+                    for p, _ in prefixes_n_values
+                ]
+                prefixes_n_values = [
+                    (p, values + [v])
+                    for f, (_, values) in zip(futures, prefixes_n_values)
+                    for p, v in f.result()
+                ]
+                logging.info(f"Found {len(prefixes_n_values)} prefixes of the partition key[{key}].")
+        return [(values, f"s3://{bucket}/{p}") for p, values in prefixes_n_values]
+
+    def _is_first_key_numeric(self) -> bool:
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        first_key = glue.get_table(db=self.db, name=self.table)['PartitionKeys'][0]
+        return first_key['Type'].lower() in NumericPartitionKeyTypes
+
+    @staticmethod
+    def _first_value_order(value: str, numeric: bool):
+        """Returns the key to compare values of the first partition key like Glue, or None if it is not comparable."""
+        if not numeric:
+            return value
+        try:
+            return int(value)
+        except ValueError:
+            return None
+
+    def _first_key_expression(self, checkpoint: str, numeric: bool) -> str:
+        if not checkpoint:
+            return ''
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        first_key = glue.get_table(db=self.db, name=self.table)['PartitionKeys'][0]
+        if numeric:
+            return f"{first_key['Name']} >= {int(checkpoint)}"
+        escaped = checkpoint.replace("'", "''")
+        return f"{first_key['Name']} >= '{escaped}'"
+
+    def execute(self, context) -> Dict:
+        try:
+            return self._execute(context)
+        finally:
+            self._emit_metrics(context)
+
+    def _execute(self, context) -> Dict:
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        location = glue.get_table_location(db=self.db, name=self.table)
+        if not location.endswith('/'):
+            location = location + '/'
+        partition_keys = glue.get_partition_keys(db=self.db, name=self.table)
+        checkpoint = self._load_checkpoint(location)
+        numeric = self._is_first_key_numeric()
+        if checkpoint and self._first_value_order(checkpoint, numeric) is None:
+            logging.warning(f"Ignore the checkpoint[{checkpoint}] that is not a value of the numeric partition key.")
+            checkpoint = None
+        logging.info(f"Discover partitions{partition_keys} in Location[{location}]"
+                     + (f" from the checkpoint[{checkpoint}]." if checkpoint else "."))
+
+        with self._metrics.phase('crawl'):
+            # NOTE: S3 lists keys in the lexicographic order, which differs from the order of unpadded numbers
+            #       (e.g. `10` < `9`), so the prefixes of a numeric key are listed from the start and filtered.
+            discovered = self._crawl(location=location, partition_keys=partition_keys,
+                                     checkpoint=None if numeric else checkpoint)
+            if checkpoint and numeric:
+                discovered = [
+                    (v, l) for v, l in discovered
+                    if self._first_value_order(v[0], numeric) is not None
+                    and self._first_value_order(v[0], numeric) >= int(checkpoint)
+                ]
+        with self._metrics.phase('existence_check'):
+            existing_values = set(
+                tuple(p['Values'])
+                for p in glue.get_partitions(db=self.db,
+                                             table_name=self.table,
+                                             expression=self._first_key_expression(checkpoint, numeric))
+            )
+        to_create = [(v, l) for v, l in discovered if tuple(v) not in existing_values]
+        logging.info(f"Discovered {len(discovered)} partitions, {len(existing_values)} partitions exist"
+                     f" and {len(to_create)} partitions are missing.")
+
+        with self._metrics.phase('mutation'):
+            errors = glue.batch_create_partitions(db=self.db, table_name=self.table,
+                                                  values_n_locations=to_create) if to_create else []
+        for e in errors:
+            logging.error(f"Partition{e['values']} is failed: {e['error']}")
+        if errors:
+            raise StateError(f"{len(errors)} partitions are failed: {[e['values'] for e in errors]}")
+
+        comparable = [v[0] for v, _ in discovered if self._first_value_order(v[0], numeric) is not None]
+        if comparable:
+            self._save_checkpoint(location, max(comparable, key=lambda v: self._first_value_order(v, numeric)))
+        return {
+            'discovered': len(discovered),
+            'created': [v for v, _ in to_create],
+        }
+
+    def _emit_metrics(self, context) -> None:
+        """Emits the metrics of the run whether it succeeds or not, and pushes them to XCom."""
+        logging.info(f"Created clients in this process: {dict(hook_registry.created_clients)}")
+        if not self._metrics:
+            return
+        try:
+            metrics = self._metrics.emit(f"glue_presto_apas.{self.dag_id}.{self.task_id}")
+            self.xcom_push(context, key='metrics', value=metrics)
+        except Exception as ex:
+            # NOTE: Do not hide the error of the run by the error of the metrics.
+            logging.warning(f"Cannot emit the metrics of the run: {ex}")
+
+
+class Error(Exception):
+    pass
+
+
+class ConfigError(Error):
+    pass
+
+
+class StateError(Error):
+    pass
@@ -1,31 +1,109 @@
+import hashlib
+import json
 import logging
+import math
+import os
 import random
 import re
 import string
+import tempfile
 import textwrap
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
-from airflow.hooks.S3_hook import S3Hook
+import requests
+from airflow.exceptions import AirflowException
 from airflow.models import BaseOperator
+from airflow.settings import Stats
 from airflow.utils.decorators import apply_defaults
 from tenacity import retry, stop_after_attempt, wait_random_exponential
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 from airflow.hooks.glue_presto_apas import GlueDataCatalogHook
+from airflow.hooks.glue_presto_apas import PrestoClusterStats
 from airflow.hooks.glue_presto_apas import PrestoHook
+from airflow.hooks.glue_presto_apas import PrestoQueryProgress
+from airflow.hooks.glue_presto_apas import RunMetrics
+from airflow.hooks.glue_presto_apas import S3ObjectsSummary
+from airflow.hooks.glue_presto_apas import S3Hook
+from airflow.hooks.glue_presto_apas import hook_registry
 
 SkipIfExistsSaveMode = 'skip_if_exists'
 ErrorIfExistsSaveMode = 'error_if_exists'
 IgnoreSaveMode = 'ignore'
 OverwriteSaveMode = 'overwrite'
+OverwriteVersionedSaveMode = 'overwrite_versioned'
+SkipIfUnchangedSaveMode = 'skip_if_unchanged'
 
 AvailableSaveModes = [
     SkipIfExistsSaveMode,
     ErrorIfExistsSaveMode,
     IgnoreSaveMode,
     OverwriteSaveMode,
+    OverwriteVersionedSaveMode,
+    SkipIfUnchangedSaveMode,
 ]
 
+# NOTE: `overwrite_versioned` mode writes to `<location>_apas_v<UTC timestamp>_<random>/` in each run.
+#       Presto stores the partition location without the trailing '/'.
+VersionedLocationPrefix = '_apas_v'
+VersionedLocationPattern = re.compile(r'^(.*/)_apas_v(\d{14})_[0-9A-Z]+/?$')
+
+CountRowVerification = 'count'
+QueryStatsRowVerification = 'query_stats'
+
+AvailableRowVerifications = [
+    CountRowVerification,
+    QueryStatsRowVerification,
+]
+
+QueryMetadataSchemaDetection = 'query_metadata'
+ViewSchemaDetection = 'view'
+
+AvailableSchemaDetections = [
+    QueryMetadataSchemaDetection,
+    ViewSchemaDetection,
+]
+
+BlockingExecutionMode = 'blocking'
+RescheduleExecutionMode = 'reschedule'
+
+AvailableExecutionModes = [
+    BlockingExecutionMode,
+    RescheduleExecutionMode,
+]
+
+# NOTE: The parameter of the temporary table to persist the progress among the task executions.
+StateParameterKey = 'airflow_glue_presto_apas.state'
+# NOTE: The prefix of the temporary tables that are kept for the retries, followed by the hash of the partition
+#       and the hash of the task instance, so that the runs of the partition find the tables left by others.
+ResumableTmpTablePrefix = '__work_airflow_glue_presto_apas_resumable_'
+# NOTE: The parameter of the partition to store the hash of what produces the partition.
+FingerprintParameterKey = 'airflow_glue_presto_apas.fingerprint'
+# NOTE: The default of `query.client.timeout` in Presto that abandons queries without client polling.
+PrestoClientTimeoutSeconds = 300
+# NOTE: The max `task_writer_count` that the writer tuning sets.
+MaxTaskWriterCount = 64
+# NOTE: Types of ColumnStatisticsData of Glue for Hive column types. Statistics of other types are not computed.
+ColumnStatisticsTypes = {
+    'tinyint': 'LONG',
+    'smallint': 'LONG',
+    'int': 'LONG',
+    'bigint': 'LONG',
+    'float': 'DOUBLE',
+    'double': 'DOUBLE',
+    'boolean': 'BOOLEAN',
+    'date': 'DATE',
+    'string': 'STRING',
+    'varchar': 'STRING',
+    'char': 'STRING',
+}
+# NOTE: Table parameters of the compression codec, and codec names of Hive that differ in Presto.
+CompressionTableParameters = ['parquet.compression', 'orc.compress']
+PrestoCompressionCodecs = {
+    'UNCOMPRESSED': 'NONE',
+    'ZLIB': 'GZIP',
+}
+
 
 class GluePrestoApasOperator(BaseOperator):
     template_fields = [
@@ -35,6 +113,9 @@ class GluePrestoApasOperator(BaseOperator):
         'partition_keys',
         'partition_values',
         'location',
+        'input_tables',
+        'session_properties',
+        'client_tags',
         'query_header_comment',  # internal use
     ]
     template_ext = ['.sql']
@@ -50,9 +131,25 @@ class GluePrestoApasOperator(BaseOperator):
             additional_properties: Dict[str, str] = {},
             location: str = None,
             save_mode: str = 'overwrite',
+            delete_concurrency: int = 8,
+            row_verification: str = 'count',
+            schema_detection: str = 'query_metadata',
+            schema_cache_dir: str = None,
+            input_tables: List[str] = [],
+            execution_mode: str = 'blocking',
+            poke_interval: int = 60,
+            poll_timeout: int = 30,
+            progress_interval: int = 30,
+            session_properties: Dict[str, str] = {},
+            client_tags: List[str] = [],
+            target_bytes_per_writer: int = None,
+            inherit_table_properties: bool = True,
+            column_statistics: bool = False,
             catalog_id: str = None,
             catalog_region_name: str = None,
             presto_conn_id: str = 'presto_default',
+            presto_conn_ids: List[str] = [],
+            heavy_query_bytes: int = None,
             aws_conn_id: str = 'aws_default',
             *args,
             **kwargs):
@@ -66,9 +163,29 @@ class GluePrestoApasOperator(BaseOperator):
         self.partition_keys: List[str] = list(partition_kv.keys())
         self.partition_values: List[str] = list(partition_kv.values())
         self.save_mode = save_mode
+        self.delete_concurrency = delete_concurrency
+        self.row_verification = row_verification
+        self.schema_detection = schema_detection
+        self.schema_cache_dir = schema_cache_dir
+        self.input_tables = input_tables
+        self.execution_mode = execution_mode
+        self.poke_interval = poke_interval
+        self.poll_timeout = poll_timeout
+        self.progress_interval = progress_interval
+        self.session_properties = session_properties
+        self.client_tags = client_tags
+        self.target_bytes_per_writer = target_bytes_per_writer
+        self.inherit_table_properties = inherit_table_properties
+        self.column_statistics = column_statistics
+        self._metrics: RunMetrics = None
+        self._fingerprint: str = None
+        self._input_bytes: float = None
+        self._is_input_bytes_estimated = False
         self.catalog_id = catalog_id
         self.catalog_region_name = catalog_region_name
         self.presto_conn_id = presto_conn_id
+        self.presto_conn_ids = presto_conn_ids
+        self.heavy_query_bytes = heavy_query_bytes
         self.aws_conn_id = aws_conn_id
 
         self.query_header_comment = textwrap.dedent('''
@@ -79,22 +196,63 @@ class GluePrestoApasOperator(BaseOperator):
         if save_mode not in AvailableSaveModes:
             raise ConfigError(f"Save mode[{save_mode}] is unsupported."
                               f" Supported save modes are {AvailableSaveModes}.")
+        if row_verification not in AvailableRowVerifications:
+            raise ConfigError(f"Row verification[{row_verification}] is unsupported."
+                              f" Supported row verifications are {AvailableRowVerifications}.")
+        if schema_detection not in AvailableSchemaDetections:
+            raise ConfigError(f"Schema detection[{schema_detection}] is unsupported."
+                              f" Supported schema detections are {AvailableSchemaDetections}.")
+        if execution_mode not in AvailableExecutionModes:
+            raise ConfigError(f"Execution mode[{execution_mode}] is unsupported."
+                              f" Supported execution modes are {AvailableExecutionModes}.")
+        if execution_mode == RescheduleExecutionMode and poke_interval >= PrestoClientTimeoutSeconds:
+            logging.warning(f"poke_interval[{poke_interval}] must be less than `query.client.timeout` of Presto"
+                            f" (default: {PrestoClientTimeoutSeconds}s), or Presto abandons the query.")
+        if heavy_query_bytes and not presto_conn_ids:
+            raise ConfigError("'heavy_query_bytes' requires 'presto_conn_ids'.")
+        # NOTE: The cached columns are never invalidated without the versions of the input tables.
+        if schema_cache_dir and not input_tables:
+            raise ConfigError("'schema_cache_dir' requires 'input_tables'.")
+        # NOTE: The fingerprint does not change by the updates of the input tables without their versions.
+        if save_mode == SkipIfUnchangedSaveMode and not input_tables:
+            raise ConfigError(f"save_mode[{save_mode}] requires 'input_tables'.")
+        for t in input_tables:
+            if '.' not in t.split('/', 1)[0]:
+                raise ConfigError(f"Input table[{t}] must be '<db>.<table>' or '<db>.<table>/<key>=<value>/...'.")
         for p in ['format', 'external_location']:
             if p in additional_properties:
                 raise ConfigError(f"Additional properties must not includes '{p}'"
                                   f" because this plugin uses.")
 
-    def _presto_hook(self) -> PrestoHook:
-        return PrestoHook(presto_conn_id=self.presto_conn_id,
-                          query_header_comment=self.query_header_comment)
+    @property
+    def reschedule(self) -> bool:
+        return self.execution_mode == RescheduleExecutionMode
+
+    @property
+    def deps(self):
+        deps = super().deps
+        if self.reschedule:
+            # NOTE: Only BaseSensorOperator waits for the reschedule date by this dep in Airflow 1.10,
+            #       or the scheduler runs the task again at once. The dep is available from Airflow 1.10.2.
+            from airflow.ti_deps.deps.ready_to_reschedule import ReadyToRescheduleDep
+            deps = deps | {ReadyToRescheduleDep()}
+        return deps
+
+    def _presto_hook(self, presto_conn_id: str = None) -> PrestoHook:
+        return hook_registry.get_hook(PrestoHook,
+                                      presto_conn_id=presto_conn_id or self.presto_conn_id,
+                                      query_header_comment=self.query_header_comment,
+                                      session_properties=self.session_properties,
+                                      client_tags=self.client_tags)
 
     def _glue_data_catalog_hook(self) -> GlueDataCatalogHook:
-        return GlueDataCatalogHook(aws_conn_id=self.aws_conn_id,
-                                   region_name=self.catalog_region_name,
-                                   catalog_id=self.catalog_id)
+        return hook_registry.get_hook(GlueDataCatalogHook,
+                                      aws_conn_id=self.aws_conn_id,
+                                      region_name=self.catalog_region_name,
+                                      catalog_id=self.catalog_id)
 
     def _s3_hook(self) -> S3Hook:
-        return S3Hook(aws_conn_id=self.aws_conn_id)
+        return hook_registry.get_hook(S3Hook, aws_conn_id=self.aws_conn_id)
 
     def _is_sufficient_partition_kv(self) -> bool:
         glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
@@ -144,24 +302,58 @@ class GluePrestoApasOperator(BaseOperator):
         return ''.join(random.choice(chars) for _ in range(size))
 
     def pre_execute(self, context) -> None:
-        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        self._glue_data_catalog_hook().clear_snapshots()
+        self._check_n_prepare_partition()
+
+    def _check_n_prepare_partition(self) -> None:
+        self._metrics = RunMetrics()
+        with self._metrics.phase('validation'):
+            glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+            if not glue.does_database_exists(name=self.db):
+                raise ConfigError(f"DB[{self.db}] is not found.")
+            if not glue.does_table_exists(db=self.db, name=self.table):
+                raise ConfigError(f"Table[{self.db}.{self.table}] is not found.")
+            if not glue.get_partition_keys(db=self.db, name=self.table):
+                raise ConfigError(f"Table[{self.db}.{self.table}] does not have partition keys.")
+            if not self._is_sufficient_partition_kv():
+                raise ConfigError(f"partition keys{self.partition_keys} and partition values{self.partition_values} are insufficient.")
+            if not self.location:
+                self.location = self._gen_partition_location()
+            if not self.location.endswith('/'):
+                self.location = self.location + '/'
+            self._check_input_tables()
 
-        if not glue.does_database_exists(name=self.db):
-            raise ConfigError(f"DB[{self.db}] is not found.")
-        if not glue.does_table_exists(db=self.db, name=self.table):
-            raise ConfigError(f"Table[{self.db}.{self.table}] is not found.")
-        if not glue.get_partition_keys(db=self.db, name=self.table):
-            raise ConfigError(f"Table[{self.db}.{self.table}] does not have partition keys.")
-        if not self._is_sufficient_partition_kv():
-            raise ConfigError(f"partition keys{self.partition_keys} and partition values{self.partition_values} are insufficient.")
-        if not self.location:
-            self.location = self._gen_partition_location()
-        if not self.location.endswith('/'):
-            self.location = self.location + '/'
+    def _gen_versioned_location(self) -> str:
+        return f"{self.location}{VersionedLocationPrefix}" \
+            f"{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}_{self._random_str()}/"
+
+    def _is_unchanged(self) -> bool:
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        partition_values = [h['value'] for h in self._get_ordered_partition_kv()]
+        partitions = glue.batch_get_partitions(db=self.db, table_name=self.table, partition_values_list=[partition_values])
+        if not partitions:
+            return False
+        return partitions[0].get('Parameters', {}).get(FingerprintParameterKey) == self._get_fingerprint()
 
     def _processable_check_n_prepare_location(self) -> bool:
         s3: S3Hook = self._s3_hook()
 
+        # NOTE: The versions of the input tables must be read before the query reads the tables.
+        if self.input_tables:
+            self._get_fingerprint()
+        if self.save_mode == SkipIfUnchangedSaveMode:
+            if self._is_unchanged():
+                logging.info(f"Skip this execution because the partition has Fingerprint[{self._fingerprint}]"
+                             f" and save_mode[{self.save_mode}] is defined.")
+                return False
+            logging.info(f"Overwrite the partition because Fingerprint[{self._fingerprint}] is changed.")
+
+        if self.save_mode == OverwriteVersionedSaveMode:
+            self.location = self._gen_versioned_location()
+            logging.info(f"Write to the new version location[{self.location}]"
+                         f" because save_mode[{self.save_mode}] is defined.")
+            return True
+
         bucket, prefix = self._extract_s3_uri(self.location)
         if s3.check_for_prefix(bucket_name=bucket, prefix=prefix, delimiter='/'):
             if self.save_mode == SkipIfExistsSaveMode:
@@ -174,15 +366,160 @@ class GluePrestoApasOperator(BaseOperator):
             elif self.save_mode == IgnoreSaveMode:
                 logging.info(f"Continue the execution regardless that location[{self.location}] exists"
                              f" because save_mode[{self.save_mode}] is defined.")
-            elif self.save_mode == OverwriteSaveMode:
+            elif self.save_mode in (OverwriteSaveMode, SkipIfUnchangedSaveMode):
                 logging.info(f"Delete all objects in location[{self.location}]"
                              f" because save_mode[{self.save_mode}] is defined.")
-                keys = s3.list_keys(bucket_name=bucket, prefix=prefix, delimiter='/')
-                s3.delete_objects(bucket=bucket, keys=keys)
+                summary = s3.delete_prefix(bucket_name=bucket, prefix=prefix, concurrency=self.delete_concurrency)
+                logging.info(f"Deleted {summary} in location[{self.location}].")
             else:
                 raise UnknownError()
         return True
 
+    def _estimate_input_bytes(self, presto_conn_id: str = None) -> float:
+        """Returns the estimated input size of `sql`, or None if unknown. `EXPLAIN` runs once in the run."""
+        if not self._is_input_bytes_estimated:
+            self._is_input_bytes_estimated = True
+            try:
+                self._input_bytes = self._presto_hook(presto_conn_id).estimate_input_bytes(self.sql)
+            except Exception as ex:
+                logging.warning(f"Cannot estimate the input size of the query: {ex}")
+            logging.info(f"The estimated input size of the query is {self._input_bytes} bytes.")
+        return self._input_bytes
+
+    def _tune_writers(self) -> None:
+        """Sets `task_writer_count` by the estimated input size of `sql` unless it is set explicitly."""
+        if not self.target_bytes_per_writer or 'task_writer_count' in self.session_properties:
+            return
+        size = self._estimate_input_bytes()
+        if size is None:
+            logging.warning("The input size of the query is not estimated. Use the default writer count.")
+            return
+        writers = max(1, math.ceil(size / self.target_bytes_per_writer))
+        # NOTE: `task_writer_count` must be a power of 2.
+        task_writer_count = min(MaxTaskWriterCount, 1 << (writers.bit_length() - 1))
+        logging.info(f"Set task_writer_count[{task_writer_count}] for the estimated input size[{size:.0f} bytes].")
+        self.session_properties = dict(self.session_properties, task_writer_count=str(task_writer_count))
+
+    def _route_presto_conn_id(self) -> None:
+        """Sets `presto_conn_id` to the cluster in `presto_conn_ids` that fits the query.
+
+        Unhealthy coordinators and clusters without active workers are skipped. Queries that read
+        `heavy_query_bytes` or more go to the largest cluster without queued queries, and the others go to
+        the cluster that has the least queries per worker.
+        """
+        if not self.presto_conn_ids:
+            return
+        clusters: List[Tuple[str, PrestoClusterStats]] = []
+        for conn_id in self.presto_conn_ids:
+            try:
+                stats = self._presto_hook(conn_id).get_cluster_stats()
+            except Exception as ex:
+                logging.warning(f"Skip Presto[{conn_id}] because the coordinator is unhealthy: {ex}")
+                continue
+            logging.info(f"Presto[{conn_id}] has {stats}.")
+            if stats.active_workers < 1:
+                logging.warning(f"Skip Presto[{conn_id}] because it has no active workers.")
+                continue
+            clusters.append((conn_id, stats))
+        if not clusters:
+            raise StateError(f"No Presto clusters{self.presto_conn_ids} are healthy.")
+
+        heavy = False
+        if self.heavy_query_bytes:
+            cost = self._estimate_input_bytes(clusters[0][0])
+            heavy = cost is not None and cost >= self.heavy_query_bytes
+        if heavy:
+            conn_id, stats = min(clusters, key=lambda c: (c[1].queued_queries > 0, -c[1].active_workers, c[1].load))
+        else:
+            # NOTE: Prefer the smaller cluster among the same load to leave the larger one for heavy queries.
+            conn_id, stats = min(clusters, key=lambda c: (c[1].load, c[1].active_workers))
+        logging.info(f"Route the {'heavy' if heavy else 'light'} query to Presto[{conn_id}].")
+        self.presto_conn_id = conn_id
+
+    @staticmethod
+    def _parse_input_table(input_table: str) -> (str, str, Dict[str, str]):
+        """Returns the db, the table name and the partition kv of `<db>.<table>/<key>=<value>/...`."""
+        table_name, *partition_elems = input_table.rstrip('/').split('/')
+        db, name = table_name.split('.', 1)
+        return db, name, dict(e.split('=', 1) for e in partition_elems)
+
+    def _check_input_tables(self) -> None:
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        for t in self.input_tables:
+            db, name, kv = self._parse_input_table(t)
+            if not glue.does_table_exists(db=db, name=name):
+                raise AirflowException(f"Input table[{t}] is not found.")
+            if not kv:
+                continue
+            partition_keys = glue.get_partition_keys(db=db, name=name)
+            missing_keys = [k for k in partition_keys if k not in kv]
+            unknown_keys = [k for k in kv if k not in partition_keys]
+            if missing_keys or unknown_keys:
+                raise AirflowException(f"Input table[{t}] misses partition keys{missing_keys}"
+                                       f" and has unknown keys{unknown_keys} of Table[{db}.{name}]{partition_keys}.")
+
+    def _input_table_versions(self) -> List[Dict[str, str]]:
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        versions: List[Dict[str, str]] = []
+        for t in self.input_tables:
+            db, name, kv = self._parse_input_table(t)
+            if not kv:
+                table = glue.get_table(db=db, name=name)
+                versions.append({
+                    'table': t,
+                    'update_time': str(table.get('UpdateTime')),
+                    'version_id': table.get('VersionId'),
+                })
+                continue
+            partition_values = [kv[k] for k in glue.get_partition_keys(db=db, name=name)]
+            partitions = glue.batch_get_partitions(db=db, table_name=name, partition_values_list=[partition_values])
+            # NOTE: Glue partitions do not have the update time, so the location and the parameters
+            #       (e.g. numRows, totalSize, transient_lastDdlTime and the fingerprint) are the version.
+            versions.append({
+                'table': t,
+                'creation_time': str(partitions[0].get('CreationTime')) if partitions else None,
+                'location': partitions[0]['StorageDescriptor'].get('Location') if partitions else None,
+                'parameters': partitions[0].get('Parameters', {}) if partitions else None,
+            })
+        return versions
+
+    def _get_fingerprint(self) -> str:
+        """Returns the fingerprint of this run, which is generated when it is used first."""
+        if self._fingerprint is None:
+            self._fingerprint = self._gen_fingerprint()
+        return self._fingerprint
+
+    def _gen_fingerprint(self) -> str:
+        """Returns the hash of the rendered sql, the format, the properties and the versions of input_tables."""
+        key = json.dumps([self.sql, self.fmt, self.additional_properties, self.inherit_table_properties,
+                          self._input_table_versions()], sort_keys=True)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _schema_cache_path(self, sql: str) -> str:
+        key = hashlib.sha256(json.dumps([sql, self._input_table_versions()], sort_keys=True).encode('utf-8'))
+        return os.path.join(self.schema_cache_dir, f"{key.hexdigest()}.json")
+
+    def _detect_columns(self, sql: str) -> List[Dict[str, str]]:
+        cache_path = self._schema_cache_path(sql) if self.schema_cache_dir else None
+        if cache_path and os.path.exists(cache_path):
+            logging.info(f"Use the cached columns[{cache_path}].")
+            with open(cache_path) as f:
+                return json.load(f)
+
+        if self.schema_detection == ViewSchemaDetection:
+            columns = self._desc_columns_by_query(sql)
+        else:
+            columns = self._presto_hook().get_result_columns(sql)
+
+        if cache_path:
+            os.makedirs(self.schema_cache_dir, exist_ok=True)
+            # NOTE: Write atomically because concurrent tasks may read the cache.
+            fd, tmp_path = tempfile.mkstemp(dir=self.schema_cache_dir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(columns, f)
+            os.replace(tmp_path, cache_path)
+        return columns
+
     def _desc_columns_by_query(self, sql: str):
         presto: PrestoHook = self._presto_hook()
         tmp_table = f"__work_airflow_glue_presto_apas" \
@@ -202,8 +539,56 @@ class GluePrestoApasOperator(BaseOperator):
             presto.get_first(f"DROP VIEW {self.db}.{tmp_table}")
         return columns
 
-    def _prepare_create_table_properties_stmt(self):
+    def _inherited_table_properties(self, column_names: List[str]) -> Dict[str, str]:
+        """Returns bucketed_by, bucket_count and sorted_by of the target table as the table properties."""
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        sd = glue.get_table(db=self.db, name=self.table)['StorageDescriptor']
+        # NOTE: Presto lowercases the column names.
+        bucket_columns = [c.lower() for c in sd.get('BucketColumns', [])]
+        sort_columns = [dict(s, Column=s['Column'].lower()) for s in sd.get('SortColumns', [])]
+        if not bucket_columns or sd.get('NumberOfBuckets', 0) <= 0:
+            return {}
+        column_names = [c.lower() for c in column_names]
+        missing = [c for c in bucket_columns + [s['Column'] for s in sort_columns] if c not in column_names]
+        if missing:
+            logging.warning(f"Do not inherit the bucketing of Table[{self.db}.{self.table}]"
+                            f" because columns{missing} are not in the result of sql.")
+            return {}
+        props = {
+            'bucketed_by': f"ARRAY[{', '.join(self._sql_literal(c) for c in bucket_columns)}]",
+            'bucket_count': str(sd['NumberOfBuckets']),
+        }
+        if sort_columns:
+            # NOTE: SortOrder of Glue is 1 for ascending and 0 for descending.
+            sorted_by = [f"{s['Column']}{'' if s.get('SortOrder', 1) else ' DESC'}" for s in sort_columns]
+            props['sorted_by'] = f"ARRAY[{', '.join(self._sql_literal(c) for c in sorted_by)}]"
+        return props
+
+    @staticmethod
+    def _sql_literal(s: str) -> str:
+        return "'" + s.replace("'", "''") + "'"
+
+    def _inherit_compression(self) -> None:
+        """Sets `compression_codec` of the catalog by the table parameters unless it is set explicitly."""
+        if not self.inherit_table_properties:
+            return
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        catalog = self._presto_hook().catalog
+        if f"{catalog}.compression_codec" in self.session_properties:
+            return
+        parameters = glue.get_table(db=self.db, name=self.table).get('Parameters', {})
+        codecs = [parameters[p].upper() for p in CompressionTableParameters if parameters.get(p)]
+        if not codecs:
+            return
+        codec = PrestoCompressionCodecs.get(codecs[0], codecs[0])
+        logging.info(f"Set {catalog}.compression_codec[{codec}] by the parameters of Table[{self.db}.{self.table}].")
+        self.session_properties = dict(self.session_properties, **{f"{catalog}.compression_codec": codec})
+
+    def _prepare_create_table_properties_stmt(self, column_names: List[str] = []):
         props = self.additional_properties.copy()
+        if self.inherit_table_properties:
+            for k, v in self._inherited_table_properties(column_names).items():
+                props.setdefault(k, v)
         props['external_location'] = f"'{self.location}'"
         props['format'] = f"'{self.fmt}'"
         props_stmts = []
@@ -225,106 +610,503 @@ class GluePrestoApasOperator(BaseOperator):
     @retry(reraise=True,
            stop=stop_after_attempt(5),
            wait=wait_random_exponential(multiplier=1, max=60))
-    def wait_until_objects_created(self, obj_filter=lambda obj: True):
+    def wait_until_objects_created(self, obj_filter=lambda obj: True) -> S3ObjectsSummary:
         s3: S3Hook = self._s3_hook()
         bucket, prefix = self._extract_s3_uri(self.location)
-        created_objects = []
-        for key in s3.list_keys(bucket_name=bucket, prefix=prefix, delimiter='/'):
-            obj = s3.get_key(bucket_name=bucket, key=key)
-            if obj_filter(obj):
-                logging.info(f"Found a created object[{obj}"
-                             f", last_modified:{obj.last_modified}"
-                             f", length:{obj.content_length}].")
-                created_objects.append(obj)
-            else:
-                logging.info(f"Skip a Object[{obj}"
-                             f", last_modified:{obj.last_modified}"
-                             f", length:{obj.content_length}] "
-                             f"as is not created in the current execution.")
-        if not created_objects:
+        summary = s3.summarize_objects(bucket_name=bucket, prefix=prefix, delimiter='/', obj_filter=obj_filter)
+        if not summary.file_count:
             raise StateError(f"No objects are found in {self.location}.")
-        logging.info(f"Created objects are found in {self.location}.")
+        logging.info(f"Created objects are found in {self.location}: {summary}.")
+        return summary
 
-    def execute(self, context) -> None:
-        s3: S3Hook = self._s3_hook()
+    def _verify_rows_by_query_stats(self, query_id: str, affected_rows: int) -> bool:
         presto: PrestoHook = self._presto_hook()
+        if not query_id:
+            logging.warning("Cannot get the query id of the INSERT query.")
+            return False
+        try:
+            stats = presto.get_write_stats(query_id)
+        except Exception as ex:
+            logging.warning(f"Cannot get the stats of Query[{query_id}]: {ex}")
+            return False
+        logging.info(f"Stats of Query[{query_id}]: {stats}")
+        if stats['written_rows'] is None:
+            logging.warning(f"Query[{query_id}] does not have the written rows stat.")
+            return False
+        if stats['state'] not in ('FINISHING', 'FINISHED'):
+            raise StateError(f"Query[{query_id}] is {stats['state']}.")
+        if stats['written_rows'] != affected_rows:
+            raise StateError(f"Query[{query_id}] wrote {stats['written_rows']} rows,"
+                             f" but {affected_rows} rows are affected.")
+        logging.info(f"Query[{query_id}] wrote {affected_rows} rows ({stats['written_bytes']} bytes).")
+        return True
+
+    def _verify_rows(self, tmp_table: str, query_id: str, affected_rows: int) -> None:
+        presto: PrestoHook = self._presto_hook()
+        if self.row_verification == QueryStatsRowVerification:
+            if self._verify_rows_by_query_stats(query_id=query_id, affected_rows=affected_rows):
+                return
+            logging.warning(f"Fall back to counting rows of Table[{self.db}.{tmp_table}].")
+        self.wait_for(
+            success_message=f"Table[{self.db}.{tmp_table}] has {affected_rows} rows.",
+            failure_message=f"Table[{self.db}.{tmp_table}] does not has {affected_rows} rows.",
+            method=lambda: presto.get_first(f"SELECT COUNT(1) FROM {self.db}.{tmp_table}")[0] == affected_rows
+        )
+
+    def _report_progress(self, progress: PrestoQueryProgress) -> None:
+        logging.info(f"{progress}")
+        # NOTE: StatsD of Airflow does not support tags, so they are a part of the metric name.
+        prefix = f"glue_presto_apas.query.{self.dag_id}.{self.task_id}.{self.db}.{self.table}"
+        for name in ['completed_splits', 'total_splits', 'processed_rows', 'processed_bytes',
+                     'cpu_time_millis', 'peak_memory_bytes']:
+            Stats.gauge(f"{prefix}.{name}", getattr(progress, name))
+
+    def _new_result(self) -> Dict:
+        return {
+            'location': self.location,
+            'partition_kv': dict(zip(self.partition_keys, self.partition_values)),
+            'processed': False,
+            'query_id': None,
+            'affected_rows': None,
+            'created_objects': None,
+            'fingerprint': None,
+            'presto_conn_id': None,
+        }
+
+    def _gen_tmp_table_name(self) -> str:
+        return f"__work_airflow_glue_presto_apas" \
+            f"_{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}" \
+            f"_{self._random_str()}"
+
+    def _tmp_table_prefix_for_partition(self) -> str:
+        key = json.dumps([self.db, self.table, self.partition_keys, self.partition_values])
+        return f"{ResumableTmpTablePrefix}{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}_"
+
+    def _tmp_table_name_for(self, context) -> str:
+        """Returns the temporary table name that is unique to the task instance and the partition."""
+        ti = context['ti']
+        key = json.dumps([ti.dag_id, ti.task_id, ti.execution_date.isoformat()])
+        return f"{self._tmp_table_prefix_for_partition()}{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}"
+
+    def _drop_stale_tmp_tables(self, tmp_table: str) -> None:
+        """Drops the temporary tables of the partition that other task instances keep for their retries,
+        if their INSERTs are produced by another fingerprint. The retries do not resume them any more.
+        """
         glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        prefix = self._tmp_table_prefix_for_partition()
+        with self._metrics.phase('state'):
+            tables = glue.get_tables(db=self.db, expression=f"{prefix}.*")
+        for t in tables:
+            if not t['Name'].startswith(prefix) or t['Name'] == tmp_table:
+                continue
+            state = json.loads(t.get('Parameters', {}).get(StateParameterKey) or '{}')
+            # NOTE: Tables without the finished INSERT may be used by running task instances.
+            if state.get('affected_rows') is None:
+                continue
+            if state.get('fingerprint') == self._get_fingerprint():
+                continue
+            logging.info(f"Drop Table[{self.db}.{t['Name']}] that the try[{state['try_number']}] keeps"
+                         f" because Fingerprint[{self._fingerprint}] is changed.")
+            self._cleanup(t['Name'], location=state.get('location'))
 
-        if not self._processable_check_n_prepare_location():
-            return
+    def _load_state(self, tmp_table: str) -> Dict:
+        """Returns the state of the temporary table, {} if the table has no state, or None if it does not exist."""
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        glue.invalidate_table(db=self.db, name=tmp_table)
+        if not glue.does_table_exists(db=self.db, name=tmp_table):
+            return None
+        state = glue.get_table(db=self.db, name=tmp_table).get('Parameters', {}).get(StateParameterKey)
+        return json.loads(state) if state else {}
+
+    def _save_state(self, tmp_table: str, state: Dict) -> None:
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        with self._metrics.phase('state'):
+            glue.update_table_parameters(db=self.db, name=tmp_table, parameters={StateParameterKey: json.dumps(state)})
+
+    def _load_resumable_state(self, tmp_table: str, context) -> Dict:
+        """Returns the state that the previous executions of the task instance leave in the temporary table.
+
+        The state of another try is resumed only if its INSERT is finished and the fingerprint is the same,
+        otherwise the temporary table is dropped. The table without the state is dropped too.
+        """
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        with self._metrics.phase('state'):
+            state = self._load_state(tmp_table)
+        if state is None:
+            return None
+        if not state:
+            # NOTE: A killed worker leaves the table without the state, and it blocks CREATE TABLE of the retries.
+            location = glue.get_table(db=self.db, name=tmp_table)['StorageDescriptor'].get('Location')
+            logging.info(f"Drop Table[{self.db}.{tmp_table}] that is left without the state.")
+            self._cleanup(tmp_table, location=location)
+            return None
+        try_number = context['ti'].try_number
+        if state['try_number'] == try_number:
+            return state
+        if state.get('affected_rows') is not None:
+            with self._metrics.phase('state'):
+                fingerprint = self._get_fingerprint()
+            if state.get('fingerprint') == fingerprint:
+                logging.info(f"Resume Table[{self.db}.{tmp_table}] that the try[{state['try_number']}] leaves: {state}")
+                state['try_number'] = try_number
+                return state
+            logging.info(f"Do not resume Table[{self.db}.{tmp_table}] because Fingerprint[{self._fingerprint}]"
+                         f" is changed from the try[{state['try_number']}].")
+        logging.info(f"Drop Table[{self.db}.{tmp_table}] that is left by the try[{state['try_number']}].")
+        self._cleanup(tmp_table, location=state.get('location'))
+        return None
+
+    def _resume(self, state: Dict) -> None:
+        # NOTE: The location is generated in the first execution in `overwrite_versioned` mode.
+        self.location = state.get('location', self.location)
+        self._fingerprint = state.get('fingerprint')
+        # NOTE: The query must be followed on the cluster that runs it.
+        self.presto_conn_id = state.get('presto_conn_id', self.presto_conn_id)
+
+    @staticmethod
+    def _keeps_for_retry(result: Dict, state: Dict, context) -> bool:
+        """Returns whether the temporary table of the finished INSERT is kept for the retry to resume it."""
+        if result['processed'] or not state or state.get('affected_rows') is None:
+            return False
+        return bool(context['ti'].is_eligible_to_retry())
+
+    def _dummy_key(self, location: str = None) -> (str, str):
+        # NOTE: Presto stores the table location without the trailing '/'.
+        bucket, prefix = self._extract_s3_uri((location or self.location).rstrip('/') + '/')
+        return bucket, prefix + '_DUMMY'
+
+    def _create_tmp_table(self, tmp_table: str) -> None:
+        s3: S3Hook = self._s3_hook()
+        presto: PrestoHook = self._presto_hook()
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
 
         # columns detection
         col_stmts: List[str] = []
-        for c in self._desc_columns_by_query(self.sql):
-            col_stmts.append(f"{c['name']} {c['type']}")
+        with self._metrics.phase('schema_detection'):
+            columns = self._detect_columns(self.sql)
+            for c in columns:
+                col_stmts.append(f"{c['name']} {c['type']}")
         logging.info(f"Detect columns{col_stmts}")
 
-        tmp_table = f"__work_airflow_glue_presto_apas" \
-            f"_{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}" \
-            f"_{self._random_str()}"
-
-        bucket, prefix = self._extract_s3_uri(self.location)
-        ordered_partition_kv = self._get_ordered_partition_kv()
-        ordered_partition_values = []
-        for h in ordered_partition_kv:
-            ordered_partition_values.append(h["value"])
-        dummy_fname = '_DUMMY'
-        try:
+        with self._metrics.phase('create_table'):
             # NOTE: Avoid `failed: External location must be a directory`.
-            logging.info(f"Upload '{dummy_fname}' -> s3://{bucket}/{prefix + dummy_fname}")
-            s3.load_string(string_data="", key=prefix + dummy_fname, bucket_name=bucket)
+            bucket, dummy_key = self._dummy_key()
+            logging.info(f"Upload '{dummy_key}' -> s3://{bucket}/{dummy_key}")
+            s3.load_string(string_data="", key=dummy_key, bucket_name=bucket)
 
-            try:
-                prop_stmt = self._prepare_create_table_properties_stmt()
-                sql = f"CREATE TABLE {self.db}.{tmp_table} ( {','.join(col_stmts)} )" \
-                    f" WITH ( {prop_stmt} )"
-                r = presto.get_first(sql)
-                logging.info(f"SQL[{sql}], Result[{r}]")
-                if not r:
-                    raise StateError(f"Fail: SQL[{sql}]")
-                is_created = r[0]
-                if not is_created:
-                    raise StateError(f"Fail: SQL[{sql}]")
-                if not glue.does_table_exists(self.db, tmp_table):
-                    raise StateError(f"Run CREATE TABLE, but the table does not exists: {self.db}.{tmp_table}")
+            prop_stmt = self._prepare_create_table_properties_stmt([c['name'] for c in columns])
+            sql = f"CREATE TABLE {self.db}.{tmp_table} ( {','.join(col_stmts)} )" \
+                f" WITH ( {prop_stmt} )"
+            r = presto.get_first(sql)
+            logging.info(f"SQL[{sql}], Result[{r}]")
+            if not r:
+                raise StateError(f"Fail: SQL[{sql}]")
+            is_created = r[0]
+            if not is_created:
+                raise StateError(f"Fail: SQL[{sql}]")
+            if not glue.does_table_exists(self.db, tmp_table):
+                raise StateError(f"Run CREATE TABLE, but the table does not exists: {self.db}.{tmp_table}")
 
-                query_start_at = datetime.now(timezone.utc)
-                sql = f"INSERT INTO {self.db}.{tmp_table} {self.sql}"
-                r = presto.get_first(f"INSERT INTO {self.db}.{tmp_table} {self.sql}")
-                logging.info(f"SQL[{sql}], Result[{r}]")
-                if not r:
-                    raise StateError(f"Fail: SQL[{sql}]")
-                affected_rows = r[0]
-                if affected_rows > 0:
-                    logging.info(f"The query starts at {query_start_at}.")
-                    self.wait_for(
-                        success_message=f"Table[{self.db}.{tmp_table}] has {affected_rows} rows.",
-                        failure_message=f"Table[{self.db}.{tmp_table}] does not has {affected_rows} rows.",
-                        method=lambda: presto.get_first(f"SELECT COUNT(1) FROM {self.db}.{tmp_table}")[0] == affected_rows
-                    )
-                    self.wait_until_objects_created(
-                        obj_filter=lambda obj: obj.last_modified > query_start_at and obj.content_length > 0
+    def _compute_column_statistics(self, tmp_table: str) -> List[dict]:
+        """Computes ColumnStatistics of Glue for the columns of the temporary table by one query."""
+        presto: PrestoHook = self._presto_hook()
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        targets = []
+        exprs: List[str] = []
+        for c in glue.get_table(db=self.db, name=tmp_table)['StorageDescriptor']['Columns']:
+            stats_type = ColumnStatisticsTypes.get(re.sub(r'\(.*\)$', '', c['Type'].lower()))
+            if not stats_type:
+                continue
+            n = f'"{c["Name"]}"'
+            if stats_type == 'BOOLEAN':
+                exprs.extend([f"count_if({n})", f"count_if(NOT {n})", f"count_if({n} IS NULL)"])
+            elif stats_type == 'STRING':
+                exprs.extend([f"max(length({n}))", f"avg(length({n}))", f"count_if({n} IS NULL)",
+                              f"approx_distinct({n})"])
+            else:
+                exprs.extend([f"min({n})", f"max({n})", f"count_if({n} IS NULL)", f"approx_distinct({n})"])
+            targets.append((c['Name'], c['Type'], stats_type))
+        if not targets:
+            return []
+
+        row = list(presto.get_first(f"SELECT {', '.join(exprs)} FROM {self.db}.{tmp_table}"))
+        analyzed_at = datetime.now(timezone.utc)
+        column_statistics: List[dict] = []
+        for name, hive_type, stats_type in targets:
+            if stats_type == 'BOOLEAN':
+                trues, falses, nulls = row[:3]
+                row = row[3:]
+                data = {'NumberOfTrues': trues, 'NumberOfFalses': falses, 'NumberOfNulls': nulls}
+            elif stats_type == 'STRING':
+                max_length, avg_length, nulls, distinct = row[:4]
+                row = row[4:]
+                data = {'MaximumLength': max_length or 0, 'AverageLength': avg_length or 0.0,
+                        'NumberOfNulls': nulls, 'NumberOfDistinctValues': distinct}
+            else:
+                min_value, max_value, nulls, distinct = row[:4]
+                row = row[4:]
+                if stats_type == 'DATE':
+                    min_value = datetime.strptime(str(min_value), '%Y-%m-%d') if min_value is not None else None
+                    max_value = datetime.strptime(str(max_value), '%Y-%m-%d') if max_value is not None else None
+                data = {'NumberOfNulls': nulls, 'NumberOfDistinctValues': distinct}
+                if min_value is not None:
+                    data['MinimumValue'] = min_value
+                if max_value is not None:
+                    data['MaximumValue'] = max_value
+            data_key = f"{stats_type.capitalize()}ColumnStatisticsData"
+            column_statistics.append({
+                'ColumnName': name,
+                'ColumnType': hive_type,
+                'AnalyzedTime': analyzed_at,
+                'StatisticsData': {'Type': stats_type, data_key: data},
+            })
+        return column_statistics
+
+    def _complete_partition(self, result: Dict, tmp_table: str, state: Dict) -> None:
+        """Verifies the finished INSERT of `state` and converts the temporary table to the partition."""
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        query_id = state['query_id']
+        affected_rows = state['affected_rows']
+        result['location'] = self.location
+        result['presto_conn_id'] = self.presto_conn_id
+        result['query_id'] = query_id
+        result['affected_rows'] = affected_rows
+        if state.get('verified'):
+            logging.info(f"Skip the verification of Table[{self.db}.{tmp_table}] that is already verified.")
+            result['created_objects'] = state.get('created_objects')
+        else:
+            if affected_rows > 0:
+                query_start_at = datetime.fromtimestamp(state['query_start_at'], timezone.utc)
+                logging.info(f"The query starts at {query_start_at}.")
+                with self._metrics.phase('row_verification'):
+                    self._verify_rows(tmp_table=tmp_table, query_id=query_id, affected_rows=affected_rows)
+                with self._metrics.phase('object_verification'):
+                    created_objects = self.wait_until_objects_created(
+                        obj_filter=lambda obj: obj['LastModified'] > query_start_at and obj['Size'] > 0
                     )
+                result['created_objects'] = created_objects.to_dict()
+            state['verified'] = True
+            state['created_objects'] = result['created_objects']
+            self._save_state(tmp_table, state)
+
+        # NOTE: The statistics for the cost-based optimizer of Presto and Hive.
+        parameters = {'numRows': str(affected_rows)}
+        if result['created_objects']:
+            parameters['numFiles'] = str(result['created_objects']['file_count'])
+            parameters['totalSize'] = str(result['created_objects']['total_bytes'])
+        if self._fingerprint:
+            parameters[FingerprintParameterKey] = self._fingerprint
+            result['fingerprint'] = self._fingerprint
+        column_statistics: List[dict] = []
+        if self.column_statistics and affected_rows > 0:
+            with self._metrics.phase('statistics'):
+                # NOTE: The statistics are advisory, so failures do not fail the task.
+                try:
+                    column_statistics = self._compute_column_statistics(tmp_table)
+                except Exception as ex:
+                    logging.warning(f"Cannot compute the column statistics of Table[{self.db}.{tmp_table}]: {ex}")
 
-                if glue.does_partition_exists(db=self.db,
-                                              table_name=self.table,
-                                              partition_values=ordered_partition_values):
+        with self._metrics.phase('partition_swap'):
+            ordered_partition_kv = self._get_ordered_partition_kv()
+            ordered_partition_values = []
+            for h in ordered_partition_kv:
+                ordered_partition_values.append(h["value"])
+            replace = False
+            if glue.does_partition_exists(db=self.db,
+                                          table_name=self.table,
+                                          partition_values=ordered_partition_values):
+                if self.save_mode == OverwriteVersionedSaveMode:
+                    replace = True
+                else:
                     logging.info(f"Delete a partition{ordered_partition_kv}")
                     glue.delete_partition(db=self.db,
                                           table_name=self.table,
                                           partition_values=ordered_partition_values)
-                logging.info(f"Convert table[{self.db}.{tmp_table}]"
-                             f" to partition{ordered_partition_kv}")
-                glue.convert_table_to_partition(src_db=self.db,
-                                                src_table=tmp_table,
-                                                dst_db=self.db,
-                                                dst_table=self.table,
-                                                partition_values=ordered_partition_values)
-            finally:
+            logging.info(f"Convert table[{self.db}.{tmp_table}]"
+                         f" to partition{ordered_partition_kv}" + (" by replacing it" if replace else ""))
+            glue.convert_table_to_partition(src_db=self.db,
+                                            src_table=tmp_table,
+                                            dst_db=self.db,
+                                            dst_table=self.table,
+                                            partition_values=ordered_partition_values,
+                                            replace=replace,
+                                            parameters=parameters)
+        result['processed'] = True
+
+        if column_statistics:
+            with self._metrics.phase('statistics'):
+                try:
+                    errors = glue.update_partition_column_statistics(db=self.db,
+                                                                     table_name=self.table,
+                                                                     partition_values=ordered_partition_values,
+                                                                     column_statistics=column_statistics)
+                except Exception as ex:
+                    # NOTE: The partition is already swapped, so do not let the retry run the INSERT again.
+                    logging.warning(f"Cannot update the column statistics of partition{ordered_partition_kv}: {ex}")
+                    return
+            for e in errors:
+                logging.warning(f"Cannot update the statistics of Column[{e['column']}]: {e['error']}")
+            logging.info(f"Updated the statistics of {len(column_statistics) - len(errors)} columns"
+                         f" of partition{ordered_partition_kv}.")
+
+    def _cleanup(self, tmp_table: str, location: str = None) -> None:
+        s3: S3Hook = self._s3_hook()
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        with self._metrics.phase('cleanup'):
+            try:
                 if glue.does_table_exists(db=self.db, name=tmp_table):
                     glue.delete_table(db=self.db, name=tmp_table)
+            finally:
+                bucket, dummy_key = self._dummy_key(location)
+                s3.delete_objects(bucket, dummy_key)
+
+    def execute(self, context) -> Dict:
+        try:
+            return self._execute(context)
         finally:
-            s3.delete_objects(bucket, prefix + dummy_fname)
+            self._emit_metrics(context)
+
+    def _execute(self, context) -> Dict:
+        if self.execution_mode == RescheduleExecutionMode:
+            return self._execute_reschedulable(context)
+
+        result = self._new_result()
+        tmp_table = self._tmp_table_name_for(context)
+        state = self._load_resumable_state(tmp_table, context)
+        if not state:
+            self._drop_stale_tmp_tables(tmp_table)
+            # NOTE: The skipped execution creates nothing to clean up.
+            with self._metrics.phase('location_prep'):
+                if not self._processable_check_n_prepare_location():
+                    return result
+        try:
+            if state:
+                self._resume(state)
+            else:
+                with self._metrics.phase('routing'):
+                    self._route_presto_conn_id()
+
+                with self._metrics.phase('writer_tuning'):
+                    self._inherit_compression()
+                    self._tune_writers()
+
+                self._create_tmp_table(tmp_table)
+
+                query_start_at = datetime.now(timezone.utc)
+                sql = f"INSERT INTO {self.db}.{tmp_table} {self.sql}"
+                with self._metrics.phase('insert'):
+                    r, query_id = self._presto_hook().get_first_with_query_id(
+                        sql,
+                        progress_callback=self._report_progress if self.progress_interval else None,
+                        progress_interval=self.progress_interval,
+                    )
+                logging.info(f"SQL[{sql}], Result[{r}]")
+                if not r:
+                    raise StateError(f"Fail: SQL[{sql}]")
+                state = {
+                    'query_id': query_id,
+                    'affected_rows': r[0],
+                    'try_number': context['ti'].try_number,
+                    'query_start_at': query_start_at.timestamp(),
+                    'location': self.location,
+                    'fingerprint': self._get_fingerprint(),
+                    'presto_conn_id': self.presto_conn_id,
+                }
+                self._save_state(tmp_table, state)
+            self._complete_partition(result=result, tmp_table=tmp_table, state=state)
+        finally:
+            if self._keeps_for_retry(result, state, context):
+                logging.warning(f"Keep Table[{self.db}.{tmp_table}] for the retry to resume it.")
+            else:
+                self._cleanup(tmp_table)
+        return result
+
+    def _poll_affected_rows(self, state: Dict) -> int:
+        """Returns the affected rows of the submitted INSERT query, or None if the query is running."""
+        presto: PrestoHook = self._presto_hook()
+        try:
+            r = presto.poll(next_uri=state['next_uri'], timeout=self.poll_timeout)
+        except requests.HTTPError as ex:
+            # NOTE: The saved next uri may be expired, so confirm the result by the query info.
+            logging.warning(f"Cannot follow the results of Query[{state['query_id']}]: {ex}")
+            stats = presto.get_write_stats(state['query_id'])
+            if stats['state'] != 'FINISHED' or stats['written_rows'] is None:
+                raise StateError(f"Query[{state['query_id']}] is {stats['state']}.")
+            return stats['written_rows']
+        if r['stats'] and self.progress_interval:
+            self._report_progress(PrestoQueryProgress.from_stats(dict(r['stats'], queryId=state['query_id'])))
+        if not r['finished']:
+            state['next_uri'] = r['next_uri']
+            return None
+        if not r['rows']:
+            raise StateError(f"Query[{state['query_id']}] returns no results.")
+        return r['rows'][0][0]
+
+    def _execute_reschedulable(self, context) -> Dict:
+        # NOTE: AirflowRescheduleException is available from Airflow 1.10.2.
+        from airflow.exceptions import AirflowRescheduleException
+
+        result = self._new_result()
+        tmp_table = self._tmp_table_name_for(context)
+        state = self._load_resumable_state(tmp_table, context)
+        if not state:
+            self._drop_stale_tmp_tables(tmp_table)
+            # NOTE: The skipped execution creates nothing to clean up.
+            with self._metrics.phase('location_prep'):
+                if not self._processable_check_n_prepare_location():
+                    return result
+
+        rescheduled = False
+        try:
+            if not state:
+                with self._metrics.phase('routing'):
+                    self._route_presto_conn_id()
+                with self._metrics.phase('writer_tuning'):
+                    self._inherit_compression()
+                    self._tune_writers()
+                self._create_tmp_table(tmp_table)
+                query_start_at = datetime.now(timezone.utc)
+                with self._metrics.phase('insert'):
+                    state = self._presto_hook().submit(f"INSERT INTO {self.db}.{tmp_table} {self.sql}")
+                state['try_number'] = context['ti'].try_number
+                state['query_start_at'] = query_start_at.timestamp()
+                state['location'] = self.location
+                state['fingerprint'] = self._get_fingerprint()
+                state['presto_conn_id'] = self.presto_conn_id
+                self._save_state(tmp_table, state)
+            else:
+                self._resume(state)
+
+            if state.get('affected_rows') is None:
+                logging.info(f"Poll Query[{state['query_id']}] of Table[{self.db}.{tmp_table}].")
+                with self._metrics.phase('insert'):
+                    affected_rows = self._poll_affected_rows(state)
+                if affected_rows is None:
+                    self._save_state(tmp_table, state)
+                    rescheduled = True
+                    raise AirflowRescheduleException(datetime.now(timezone.utc) + timedelta(seconds=self.poke_interval))
+                state['affected_rows'] = affected_rows
+                self._save_state(tmp_table, state)
+            self._complete_partition(result=result, tmp_table=tmp_table, state=state)
+        finally:
+            if not rescheduled:
+                if self._keeps_for_retry(result, state, context):
+                    logging.warning(f"Keep Table[{self.db}.{tmp_table}] for the retry to resume it.")
+                else:
+                    self._cleanup(tmp_table)
+        return result
+
+    def _emit_metrics(self, context) -> None:
+        """Emits the metrics of the run whether it succeeds or not, and pushes them to XCom."""
+        logging.info(f"Created clients in this process: {dict(hook_registry.created_clients)}")
+        if not self._metrics:
+            return
+        try:
+            metrics = self._metrics.emit(f"glue_presto_apas.{self.dag_id}.{self.task_id}")
+            self.xcom_push(context, key='metrics', value=metrics)
+        except Exception as ex:
+            # NOTE: Do not hide the error of the run by the error of the metrics.
+            logging.warning(f"Cannot emit the metrics of the run: {ex}")
 
 
 class Error(Exception):
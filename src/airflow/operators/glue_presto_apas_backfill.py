@@ -0,0 +1,196 @@
+import logging
+import textwrap
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import jinja2
+from airflow.models import BaseOperator
+from airflow.utils.decorators import apply_defaults
+from typing import Dict, List
+
+from airflow.hooks.glue_presto_apas import GlueDataCatalogHook
+from airflow.hooks.glue_presto_apas import hook_registry
+from airflow.operators.glue_presto_apas import AvailableSaveModes
+from airflow.operators.glue_presto_apas import GluePrestoApasOperator
+
+SuccessState = 'success'
+FailedState = 'failed'
+
+
+def partition_kv_range(
+        key: str,
+        start: str,
+        end: str,
+        fmt: str = '%Y-%m-%d',
+        step: timedelta = timedelta(days=1),
+        fixed_kv: Dict[str, str] = {}) -> List[Dict[str, str]]:
+    """Returns partition_kv list whose `key` values are from `start` to `end` (inclusive)."""
+    if step <= timedelta(0):
+        raise ConfigError(f"step[{step}] must be positive.")
+    current = datetime.strptime(start, fmt)
+    last = datetime.strptime(end, fmt)
+    partition_kvs: List[Dict[str, str]] = []
+    while current <= last:
+        partition_kv = dict(fixed_kv)
+        partition_kv[key] = current.strftime(fmt)
+        partition_kvs.append(partition_kv)
+        current += step
+    return partition_kvs
+
+
+class GluePrestoApasBackfillOperator(BaseOperator):
+    # NOTE: `sql` is rendered for each partition with `partition_kv` in the context.
+    template_fields = [
+        'db',
+        'table',
+        'partition_kvs',
+        'partition_range',
+        'query_header_comment',  # internal use
+    ]
+    template_ext = ['.sql']
+
+    @apply_defaults
+    def __init__(
+            self,
+            db: str,
+            table: str,
+            sql: str,
+            partition_kvs: List[Dict[str, str]] = None,
+            partition_range: Dict = None,
+            max_concurrency: int = 8,
+            fmt: str = 'parquet',
+            additional_properties: Dict[str, str] = {},
+            save_mode: str = 'overwrite',
+            catalog_id: str = None,
+            catalog_region_name: str = None,
+            presto_conn_id: str = 'presto_default',
+            aws_conn_id: str = 'aws_default',
+            apas_options: Dict = {},
+            *args,
+            **kwargs):
+        super().__init__(*args, **kwargs)
+        self.db = db
+        self.table = table
+        self.sql = sql
+        self.partition_kvs = partition_kvs
+        self.partition_range = partition_range
+        self.max_concurrency = max_concurrency
+        self.fmt = fmt
+        self.additional_properties = additional_properties
+        self.save_mode = save_mode
+        self.catalog_id = catalog_id
+        self.catalog_region_name = catalog_region_name
+        self.presto_conn_id = presto_conn_id
+        self.aws_conn_id = aws_conn_id
+        self.apas_options = apas_options
+
+        self.query_header_comment = textwrap.dedent('''
+            -- AirflowLogURL: {{ ti.log_url }}
+            -- AirflowDagID: {{ ti.dag_id }}, TaskID: {{ ti.task_id }}, ExeDate: {{ ti.execution_date }}
+        ''')
+
+        if (partition_kvs is None) == (partition_range is None):
+            raise ConfigError("Either 'partition_kvs' or 'partition_range' must be set.")
+        if apas_options.get('execution_mode', 'blocking') != 'blocking':
+            raise ConfigError("Partitions in a backfill must be processed in 'blocking' execution mode.")
+        if max_concurrency < 1:
+            raise ConfigError(f"max_concurrency[{max_concurrency}] must be positive.")
+        if save_mode not in AvailableSaveModes:
+            raise ConfigError(f"Save mode[{save_mode}] is unsupported."
+                              f" Supported save modes are {AvailableSaveModes}.")
+
+    def _get_partition_kvs(self) -> List[Dict[str, str]]:
+        if self.partition_kvs is not None:
+            return self.partition_kvs
+        return partition_kv_range(**self.partition_range)
+
+    def _apas_operator(self, index: int, partition_kv: Dict[str, str], sql: str) -> GluePrestoApasOperator:
+        op = GluePrestoApasOperator(task_id=f"{self.task_id}.{index}",
+                                    db=self.db,
+                                    table=self.table,
+                                    sql=sql,
+                                    partition_kv=partition_kv,
+                                    fmt=self.fmt,
+                                    additional_properties=self.additional_properties,
+                                    save_mode=self.save_mode,
+                                    catalog_id=self.catalog_id,
+                                    catalog_region_name=self.catalog_region_name,
+                                    presto_conn_id=self.presto_conn_id,
+                                    aws_conn_id=self.aws_conn_id,
+                                    **self.apas_options)
+        op.query_header_comment = self.query_header_comment
+        return op
+
+    def _render_sql(self, context) -> str:
+        # NOTE: The signature of BaseOperator.render_template differs among Airflow 1.10.x releases,
+        #       so render `sql` by the template environment like BaseOperator does.
+        if hasattr(self, 'get_template_env'):
+            jinja_env = self.get_template_env()
+        elif self.has_dag():
+            jinja_env = self.dag.get_template_env()
+        else:
+            jinja_env = jinja2.Environment(cache_size=0)
+        if any(self.sql.endswith(ext) for ext in self.template_ext):
+            return jinja_env.get_template(self.sql).render(**context)
+        return jinja_env.from_string(self.sql).render(**context)
+
+    def _run_partition(self, context, index: int, partition_kv: Dict[str, str]) -> Dict:
+        started_at = time.monotonic()
+        result = {
+            'partition_kv': partition_kv,
+            'state': SuccessState,
+            'error': None,
+            'summary': None,
+            'metrics': None,
+        }
+        try:
+            partition_context = dict(context, partition_kv=partition_kv)
+            sql = self._render_sql(partition_context)
+            op = self._apas_operator(index=index, partition_kv=partition_kv, sql=sql)
+            op.pre_execute(partition_context)
+            # NOTE: The metrics of the partitions are returned in the results instead of XCom of this task.
+            result['summary'] = op._execute(partition_context)
+            result['metrics'] = op._metrics.summary()
+            logging.info(f"Partition{partition_kv} is processed.")
+        except Exception as ex:
+            logging.exception(f"Partition{partition_kv} is failed.")
+            result['state'] = FailedState
+            result['error'] = f"{ex.__class__.__name__}: {ex}"
+        result['duration'] = time.monotonic() - started_at
+        return result
+
+    def pre_execute(self, context) -> None:
+        glue: GlueDataCatalogHook = hook_registry.get_hook(GlueDataCatalogHook,
+                                                           aws_conn_id=self.aws_conn_id,
+                                                           region_name=self.catalog_region_name,
+                                                           catalog_id=self.catalog_id)
+        glue.clear_snapshots()
+
+    def execute(self, context) -> None:
+        partition_kvs = self._get_partition_kvs()
+        logging.info(f"Backfill {len(partition_kvs)} partitions with max_concurrency[{self.max_concurrency}].")
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = [executor.submit(self._run_partition, context, i, kv) for i, kv in enumerate(partition_kvs)]
+            results = [f.result() for f in futures]
+
+        for r in results:
+            logging.info(f"Partition{r['partition_kv']}: {r['state']} ({r['duration']:.1f}s)"
+                         + (f", {r['error']}" if r['error'] else ""))
+        failed = [r for r in results if r['state'] == FailedState]
+        logging.info(f"Backfill is finished: {len(results) - len(failed)} succeeded, {len(failed)} failed.")
+        self.xcom_push(context, key='partition_results', value=results)
+        if failed:
+            raise StateError(f"Partitions{[r['partition_kv'] for r in failed]} are failed.")
+
+
+class Error(Exception):
+    pass
+
+
+class ConfigError(Error):
+    pass
+
+
+class StateError(Error):
+    pass
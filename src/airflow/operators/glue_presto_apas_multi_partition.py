@@ -0,0 +1,200 @@
+import logging
+from datetime import datetime, timezone
+
+from airflow.utils.decorators import apply_defaults
+from typing import Dict, List
+
+from airflow.hooks.glue_presto_apas import GlueDataCatalogHook
+from airflow.hooks.glue_presto_apas import RunMetrics
+from airflow.hooks.glue_presto_apas import S3Hook
+from airflow.operators.glue_presto_apas import BlockingExecutionMode
+from airflow.operators.glue_presto_apas import ErrorIfExistsSaveMode
+from airflow.operators.glue_presto_apas import GluePrestoApasOperator
+from airflow.operators.glue_presto_apas import IgnoreSaveMode
+from airflow.operators.glue_presto_apas import OverwriteSaveMode
+from airflow.operators.glue_presto_apas import SkipIfExistsSaveMode
+
+AvailableSaveModes = [
+    SkipIfExistsSaveMode,
+    ErrorIfExistsSaveMode,
+    IgnoreSaveMode,
+    OverwriteSaveMode,
+]
+
+
+class GluePrestoApasMultiPartitionOperator(GluePrestoApasOperator):
+    """Adds the partitions that `sql` produces by one INSERT.
+
+    `sql` must return the partition keys of the table as the last columns in the order of the keys.
+    The temporary table is partitioned by the keys and written to a new location under the table location,
+    then its partitions are registered to the table by Glue batch APIs with `save_mode` per partition.
+    """
+
+    @apply_defaults
+    def __init__(
+            self,
+            db: str,
+            table: str,
+            sql: str,
+            save_mode: str = 'overwrite',
+            *args,
+            **kwargs):
+        super().__init__(*args, db=db, table=table, sql=sql, partition_kv={}, save_mode=save_mode, **kwargs)
+
+        if save_mode not in AvailableSaveModes:
+            raise ConfigError(f"Save mode[{save_mode}] is unsupported."
+                              f" Supported save modes are {AvailableSaveModes}.")
+        if self.execution_mode != BlockingExecutionMode:
+            raise ConfigError(f"Execution mode[{self.execution_mode}] is unsupported."
+                              f" Partitions are written in '{BlockingExecutionMode}' execution mode.")
+        if self.location:
+            raise ConfigError("'location' cannot be set because a new location is generated in each run.")
+
+    def _check_n_prepare_partition(self) -> None:
+        self._metrics = RunMetrics()
+        with self._metrics.phase('validation'):
+            glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+            if not glue.does_database_exists(name=self.db):
+                raise ConfigError(f"DB[{self.db}] is not found.")
+            if not glue.does_table_exists(db=self.db, name=self.table):
+                raise ConfigError(f"Table[{self.db}.{self.table}] is not found.")
+            if not glue.get_partition_keys(db=self.db, name=self.table):
+                raise ConfigError(f"Table[{self.db}.{self.table}] does not have partition keys.")
+            table_location = glue.get_table_location(db=self.db, name=self.table)
+            if not table_location.endswith('/'):
+                table_location = table_location + '/'
+            # NOTE: Presto and Hive ignore the prefix that starts with '_' when they read the table location.
+            self.location = f"{table_location}_apas_m" \
+                f"{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}_{self._random_str()}/"
+
+    def _detect_columns(self, sql: str) -> List[Dict[str, str]]:
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        columns = super()._detect_columns(sql)
+        partition_keys = glue.get_partition_keys(db=self.db, name=self.table)
+        if [c['name'] for c in columns[-len(partition_keys):]] != partition_keys:
+            raise ConfigError(f"The last columns of sql{[c['name'] for c in columns]}"
+                              f" must be the partition keys{partition_keys}.")
+        return columns
+
+    def _prepare_create_table_properties_stmt(self, column_names: List[str] = []):
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        partitioned_by = ', '.join(f"'{k}'" for k in glue.get_partition_keys(db=self.db, name=self.table))
+        return f"{super()._prepare_create_table_properties_stmt(column_names)},partitioned_by = ARRAY[{partitioned_by}]"
+
+    def _register_partitions(self, result: Dict, tmp_table: str) -> None:
+        s3: S3Hook = self._s3_hook()
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        written = glue.get_partitions(db=self.db, table_name=tmp_table)
+        existing = {
+            tuple(p['Values']): p
+            for p in glue.batch_get_partitions(db=self.db,
+                                               table_name=self.table,
+                                               partition_values_list=[p['Values'] for p in written])
+        }
+        if existing and self.save_mode == ErrorIfExistsSaveMode:
+            raise ConfigError(f"Partitions{list(existing.keys())} already exist"
+                              f" and save_mode[{self.save_mode}] is defined.")
+
+        to_create: List[dict] = []
+        to_update: List[dict] = []
+        to_skip: List[dict] = []
+        for p in written:
+            partition_input = {
+                'Values': p['Values'],
+                'StorageDescriptor': p['StorageDescriptor'],
+                'Parameters': p.get('Parameters', {}),
+            }
+            if tuple(p['Values']) not in existing:
+                to_create.append(partition_input)
+            elif self.save_mode == SkipIfExistsSaveMode:
+                to_skip.append(partition_input)
+            else:
+                to_update.append(partition_input)
+
+        errors = glue.batch_create_partition_inputs(db=self.db, table_name=self.table, partition_inputs=to_create) \
+            + glue.batch_update_partition_inputs(db=self.db, table_name=self.table, partition_inputs=to_update)
+        for e in errors:
+            logging.error(f"Partition{e['values']} is failed: {e['error']}")
+        if errors:
+            raise StateError(f"{len(errors)} partitions are failed: {[e['values'] for e in errors]}")
+        logging.info(f"Partitions are created: {len(to_create)}, updated: {len(to_update)}, skipped: {len(to_skip)}.")
+        result['created'] = [i['Values'] for i in to_create]
+        result['updated'] = [i['Values'] for i in to_update]
+        result['skipped'] = [i['Values'] for i in to_skip]
+
+        # NOTE: Delete objects after the partitions are switched not to make them empty while writing.
+        obsolete_locations = [i['StorageDescriptor']['Location'] for i in to_skip]
+        if self.save_mode == OverwriteSaveMode:
+            obsolete_locations += [existing[tuple(i['Values'])]['StorageDescriptor']['Location'] for i in to_update]
+        # NOTE: Presto stores locations without the trailing '/', and deleting 'hour=1' without it deletes
+        #       'hour=10' and the other siblings too.
+        obsolete_locations = [location.rstrip('/') + '/' for location in obsolete_locations]
+        for location in obsolete_locations:
+            if self.location.startswith(location):
+                logging.warning(f"Skip deleting location[{location}] because it includes the written objects.")
+                continue
+            bucket, prefix = self._extract_s3_uri(location)
+            summary = s3.delete_prefix(bucket_name=bucket, prefix=prefix, concurrency=self.delete_concurrency)
+            logging.info(f"Deleted {summary} in location[{location}].")
+
+    def _execute(self, context) -> Dict:
+        s3: S3Hook = self._s3_hook()
+        result = {
+            'location': self.location,
+            'processed': False,
+            'query_id': None,
+            'affected_rows': None,
+            'created': [],
+            'updated': [],
+            'skipped': [],
+        }
+        with self._metrics.phase('routing'):
+            self._route_presto_conn_id()
+        result['presto_conn_id'] = self.presto_conn_id
+        with self._metrics.phase('writer_tuning'):
+            self._inherit_compression()
+            self._tune_writers()
+
+        tmp_table = self._gen_tmp_table_name()
+        try:
+            self._create_tmp_table(tmp_table)
+
+            sql = f"INSERT INTO {self.db}.{tmp_table} {self.sql}"
+            with self._metrics.phase('insert'):
+                r, query_id = self._presto_hook().get_first_with_query_id(
+                    sql,
+                    progress_callback=self._report_progress if self.progress_interval else None,
+                    progress_interval=self.progress_interval,
+                )
+            logging.info(f"SQL[{sql}], Result[{r}]")
+            if not r:
+                raise StateError(f"Fail: SQL[{sql}]")
+            result['query_id'] = query_id
+            result['affected_rows'] = r[0]
+            if r[0] > 0:
+                with self._metrics.phase('row_verification'):
+                    self._verify_rows(tmp_table=tmp_table, query_id=query_id, affected_rows=r[0])
+            with self._metrics.phase('partition_swap'):
+                self._register_partitions(result=result, tmp_table=tmp_table)
+            result['processed'] = True
+        finally:
+            self._cleanup(tmp_table)
+            if not result['processed']:
+                with self._metrics.phase('cleanup'):
+                    bucket, prefix = self._extract_s3_uri(self.location)
+                    summary = s3.delete_prefix(bucket_name=bucket, prefix=prefix,
+                                               concurrency=self.delete_concurrency)
+                    logging.info(f"Deleted {summary} in location[{self.location}] that is not registered.")
+        return result
+
+
+class Error(Exception):
+    pass
+
+
+class ConfigError(Error):
+    pass
+
+
+class StateError(Error):
+    pass
@@ -0,0 +1,180 @@
+import logging
+import re
+from datetime import datetime, timedelta, timezone
+
+from airflow.models import BaseOperator
+from airflow.utils.decorators import apply_defaults
+from typing import Dict, List
+
+from airflow.hooks.glue_presto_apas import GlueDataCatalogHook
+from airflow.hooks.glue_presto_apas import S3DeletionSummary
+from airflow.hooks.glue_presto_apas import S3Hook
+from airflow.hooks.glue_presto_apas import hook_registry
+from airflow.operators.glue_presto_apas import VersionedLocationPattern
+from airflow.operators.glue_presto_apas import VersionedLocationPrefix
+
+
+class GluePrestoApasVersionGcOperator(BaseOperator):
+    """Deletes old version locations that `overwrite_versioned` mode of GluePrestoApasOperator leaves.
+
+    A version older than the current location of the partition is deleted once `retention` passes since
+    the next version is created. Versions newer than the current location may be written by running tasks,
+    so they are kept. The objects that are written to the partition location before the first version,
+    i.e. outside of the version locations, are deleted once `retention` passes since the first version is created.
+    """
+    template_fields = [
+        'db',
+        'table',
+        'partition_kvs',
+    ]
+
+    @apply_defaults
+    def __init__(
+            self,
+            db: str,
+            table: str,
+            partition_kvs: List[Dict[str, str]] = None,
+            retention: timedelta = timedelta(hours=6),
+            delete_concurrency: int = 8,
+            catalog_id: str = None,
+            catalog_region_name: str = None,
+            aws_conn_id: str = 'aws_default',
+            *args,
+            **kwargs):
+        super().__init__(*args, **kwargs)
+        self.db = db
+        self.table = table
+        self.partition_kvs = partition_kvs
+        self.retention = retention
+        self.delete_concurrency = delete_concurrency
+        self.catalog_id = catalog_id
+        self.catalog_region_name = catalog_region_name
+        self.aws_conn_id = aws_conn_id
+
+        if retention < timedelta(0):
+            raise ConfigError(f"retention[{retention}] must not be negative.")
+
+    def _glue_data_catalog_hook(self) -> GlueDataCatalogHook:
+        return hook_registry.get_hook(GlueDataCatalogHook,
+                                      aws_conn_id=self.aws_conn_id,
+                                      region_name=self.catalog_region_name,
+                                      catalog_id=self.catalog_id)
+
+    def _s3_hook(self) -> S3Hook:
+        return hook_registry.get_hook(S3Hook, aws_conn_id=self.aws_conn_id)
+
+    @staticmethod
+    def _extract_s3_uri(uri) -> (str, str):
+        m = re.search('^s3://([^/]+)/(.+)', uri)
+        if not m:
+            raise Error(f"URI[{uri}] is invalid for S3.")
+        bucket = m.group(1)
+        prefix = m.group(2)
+        return bucket, prefix
+
+    @staticmethod
+    def _version_created_at(location: str) -> datetime:
+        m = VersionedLocationPattern.match(location)
+        return datetime.strptime(m.group(2), '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+
+    def _get_partitions(self) -> List[dict]:
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        if self.partition_kvs is None:
+            return glue.get_partitions(db=self.db, table_name=self.table)
+        partition_keys = glue.get_partition_keys(db=self.db, name=self.table)
+        return glue.batch_get_partitions(db=self.db,
+                                         table_name=self.table,
+                                         partition_values_list=[[kv[k] for k in partition_keys]
+                                                                for kv in self.partition_kvs])
+
+    def _list_versions(self, root: str) -> List[str]:
+        s3: S3Hook = self._s3_hook()
+        bucket, prefix = self._extract_s3_uri(root)
+        versions = [
+            f"s3://{bucket}/{p}"
+            for p in s3.list_prefixes(bucket_name=bucket, prefix=prefix + VersionedLocationPrefix, delimiter='/') or []
+            if VersionedLocationPattern.match(f"s3://{bucket}/{p}")
+        ]
+        versions.sort(key=lambda v: (self._version_created_at(v), v))
+        return versions
+
+    def _expired_versions(self, current_location: str, versions: List[str], expire_before: datetime) -> List[str]:
+        expired: List[str] = []
+        older = versions[:versions.index(current_location)]
+        for version, next_version in zip(older, versions[1:]):
+            # NOTE: A version is read until the next version replaces it.
+            if self._version_created_at(next_version) < expire_before:
+                expired.append(version)
+        return expired
+
+    def _delete_unversioned(self, root: str) -> S3DeletionSummary:
+        """Deletes the objects under `root` that are outside of the version locations."""
+        s3: S3Hook = self._s3_hook()
+        bucket, prefix = self._extract_s3_uri(root)
+        # NOTE: Objects just under `root` are listed with the delimiter not to list all objects in the versions.
+        summaries = [s3.delete_prefix(bucket_name=bucket, prefix=prefix, concurrency=self.delete_concurrency,
+                                      delimiter='/')]
+        for p in s3.iter_prefixes(bucket_name=bucket, prefix=prefix, delimiter='/'):
+            if p[len(prefix):].startswith(VersionedLocationPrefix):
+                continue
+            summaries.append(s3.delete_prefix(bucket_name=bucket, prefix=p, concurrency=self.delete_concurrency))
+        return S3DeletionSummary(deleted_count=sum(s.deleted_count for s in summaries),
+                                 deleted_bytes=sum(s.deleted_bytes for s in summaries),
+                                 elapsed_seconds=sum(s.elapsed_seconds for s in summaries))
+
+    def execute(self, context) -> Dict:
+        s3: S3Hook = self._s3_hook()
+        self._glue_data_catalog_hook().clear_snapshots()
+        expire_before = datetime.now(timezone.utc) - self.retention
+        deleted_locations: List[str] = []
+        deleted_count = 0
+        deleted_bytes = 0
+        for p in self._get_partitions():
+            location = p['StorageDescriptor'].get('Location', '')
+            m = VersionedLocationPattern.match(location)
+            if not m:
+                logging.debug(f"Skip Partition{p['Values']} because Location[{location}] is not versioned.")
+                continue
+            # NOTE: Presto stores the location without the trailing '/', and the listed versions have it.
+            current_location = location.rstrip('/') + '/'
+            root = m.group(1)
+            versions = self._list_versions(root)
+            if current_location not in versions:
+                logging.warning(f"The current location[{current_location}] is not found in the versions{versions}.")
+                continue
+            summaries: List[S3DeletionSummary] = []
+            for version in self._expired_versions(current_location=current_location,
+                                                  versions=versions,
+                                                  expire_before=expire_before):
+                bucket, prefix = self._extract_s3_uri(version)
+                summary = s3.delete_prefix(bucket_name=bucket, prefix=prefix, concurrency=self.delete_concurrency)
+                logging.info(f"Deleted {summary} in the expired version location[{version}].")
+                deleted_locations.append(version)
+                summaries.append(summary)
+            # NOTE: The objects written before the first version are read until the first version replaces them.
+            if self._version_created_at(versions[0]) < expire_before:
+                summary = self._delete_unversioned(root)
+                if summary.deleted_count:
+                    logging.info(f"Deleted {summary} outside of the versions in location[{root}].")
+                summaries.append(summary)
+            deleted_count += sum(s.deleted_count for s in summaries)
+            deleted_bytes += sum(s.deleted_bytes for s in summaries)
+        logging.info(f"Deleted {len(deleted_locations)} expired versions and the objects outside of the versions:"
+                     f" {deleted_count} objects ({deleted_bytes} bytes).")
+        return {
+            'deleted_locations': deleted_locations,
+            'deleted_count': deleted_count,
+            'deleted_bytes': deleted_bytes,
+        }
+
+    def post_execute(self, context, *args, **kwargs):
+        logging.info(f"Created clients in this process: {dict(hook_registry.created_clients)}")
+        super().post_execute(context, *args, **kwargs)
+
+
+class Error(Exception):
+    pass
+
+
+class ConfigError(Error):
+    pass
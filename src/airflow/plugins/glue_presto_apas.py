@@ -2,7 +2,12 @@ from airflow.plugins_manager import AirflowPlugin
 
 from airflow.hooks.glue_presto_apas import GlueDataCatalogHook
 from airflow.operators.glue_add_partition import GlueAddPartitionOperator
+from airflow.operators.glue_partition_discovery import GluePartitionDiscoveryOperator
 from airflow.operators.glue_presto_apas import GluePrestoApasOperator
+from airflow.operators.glue_presto_apas_backfill import GluePrestoApasBackfillOperator
+from airflow.operators.glue_presto_apas_multi_partition import GluePrestoApasMultiPartitionOperator
+from airflow.operators.glue_presto_apas_version_gc import GluePrestoApasVersionGcOperator
+from airflow.sensors.glue_partition import GluePartitionSensor
 
 
 class GluePrestoApasPlugin(AirflowPlugin):
@@ -10,5 +15,10 @@ class GluePrestoApasPlugin(AirflowPlugin):
     operators = [
         GluePrestoApasOperator,
         GlueAddPartitionOperator,
+        GluePrestoApasBackfillOperator,
+        GluePrestoApasMultiPartitionOperator,
+        GluePrestoApasVersionGcOperator,
+        GluePartitionDiscoveryOperator,
     ]
+    sensors = [GluePartitionSensor]
     hooks = [GlueDataCatalogHook]
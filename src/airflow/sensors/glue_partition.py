@@ -0,0 +1,98 @@
+import logging
+
+from airflow.sensors.base_sensor_operator import BaseSensorOperator
+from airflow.utils.decorators import apply_defaults
+from typing import Dict, List
+
+from airflow.hooks.glue_presto_apas import GlueDataCatalogHook
+from airflow.hooks.glue_presto_apas import hook_registry
+from airflow.hooks.glue_presto_apas import partition_index
+
+
+class GluePartitionSensor(BaseSensorOperator):
+    """Waits for partitions in Glue Data Catalog.
+
+    Lookups are served by the partition index that is shared among the sensors for the same table,
+    so the sensors poll Glue by one GetPartitions call per table and `index_ttl` seconds.
+    """
+    template_fields = [
+        'db',
+        'table',
+        'partition_kv',
+        'partition_kvs',
+    ]
+
+    @apply_defaults
+    def __init__(
+            self,
+            db: str,
+            table: str,
+            partition_kv: Dict[str, str] = None,
+            partition_kvs: List[Dict[str, str]] = None,
+            index_ttl: int = 60,
+            index_dir: str = None,
+            catalog_id: str = None,
+            catalog_region_name: str = None,
+            aws_conn_id: str = 'aws_default',
+            *args,
+            **kwargs):
+        super().__init__(*args, **kwargs)
+        self.db = db
+        self.table = table
+        self.partition_kv = partition_kv
+        self.partition_kvs = partition_kvs
+        self.index_ttl = index_ttl
+        self.index_dir = index_dir
+        self.catalog_id = catalog_id
+        self.catalog_region_name = catalog_region_name
+        self.aws_conn_id = aws_conn_id
+
+        if (partition_kv is None) == (partition_kvs is None):
+            raise ConfigError("Either 'partition_kv' or 'partition_kvs' must be set.")
+
+    def _glue_data_catalog_hook(self) -> GlueDataCatalogHook:
+        return hook_registry.get_hook(GlueDataCatalogHook,
+                                      aws_conn_id=self.aws_conn_id,
+                                      region_name=self.catalog_region_name,
+                                      catalog_id=self.catalog_id)
+
+    def _get_partition_values_list(self) -> List[List[str]]:
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        partition_keys = glue.get_partition_keys(db=self.db, name=self.table)
+        partition_values_list: List[List[str]] = []
+        for kv in (self.partition_kvs if self.partition_kvs is not None else [self.partition_kv]):
+            if sorted(kv.keys()) != sorted(partition_keys):
+                raise ConfigError(f"partition_kv{kv} must have the partition keys{partition_keys}.")
+            partition_values_list.append([kv[k] for k in partition_keys])
+        return partition_values_list
+
+    def poke(self, context) -> bool:
+        glue: GlueDataCatalogHook = self._glue_data_catalog_hook()
+        partition_values_list = self._get_partition_values_list()
+        # NOTE: Keep the waiters registered between the pokes so that the other sensors fetch them together.
+        exists = partition_index.lookup(glue=glue,
+                                        db=self.db,
+                                        table_name=self.table,
+                                        partition_values_list=partition_values_list,
+                                        ttl=self.index_ttl,
+                                        waiter_ttl=self.poke_interval * 2 + self.index_ttl,
+                                        index_dir=self.index_dir)
+        missing = [v for v, e in zip(partition_values_list, exists) if not e]
+        if missing:
+            logging.info(f"Waiting for {len(missing)} partitions of Table[{self.db}.{self.table}]: {missing[:10]}")
+            return False
+        partition_index.unregister(glue=glue,
+                                   db=self.db,
+                                   table_name=self.table,
+                                   partition_values_list=partition_values_list,
+                                   index_dir=self.index_dir)
+        logging.info(f"{len(partition_values_list)} partitions of Table[{self.db}.{self.table}] exist.")
+        return True
+
+
+class Error(Exception):
+    pass
+
+
+class ConfigError(Error):
+    pass
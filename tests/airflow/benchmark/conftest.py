@@ -0,0 +1,45 @@
+import json
+import logging
+import os
+from typing import Dict, List
+
+import pytest
+
+# NOTE: Write the report of the benchmark as JSON to this path if set.
+ReportPathEnv = 'GLUE_PRESTO_APAS_BENCHMARK_REPORT'
+
+
+class BenchmarkReport(object):
+    """Records the latency and the API calls per phase of operator runs, and checks them with call budgets."""
+
+    def __init__(self):
+        self.entries: List[dict] = []
+
+    def check(self, name: str, summary: dict, budget: Dict[str, Dict[str, int]]) -> None:
+        """Records `summary` of RunMetrics and fails if a phase calls an API more than its budget."""
+        self.entries.append({'name': name, 'summary': summary, 'budget': budget})
+        regressions: List[str] = []
+        for phase, p in summary['phases'].items():
+            for call, count in p['calls'].items():
+                allowed = budget.get(phase, {}).get(call, 0)
+                if count > allowed:
+                    regressions.append(f"{name}: {phase}: {call} is called {count} times (budget: {allowed})")
+        assert not regressions, "Call budgets regress:\n" + '\n'.join(regressions)
+
+    def log(self) -> None:
+        for e in self.entries:
+            phases = ', '.join(f"{k}={v['seconds']:.3f}s{v['calls']}" for k, v in e['summary']['phases'].items())
+            logging.info(f"{e['name']}: {e['summary']['seconds']:.3f}s ({phases})")
+
+    def write(self, path: str) -> None:
+        with open(path, 'w') as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+
+
+@pytest.fixture(scope='session')
+def benchmark_report():
+    report = BenchmarkReport()
+    yield report
+    report.log()
+    if os.environ.get(ReportPathEnv):
+        report.write(os.environ[ReportPathEnv])
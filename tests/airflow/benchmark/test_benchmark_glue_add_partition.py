@@ -0,0 +1,97 @@
+import math
+from datetime import date, timedelta
+from typing import Dict
+
+import pytest
+
+from airflow.hooks.glue_presto_apas import BatchCreatePartitionLimit
+from airflow.hooks.glue_presto_apas import BatchGetPartitionLimit
+from airflow.hooks.glue_presto_apas import BatchUpdatePartitionLimit
+from airflow.operators.glue_add_partition import GlueAddPartitionOperator
+from glue_presto_apas_fakes import AwsConnId, Db, Region, gen_columns
+
+
+def _pages(n: int, page_size: int) -> int:
+    return max(1, math.ceil(n / page_size))
+
+
+def add_partition_call_budget(overwrite: bool) -> Dict[str, Dict[str, int]]:
+    """Returns the API calls per phase that one run of GlueAddPartitionOperator with `partition_kv` may make."""
+    return {
+        'validation': {'glue.GetDatabase': 1, 'glue.GetTable': 1},
+        'location_check': {'s3.ListObjectsV2': 1},
+        'existence_check': {'glue.GetPartition': 1},
+        'mutation': {'glue.UpdatePartition' if overwrite else 'glue.CreatePartition': 1},
+    }
+
+
+def add_partitions_call_budget(partitions: int, overwrite: bool) -> Dict[str, Dict[str, int]]:
+    """Returns the API calls per phase that one run of GlueAddPartitionOperator with `partition_kvs` may make."""
+    return {
+        'validation': {'glue.GetDatabase': 1, 'glue.GetTable': 1},
+        'existence_check': {'glue.BatchGetPartition': _pages(partitions, BatchGetPartitionLimit)},
+        'location_check': {'s3.ListObjectsV2': partitions},
+        'mutation': {
+            'glue.BatchUpdatePartition': _pages(partitions, BatchUpdatePartitionLimit),
+        } if overwrite else {
+            'glue.BatchCreatePartition': _pages(partitions, BatchCreatePartitionLimit),
+        },
+    }
+
+
+def _dts(partitions: int):
+    return [(date(2019, 1, 1) + timedelta(days=i)).isoformat() for i in range(partitions)]
+
+
+@pytest.mark.parametrize('partitions', [
+    pytest.param(1, id='p1'),
+    pytest.param(5, id='p5'),
+])
+def test_glue_add_partition_operator(aws, benchmark_report, partitions):
+    table = f"add_partition_p{partitions}"
+    location = aws.create_table(table, columns=gen_columns(3))
+    for dt in _dts(partitions):
+        aws.put_objects(f"{location}dt={dt}/", count=1)
+
+    for overwrite in [False, True]:
+        for dt in _dts(partitions):
+            op = GlueAddPartitionOperator(task_id=f"add_partition_{dt}",
+                                          db=Db,
+                                          table=table,
+                                          partition_kv={'dt': dt},
+                                          catalog_region_name=Region,
+                                          aws_conn_id=AwsConnId)
+            op.pre_execute(context={})
+            op.execute(context={})
+            benchmark_report.check(name=f"{table}.{dt}{'.overwrite' if overwrite else ''}",
+                                   summary=op._metrics.summary(),
+                                   budget=add_partition_call_budget(overwrite=overwrite))
+
+    assert len(aws.get_partitions(table)) == partitions
+
+
+@pytest.mark.parametrize('partitions', [
+    pytest.param(10, id='p10'),
+    pytest.param(250, id='p250'),
+    pytest.param(1200, id='p1200'),
+])
+def test_glue_add_partition_operator_with_partition_kvs(aws, benchmark_report, partitions):
+    table = f"add_partitions_p{partitions}"
+    location = aws.create_table(table, columns=gen_columns(3))
+    for dt in _dts(partitions):
+        aws.put_objects(f"{location}dt={dt}/", count=1)
+
+    for overwrite in [False, True]:
+        op = GlueAddPartitionOperator(task_id='add_partitions',
+                                      db=Db,
+                                      table=table,
+                                      partition_kvs=[{'dt': dt} for dt in _dts(partitions)],
+                                      catalog_region_name=Region,
+                                      aws_conn_id=AwsConnId)
+        op.pre_execute(context={})
+        op.execute(context={})
+        benchmark_report.check(name=f"{table}{'.overwrite' if overwrite else ''}",
+                               summary=op._metrics.summary(),
+                               budget=add_partitions_call_budget(partitions=partitions, overwrite=overwrite))
+
+    assert len(aws.get_partitions(table)) == partitions
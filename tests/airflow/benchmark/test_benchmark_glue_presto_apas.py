@@ -0,0 +1,137 @@
+import math
+from typing import Dict
+
+import pytest
+
+from airflow.hooks.glue_presto_apas import GlueDataCatalogError
+from airflow.hooks.glue_presto_apas import GlueDataCatalogHook
+from airflow.operators.glue_presto_apas import GluePrestoApasOperator
+from glue_presto_apas_fakes import AwsConnId, Db, PrestoConnId, Region, gen_columns, gen_context
+
+# NOTE: The page size of ListObjectsV2 and the max keys of DeleteObjects.
+S3PageSize = 1000
+
+
+def _pages(n: int, page_size: int) -> int:
+    return max(1, math.ceil(n / page_size))
+
+
+def apas_call_budget(files: int, overwrite: bool) -> Dict[str, Dict[str, int]]:
+    """Returns the API calls per phase that one run of GluePrestoApasOperator may make."""
+    budget = {
+        'validation': {'glue.GetDatabase': 1, 'glue.GetTable': 1},
+        'location_prep': {'s3.ListObjectsV2': 1},
+        'schema_detection': {'presto.get_result_columns': 1},
+        'create_table': {'s3.HeadObject': 1, 's3.PutObject': 1, 'presto.get_first': 1, 'glue.GetTable': 1},
+        'insert': {'presto.get_first': 1},
+        # NOTE: The state is loaded, and saved after the INSERT and after the verification. The tables that
+        #       other task instances keep for the partition are listed.
+        'state': {'glue.GetTable': 3, 'glue.UpdateTable': 2, 'glue.GetTables': 1},
+        'row_verification': {'presto.get_first': 1},
+        # NOTE: The dummy object is listed with the created objects.
+        'object_verification': {'s3.ListObjectsV2': _pages(files + 1, S3PageSize)},
+        'partition_swap': {'glue.GetPartition': 1, 'glue.GetTable': 1, 'glue.CreatePartition': 1,
+                           'glue.DeleteTable': 1},
+        'cleanup': {'glue.GetTable': 1, 's3.DeleteObjects': 1},
+    }
+    if overwrite:
+        budget['location_prep'] = {'s3.ListObjectsV2': 1 + _pages(files, S3PageSize),
+                                   's3.DeleteObjects': _pages(files, S3PageSize)}
+        budget['partition_swap']['glue.DeletePartition'] = 1
+    return budget
+
+
+@pytest.mark.parametrize('partitions,files,columns', [
+    pytest.param(1, 1, 3, id='p1-f1-c3'),
+    pytest.param(4, 20, 50, id='p4-f20-c50'),
+    pytest.param(2, 1500, 300, id='p2-f1500-c300'),
+])
+def test_glue_presto_apas_operator(aws, presto, benchmark_report, partitions, files, columns):
+    table = f"apas_p{partitions}_f{files}_c{columns}"
+    aws.create_table(table, columns=gen_columns(columns))
+    presto.columns = gen_columns(columns)
+    presto.files = files
+    presto.rows = files * 100
+
+    # NOTE: The second round overwrites the partitions that the first round creates.
+    for overwrite in [False, True]:
+        for i in range(partitions):
+            dt = f"2019-06-{i + 1:02d}"
+            op = GluePrestoApasOperator(task_id=f"apas_{i}",
+                                        db=Db,
+                                        table=table,
+                                        sql=f"SELECT * FROM {Db}.source WHERE dt = '{dt}'",
+                                        partition_kv={'dt': dt},
+                                        progress_interval=0,
+                                        catalog_region_name=Region,
+                                        presto_conn_id=PrestoConnId,
+                                        aws_conn_id=AwsConnId)
+            context = gen_context(f"apas_{i}")
+            op.pre_execute(context=context)
+            result = op.execute(context=context)
+            assert result['processed']
+            assert result['affected_rows'] == presto.rows
+            assert result['created_objects']['file_count'] == files
+            benchmark_report.check(name=f"{table}.{dt}{'.overwrite' if overwrite else ''}",
+                                   summary=op._metrics.summary(),
+                                   budget=apas_call_budget(files=files, overwrite=overwrite))
+
+    partitions_in_glue = aws.get_partitions(table)
+    assert len(partitions_in_glue) == partitions
+    for p in partitions_in_glue:
+        assert [c['Name'] for c in p['StorageDescriptor']['Columns']] == [c['name'] for c in gen_columns(columns)]
+    assert not [t for t in aws.glue.get_tables(DatabaseName=Db)['TableList'] if t['Name'].startswith('__work_')]
+
+
+def resume_call_budget() -> Dict[str, Dict[str, int]]:
+    """Returns the API calls per phase that the retry resuming the verified INSERT may make."""
+    return {
+        'validation': {'glue.GetDatabase': 1, 'glue.GetTable': 1},
+        'state': {'glue.GetTable': 1},
+        'partition_swap': {'glue.GetPartition': 1, 'glue.GetTable': 1, 'glue.CreatePartition': 1,
+                           'glue.DeleteTable': 1},
+        'cleanup': {'glue.GetTable': 1, 's3.DeleteObjects': 1},
+    }
+
+
+def test_glue_presto_apas_operator_resumes_on_retry(aws, presto, benchmark_report, monkeypatch):
+    table = 'apas_resume'
+    aws.create_table(table, columns=gen_columns(3))
+    presto.columns = gen_columns(3)
+
+    # NOTE: Fail the first partition swap like Glue throttling.
+    convert_table_to_partition = GlueDataCatalogHook.convert_table_to_partition
+    failures = []
+
+    def flaky_convert_table_to_partition(self, *args, **kwargs):
+        if not failures:
+            failures.append(True)
+            raise GlueDataCatalogError('Rate exceeded')
+        return convert_table_to_partition(self, *args, **kwargs)
+
+    monkeypatch.setattr(GlueDataCatalogHook, 'convert_table_to_partition', flaky_convert_table_to_partition)
+
+    results = []
+    for try_number in [1, 2]:
+        op = GluePrestoApasOperator(task_id='apas_resume',
+                                    db=Db,
+                                    table=table,
+                                    sql=f"SELECT * FROM {Db}.source WHERE dt = '2019-06-01'",
+                                    partition_kv={'dt': '2019-06-01'},
+                                    progress_interval=0,
+                                    catalog_region_name=Region,
+                                    presto_conn_id=PrestoConnId,
+                                    aws_conn_id=AwsConnId)
+        context = gen_context('apas_resume', try_number=try_number, retries=1)
+        op.pre_execute(context=context)
+        if try_number == 1:
+            with pytest.raises(GlueDataCatalogError):
+                op.execute(context=context)
+            continue
+        results.append(op.execute(context=context))
+        benchmark_report.check(name=f"{table}.retry", summary=op._metrics.summary(), budget=resume_call_budget())
+
+    assert results[0]['processed']
+    assert results[0]['affected_rows'] == presto.rows
+    assert len(aws.get_partitions(table)) == 1
+    assert not [t for t in aws.glue.get_tables(DatabaseName=Db)['TableList'] if t['Name'].startswith('__work_')]
@@ -0,0 +1,37 @@
+import boto3
+import pytest
+
+from airflow.hooks.glue_presto_apas import hook_registry
+from glue_presto_apas_fakes import AwsConnId, AwsStandIn, Bucket, Db, FakePrestoCoordinator, PrestoConnId, Region
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    moto = pytest.importorskip('moto')
+    for k, v in [('AWS_ACCESS_KEY_ID', 'test'),
+                 ('AWS_SECRET_ACCESS_KEY', 'test'),
+                 ('AWS_SECURITY_TOKEN', 'test'),
+                 ('AWS_SESSION_TOKEN', 'test'),
+                 ('AWS_DEFAULT_REGION', Region),
+                 (f"AIRFLOW_CONN_{AwsConnId.upper()}", 'aws://')]:
+        monkeypatch.setenv(k, v)
+    with moto.mock_glue(), moto.mock_s3():
+        # NOTE: Clients cached in the hooks must be created in this mock.
+        hook_registry.clear()
+        stand_in = AwsStandIn(glue=boto3.client('glue', region_name=Region),
+                              s3=boto3.client('s3', region_name=Region))
+        stand_in.s3.create_bucket(Bucket=Bucket)
+        stand_in.glue.create_database(DatabaseInput={'Name': Db})
+        yield stand_in
+        hook_registry.clear()
+
+
+@pytest.fixture
+def presto(aws, monkeypatch):
+    coordinator = FakePrestoCoordinator(aws)
+    coordinator.start()
+    monkeypatch.setenv(f"AIRFLOW_CONN_{PrestoConnId.upper()}",
+                       f"presto://test@127.0.0.1:{coordinator.port}/{Db}")
+    yield coordinator
+    hook_registry.clear()
+    coordinator.stop()
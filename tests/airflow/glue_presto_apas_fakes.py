@@ -0,0 +1,427 @@
+"""Glue, S3 and Presto stand-ins shared by the plugin tests and the benchmark."""
+
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Dict, List
+
+Region = 'us-east-1'
+Bucket = 'airflow-glue-presto-apas-test'
+Db = 'test_db'
+AwsConnId = 'aws_test'
+PrestoConnId = 'presto_test'
+
+ParquetInputFormat = 'org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat'
+ParquetOutputFormat = 'org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat'
+ParquetSerde = 'org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe'
+ColumnTypes = ['bigint', 'varchar', 'double', 'boolean', 'timestamp']
+
+
+def gen_columns(n: int) -> List[Dict[str, str]]:
+    return [{'name': f"c{i}", 'type': ColumnTypes[i % len(ColumnTypes)]} for i in range(n)]
+
+
+def _storage_descriptor(columns: List[Dict[str, str]], location: str) -> dict:
+    return {
+        'Columns': [{'Name': c['name'], 'Type': c['type']} for c in columns],
+        'Location': location,
+        'InputFormat': ParquetInputFormat,
+        'OutputFormat': ParquetOutputFormat,
+        'Compressed': False,
+        'SerdeInfo': {'SerializationLibrary': ParquetSerde, 'Parameters': {}},
+    }
+
+
+class TaskInstanceStandIn(object):
+    """Attributes of TaskInstance that the operators read from the context."""
+
+    def __init__(self, task_id: str, try_number: int = 1, retries: int = 0):
+        self.dag_id = 'test_dag'
+        self.task_id = task_id
+        self.execution_date = datetime(2019, 6, 1, tzinfo=timezone.utc)
+        self.try_number = try_number
+        self.retries = retries
+        self.xcoms: Dict[str, object] = {}
+
+    def is_eligible_to_retry(self) -> bool:
+        return self.try_number <= self.retries
+
+    def xcom_push(self, key: str, value, execution_date: datetime = None) -> None:
+        self.xcoms[key] = value
+
+
+def gen_context(task_id: str, try_number: int = 1, retries: int = 0) -> dict:
+    return {'ti': TaskInstanceStandIn(task_id=task_id, try_number=try_number, retries=retries)}
+
+
+class AwsStandIn(object):
+    """Glue and S3 mocked by moto, and clients for the setup that are not counted by the operators."""
+
+    def __init__(self, glue, s3):
+        self.glue = glue
+        self.s3 = s3
+
+    def create_table(self, name: str, columns: List[Dict[str, str]], partition_keys: List[str] = ['dt'],
+                     partition_key_type: str = 'string') -> str:
+        """Creates a table partitioned by `partition_keys` of `partition_key_type`, and returns its location."""
+        location = f"s3://{Bucket}/{name}/"
+        self.glue.create_table(DatabaseName=Db, TableInput={
+            'Name': name,
+            'TableType': 'EXTERNAL_TABLE',
+            'StorageDescriptor': _storage_descriptor(columns, location),
+            'PartitionKeys': [{'Name': k, 'Type': partition_key_type} for k in partition_keys],
+        })
+        return location
+
+    def create_partition(self, table: str, values: List[str], location: str) -> None:
+        """Creates a partition whose location does not end with '/' like partitions that Presto creates."""
+        columns = self.glue.get_table(DatabaseName=Db, Name=table)['Table']['StorageDescriptor']['Columns']
+        self.glue.create_partition(DatabaseName=Db, TableName=table, PartitionInput={
+            'Values': values,
+            'StorageDescriptor': _storage_descriptor([{'name': c['Name'], 'type': c['Type']} for c in columns],
+                                                     location.rstrip('/')),
+        })
+
+    def list_keys(self, location: str) -> List[str]:
+        prefix = location.split('/', 3)[3]
+        keys: List[str] = []
+        for page in self.s3.get_paginator('list_objects_v2').paginate(Bucket=Bucket, Prefix=prefix):
+            keys.extend(o['Key'] for o in page.get('Contents', []))
+        return keys
+
+    def put_objects(self, location: str, count: int, size: int = 1024) -> None:
+        prefix = location.split('/', 3)[3]
+        for i in range(count):
+            self.s3.put_object(Bucket=Bucket, Key=f"{prefix}{i:05d}.parquet", Body=b'0' * size)
+
+    def get_partitions(self, table: str) -> List[dict]:
+        partitions: List[dict] = []
+        for page in self.glue.get_paginator('get_partitions').paginate(DatabaseName=Db, TableName=table):
+            partitions.extend(page['Partitions'])
+        return partitions
+
+
+class FakePrestoCoordinator(object):
+    """A Presto coordinator stand-in that speaks the client protocol and applies queries to the mocked Glue and S3.
+
+    It understands only the statements that the operators issue: the `LIMIT 0` query of the schema detection,
+    `EXPLAIN (TYPE IO)`, `CREATE TABLE`, `INSERT INTO`, `SELECT COUNT(1)` and the aggregations of the column
+    statistics. `INSERT INTO` writes `files` objects of `file_size` bytes to the table location after
+    `insert_latency` seconds and reports `rows` rows. `SELECT * FROM <db>.<table>` returns `rows` rows of `columns`
+    in pages of `page_rows` rows.
+
+    Like Presto, the table locations are stored without the trailing '/'. `INSERT INTO` a table created with
+    `partitioned_by` writes the objects and registers the partitions of the values in `partitions`.
+    The result pages from `unavailable_from_page` respond 503 like an overloaded coordinator.
+    """
+
+    def __init__(self, aws: AwsStandIn, columns: List[Dict[str, str]] = None, rows: int = 100, files: int = 1,
+                 file_size: int = 1024, insert_latency: float = 1.0):
+        self.aws = aws
+        self.columns = columns or gen_columns(3)
+        self.rows = rows
+        self.files = files
+        self.file_size = file_size
+        # NOTE: S3 truncates LastModified to seconds, so objects written within one second of the query start
+        #       are not distinguished from older ones.
+        self.insert_latency = insert_latency
+        self.page_rows = 1000
+        # NOTE: The polls that a query responds as RUNNING after `poll_latency` seconds before its results.
+        self.running_polls = 0
+        self.poll_latency = 0.1
+        # NOTE: Old Presto versions do not have the written rows in the query stats.
+        self.written_stats = True
+        self.unavailable_from_page: int = None
+        # NOTE: The input size that `EXPLAIN (TYPE IO)` estimates. None is NaN like the table without statistics.
+        self.input_bytes: float = None
+        # NOTE: The response of `/v1/cluster`. None responds 503 like an unhealthy coordinator.
+        self.cluster: Dict[str, int] = {'runningQueries': 0, 'blockedQueries': 0, 'queuedQueries': 0,
+                                        'activeWorkers': 1}
+        self.partitions: List[List[str]] = []
+        self.statements: List[str] = []
+        # NOTE: The session properties of the statements in the same order.
+        self.sessions: List[Dict[str, str]] = []
+        self.served_pages = 0
+        self._queries: Dict[str, dict] = {}
+        self._row_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), type('Handler', (_Handler,), {'coordinator': self}))
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    @staticmethod
+    def _column(name: str, type_: str) -> dict:
+        return {
+            'name': name,
+            'type': type_,
+            'typeSignature': {'rawType': type_, 'typeArguments': [], 'literalArguments': [], 'arguments': []},
+        }
+
+    @staticmethod
+    def _stats(state: str, rows: int = 0) -> dict:
+        return {
+            'state': state,
+            'queued': state == 'QUEUED',
+            'scheduled': state != 'QUEUED',
+            'nodes': 1,
+            'totalSplits': 1,
+            'queuedSplits': 0,
+            'runningSplits': 0,
+            'completedSplits': 0 if state == 'QUEUED' else 1,
+            'cpuTimeMillis': 0,
+            'wallTimeMillis': 0,
+            'queuedTimeMillis': 0,
+            'elapsedTimeMillis': 0,
+            'processedRows': rows,
+            'processedBytes': 0,
+            'peakMemoryBytes': 0,
+        }
+
+    def submit(self, sql: str, base_url: str, session: Dict[str, str] = None) -> dict:
+        query_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:5]}_test"
+        sql = '\n'.join(l for l in sql.splitlines() if not l.strip().startswith('--')).strip()
+        query = {'columns': None, 'data': [], 'error': None, 'written_rows': 0, 'written_bytes': 0,
+                 'running_polls': self.running_polls}
+        with self._lock:
+            self.statements.append(sql)
+            self.sessions.append(session or {})
+        try:
+            self._run(query_id, sql, query)
+        except Exception as ex:
+            logging.exception(f"Query[{query_id}] failed: {sql}")
+            query['error'] = {
+                'message': str(ex),
+                'errorCode': 65536,
+                'errorName': 'GENERIC_INTERNAL_ERROR',
+                'errorType': 'INTERNAL_ERROR',
+                'failureInfo': {'type': ex.__class__.__name__, 'message': str(ex), 'stack': []},
+            }
+        with self._lock:
+            self._queries[query_id] = query
+        return {
+            'id': query_id,
+            'infoUri': f"{base_url}/ui/query.html?{query_id}",
+            'nextUri': f"{base_url}/v1/statement/{query_id}/1",
+            'stats': self._stats('QUEUED'),
+        }
+
+    def results(self, query_id: str, base_url: str, page: int = 1) -> dict:
+        with self._lock:
+            query = self._queries[query_id]
+            self.served_pages += 1
+            running_polls = query['running_polls']
+            query['running_polls'] = max(0, running_polls - 1)
+        if running_polls:
+            time.sleep(self.poll_latency)
+            stats = self._stats('RUNNING', rows=self.rows // running_polls)
+            return {
+                'id': query_id,
+                'infoUri': f"{base_url}/ui/query.html?{query_id}",
+                'nextUri': f"{base_url}/v1/statement/{query_id}/{page}",
+                'stats': dict(stats, completedSplits=0),
+            }
+        body = {
+            'id': query_id,
+            'infoUri': f"{base_url}/ui/query.html?{query_id}",
+            'stats': self._stats('FAILED' if query['error'] else 'FINISHED', rows=len(query['data'])),
+        }
+        if query['error']:
+            body['error'] = query['error']
+            return body
+        body['columns'] = query['columns']
+        data = query['data'][(page - 1) * self.page_rows:page * self.page_rows]
+        if data:
+            body['data'] = data
+        if len(query['data']) > page * self.page_rows:
+            body['nextUri'] = f"{base_url}/v1/statement/{query_id}/{page + 1}"
+        return body
+
+    def query_info(self, query_id: str) -> dict:
+        with self._lock:
+            query = self._queries[query_id]
+        query_stats = {'outputPositions': len(query['data'])}
+        if self.written_stats:
+            query_stats['writtenOutputPositions'] = query['written_rows']
+            query_stats['writtenOutputPhysicalDataSize'] = f"{query['written_bytes']}B"
+        return {
+            'queryId': query_id,
+            'state': 'FAILED' if query['error'] else 'FINISHED',
+            'queryStats': query_stats,
+        }
+
+    def _run(self, query_id: str, sql: str, query: dict) -> None:
+        m = re.match(r'^EXPLAIN \(TYPE IO, FORMAT JSON\) SELECT .* FROM (\w+)\.(\w+)', sql, re.S)
+        if m:
+            size = float('nan') if self.input_bytes is None else self.input_bytes
+            query['columns'] = [self._column('Query Plan', 'varchar')]
+            query['data'] = [[json.dumps({
+                'inputTableColumnInfos': [{
+                    'table': {'catalog': 'hive', 'schemaTable': {'schema': m.group(1), 'table': m.group(2)}},
+                    'estimate': {'outputRowCount': self.rows, 'outputSizeInBytes': size},
+                }],
+                'estimate': {'outputRowCount': self.rows, 'outputSizeInBytes': size},
+            })]]
+            return
+        m = re.match(r'^SELECT \* FROM \(\n.*\n\) LIMIT 0$', sql, re.S)
+        if m:
+            query['columns'] = [self._column(c['name'], c['type']) for c in self.columns]
+            return
+        m = re.match(r'^CREATE TABLE (\w+)\.(\w+) \( (.*) \) WITH \( (.*) \)$', sql, re.S)
+        if m:
+            self._create_table(db=m.group(1), name=m.group(2), col_stmts=m.group(3), prop_stmts=m.group(4))
+            query['columns'] = [self._column('result', 'boolean')]
+            query['data'] = [[True]]
+            return
+        m = re.match(r'^INSERT INTO (\w+)\.(\w+) ', sql)
+        if m:
+            self._insert(query_id, db=m.group(1), name=m.group(2))
+            query['columns'] = [self._column('rows', 'bigint')]
+            query['data'] = [[self.rows]]
+            query['written_rows'] = self.rows
+            query['written_bytes'] = self.files * self.file_size
+            return
+        m = re.match(r'^SELECT COUNT\(1\) FROM (\w+)\.(\w+)$', sql)
+        if m:
+            query['columns'] = [self._column('_col0', 'bigint')]
+            query['data'] = [[self._row_counts.get(f"{m.group(1)}.{m.group(2)}", 0)]]
+            return
+        m = re.match(r'^SELECT \* FROM (\w+)\.(\w+)$', sql)
+        if m:
+            query['columns'] = [self._column(c['name'], c['type']) for c in self.columns]
+            query['data'] = [[self._value(c['type'], i) for c in self.columns] for i in range(self.rows)]
+            return
+        m = re.match(r'^SELECT (.+) FROM (\w+)\.(\w+)$', sql)
+        if m:
+            exprs = m.group(1).split(', ')
+            query['columns'] = [self._column(f"_col{i}", 'bigint') for i in range(len(exprs))]
+            query['data'] = [[self._aggregate(e) for e in exprs]]
+            return
+        raise NotImplementedError(f"Unsupported statement: {sql}")
+
+    def _aggregate(self, expr: str):
+        """Returns the aggregation of the column statistics over the rows that `_value` generates."""
+        m = re.match(r'^(\w+)\((NOT )?(?:length\()?"(\w+)"\)?( IS NULL)?\)$', expr)
+        if not m:
+            raise NotImplementedError(f"Unsupported aggregation: {expr}")
+        func, negated, name, is_null = m.groups()
+        type_ = {c['name']: c['type'] for c in self.columns}[name]
+        if func == 'count_if':
+            return 0 if is_null else (self.rows // 2 if negated else self.rows - self.rows // 2)
+        if func == 'approx_distinct':
+            return self.rows
+        if 'length(' in expr:
+            return len(str(self._value(type_, self.rows - 1))) if func == 'max' else 2.0
+        return self._value(type_, 0 if func == 'min' else self.rows - 1)
+
+    @staticmethod
+    def _value(type_: str, i: int):
+        return {
+            'bigint': i,
+            'varchar': f"v{i}",
+            'double': i / 2,
+            'boolean': i % 2 == 0,
+            'timestamp': '2019-06-01 00:00:00.000',
+        }[type_]
+
+    def _create_table(self, db: str, name: str, col_stmts: str, prop_stmts: str) -> None:
+        columns = [dict(zip(['name', 'type'], c.strip().split(' ', 1))) for c in col_stmts.split(',')]
+        props = dict(re.findall(r"(\w+)\s*=\s*('(?:[^']|'')*'|ARRAY\[[^\]]*\]|[^,]+)", prop_stmts))
+        partitioned_by = re.findall(r"'([^']*)'", props.get('partitioned_by', ''))
+        self.aws.glue.create_table(DatabaseName=db, TableInput={
+            'Name': name,
+            'TableType': 'EXTERNAL_TABLE',
+            # NOTE: Presto stores the location by Hadoop Path that strips the trailing '/'.
+            'StorageDescriptor': _storage_descriptor([c for c in columns if c['name'] not in partitioned_by],
+                                                     props['external_location'].strip("'").rstrip('/')),
+            'PartitionKeys': [{'Name': c['name'], 'Type': c['type']} for c in columns if c['name'] in partitioned_by],
+            'Parameters': {'presto_version': 'fake'},
+        })
+
+    def _insert(self, query_id: str, db: str, name: str) -> None:
+        table = self.aws.glue.get_table(DatabaseName=db, Name=name)['Table']
+        location = table['StorageDescriptor']['Location']
+        time.sleep(self.insert_latency)
+        partition_keys = [k['Name'] for k in table['PartitionKeys']]
+        locations = [
+            location + ''.join(f"/{k}={v}" for k, v in zip(partition_keys, values))
+            for values in (self.partitions if partition_keys else [[]])
+        ]
+        for values, partition_location in zip(self.partitions, locations if partition_keys else []):
+            self.aws.glue.create_partition(DatabaseName=db, TableName=name, PartitionInput={
+                'Values': values,
+                'StorageDescriptor': dict(table['StorageDescriptor'], Location=partition_location),
+                'Parameters': {'numRows': str(self.rows)},
+            })
+        for partition_location in locations:
+            prefix = partition_location.split('/', 3)[3] + '/'
+            for i in range(self.files):
+                self.aws.s3.put_object(Bucket=Bucket, Key=f"{prefix}{i:05d}_{query_id}", Body=b'0' * self.file_size)
+        with self._lock:
+            self._row_counts[f"{db}.{name}"] = self._row_counts.get(f"{db}.{name}", 0) + self.rows
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    coordinator: FakePrestoCoordinator = None
+
+    def _base_url(self) -> str:
+        return f"http://{self.headers['Host']}"
+
+    def _send(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        sql = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        if self.path != '/v1/statement':
+            self._send(404, {'message': f"{self.path} is not found."})
+            return
+        session = dict(p.split('=', 1) for p in self.headers.get('X-Presto-Session', '').split(',') if '=' in p)
+        self._send(200, self.coordinator.submit(sql, self._base_url(), session=session))
+
+    def do_GET(self):
+        m = re.match(r'^/v1/statement/([^/]+)/(\d+)$', self.path)
+        if m and self.coordinator.unavailable_from_page and int(m.group(2)) >= self.coordinator.unavailable_from_page:
+            self._send(503, {'message': 'The coordinator is unavailable.'})
+            return
+        if m:
+            self._send(200, self.coordinator.results(m.group(1), self._base_url(), page=int(m.group(2))))
+            return
+        m = re.match(r'^/v1/query/([^/]+)$', self.path)
+        if m:
+            self._send(200, self.coordinator.query_info(m.group(1)))
+            return
+        if self.path == '/v1/cluster':
+            if self.coordinator.cluster is None:
+                self._send(503, {'message': 'The coordinator is unavailable.'})
+                return
+            self._send(200, self.coordinator.cluster)
+            return
+        self._send(404, {'message': f"{self.path} is not found."})
+
+    def do_DELETE(self):
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,96 @@
+import pytest
+
+from airflow.operators import glue_partition_discovery
+from airflow.operators.glue_partition_discovery import GluePartitionDiscoveryOperator
+from glue_presto_apas_fakes import AwsConnId, Bucket, Db, Region, gen_columns, gen_context
+
+CheckpointVariable = 'glue_partition_discovery_checkpoint'
+
+
+@pytest.fixture
+def variables(monkeypatch) -> dict:
+    """Keeps Airflow Variables in a dict instead of the metadata database."""
+    stored = {}
+
+    class VariableStandIn(object):
+        @staticmethod
+        def get(key, default_var=None, deserialize_json=False):
+            return stored.get(key, default_var)
+
+        @staticmethod
+        def set(key, value, serialize_json=False):
+            stored[key] = value
+
+    monkeypatch.setattr(glue_partition_discovery, 'Variable', VariableStandIn)
+    return stored
+
+
+def _put_partition(aws, location: str, *kvs: str) -> None:
+    prefix = location.split('/', 3)[3] + ''.join(f"{kv}/" for kv in kvs)
+    aws.s3.put_object(Bucket=Bucket, Key=f"{prefix}00000.parquet", Body=b'0')
+
+
+def _run(table: str, checkpoint_variable: str = None) -> dict:
+    op = GluePartitionDiscoveryOperator(task_id='discovery',
+                                        db=Db,
+                                        table=table,
+                                        crawl_concurrency=4,
+                                        checkpoint_variable=checkpoint_variable,
+                                        catalog_region_name=Region,
+                                        aws_conn_id=AwsConnId)
+    context = gen_context('discovery')
+    op.pre_execute(context=context)
+    return op.execute(context=context)
+
+
+def test_glue_partition_discovery_creates_only_the_missing_partitions(aws):
+    table = 'discovered'
+    location = aws.create_table(table, columns=gen_columns(3), partition_keys=['dt', 'hour'])
+    for dt in ['2019-06-01', '2019-06-02']:
+        for hour in ['00', '01']:
+            _put_partition(aws, location, f"dt={dt}", f"hour={hour}")
+    # NOTE: Prefixes that are not `<key>=<value>/` of the partition key are not partitions.
+    _put_partition(aws, location, '_temporary', 'hour=00')
+    aws.create_partition(table, ['2019-06-01', '00'], f"{location}dt=2019-06-01/hour=00")
+
+    result = _run(table)
+
+    assert result['discovered'] == 4
+    assert sorted(result['created']) == [['2019-06-01', '01'], ['2019-06-02', '00'], ['2019-06-02', '01']]
+    partitions = {tuple(p['Values']): p['StorageDescriptor']['Location'] for p in aws.get_partitions(table)}
+    assert len(partitions) == 4
+    assert partitions[('2019-06-02', '01')].rstrip('/') == f"{location}dt=2019-06-02/hour=01"
+
+    assert _run(table)['created'] == []
+
+
+def test_glue_partition_discovery_crawls_from_the_checkpoint(aws, variables):
+    table = 'discovered_from_checkpoint'
+    location = aws.create_table(table, columns=gen_columns(3))
+    for dt in ['2019-06-01', '2019-06-02']:
+        _put_partition(aws, location, f"dt={dt}")
+
+    assert len(_run(table, CheckpointVariable)['created']) == 2
+    assert variables[CheckpointVariable] == {'location': location, 'last_value': '2019-06-02'}
+
+    # NOTE: The partition under the checkpoint is listed again, and the ones before it are not.
+    _put_partition(aws, location, 'dt=2019-05-31')
+    _put_partition(aws, location, 'dt=2019-06-03')
+    result = _run(table, CheckpointVariable)
+    assert result == {'discovered': 2, 'created': [['2019-06-03']]}
+    assert variables[CheckpointVariable]['last_value'] == '2019-06-03'
+
+
+def test_glue_partition_discovery_compares_numeric_checkpoint_by_number(aws, variables):
+    table = 'discovered_by_number'
+    location = aws.create_table(table, columns=gen_columns(3), partition_keys=['seq'], partition_key_type='int')
+    for seq in ['8', '9']:
+        _put_partition(aws, location, f"seq={seq}")
+
+    assert len(_run(table, CheckpointVariable)['created']) == 2
+    assert variables[CheckpointVariable]['last_value'] == '9'
+
+    # NOTE: `seq=10/` is listed before `seq=9/` by S3, but it is after the checkpoint.
+    _put_partition(aws, location, 'seq=10')
+    assert _run(table, CheckpointVariable) == {'discovered': 2, 'created': [['10']]}
+    assert variables[CheckpointVariable]['last_value'] == '10'
@@ -0,0 +1,77 @@
+import json
+
+from airflow.hooks.glue_presto_apas import GlueDataCatalogHook
+from airflow.hooks.glue_presto_apas import PartitionIndex
+from airflow.hooks.glue_presto_apas import call_counter
+from airflow.hooks.glue_presto_apas import hook_registry
+from airflow.sensors.glue_partition import GluePartitionSensor
+from glue_presto_apas_fakes import AwsConnId, Bucket, Db, Region, gen_columns
+
+
+def _glue() -> GlueDataCatalogHook:
+    return hook_registry.get_hook(GlueDataCatalogHook, aws_conn_id=AwsConnId, region_name=Region, catalog_id=None)
+
+
+def _get_partitions_calls(since: dict) -> int:
+    return call_counter.diff(since).get('glue.GetPartitions', 0)
+
+
+def test_partition_index_shares_get_partitions_among_waiters(aws, tmpdir):
+    table = 'waited'
+    aws.create_table(table, columns=gen_columns(3))
+    aws.create_partition(table, ['2019-06-01'], f"s3://{Bucket}/{table}/dt=2019-06-01")
+    glue = _glue()
+    index_dir = str(tmpdir.join('partition_index'))
+
+    def lookup(index: PartitionIndex, values: str, ttl: float = 60) -> (bool, int):
+        since = call_counter.snapshot()
+        exists = index.lookup(glue, db=Db, table_name=table, partition_values_list=[[values]],
+                              ttl=ttl, index_dir=index_dir)
+        return exists[0], _get_partitions_calls(since)
+
+    assert lookup(PartitionIndex(), '2019-06-01') == (True, 1)
+    # NOTE: A new waiter fetches the partitions of all waiters, and the others read the result from the file.
+    assert lookup(PartitionIndex(), '2019-06-02') == (False, 1)
+    assert lookup(PartitionIndex(), '2019-06-01') == (True, 0)
+
+    aws.create_partition(table, ['2019-06-02'], f"s3://{Bucket}/{table}/dt=2019-06-02")
+    assert lookup(PartitionIndex(), '2019-06-02') == (False, 0)
+    assert lookup(PartitionIndex(), '2019-06-02', ttl=0) == (True, 1)
+
+    PartitionIndex().unregister(glue, db=Db, table_name=table, partition_values_list=[['2019-06-01']],
+                                index_dir=index_dir)
+    with PartitionIndex()._state(PartitionIndex._key(glue, Db, table), index_dir) as state:
+        assert list(state['waiters']) == [json.dumps(['2019-06-02'])]
+
+
+def test_glue_partition_sensors_share_the_index_in_files(aws, tmpdir):
+    table = 'sensed'
+    aws.create_table(table, columns=gen_columns(3))
+    aws.create_partition(table, ['2019-06-01'], f"s3://{Bucket}/{table}/dt=2019-06-01")
+    index_dir = str(tmpdir.join('partition_index'))
+
+    def poke(dt: str, index_ttl: int = 60) -> (bool, int):
+        sensor = GluePartitionSensor(task_id=f"sense_{dt}",
+                                     db=Db,
+                                     table=table,
+                                     partition_kv={'dt': dt},
+                                     index_ttl=index_ttl,
+                                     index_dir=index_dir,
+                                     catalog_region_name=Region,
+                                     aws_conn_id=AwsConnId)
+        since = call_counter.snapshot()
+        return sensor.poke(context={}), _get_partitions_calls(since)
+
+    def waiters() -> list:
+        with PartitionIndex()._state(PartitionIndex._key(_glue(), Db, table), index_dir) as state:
+            return sorted(json.loads(w) for w in state['waiters'])
+
+    assert poke('2019-06-02') == (False, 1)
+    # NOTE: The sensor for a new partition fetches the partitions of all waiters, and then leaves the index.
+    assert poke('2019-06-01') == (True, 1)
+    assert waiters() == [['2019-06-02']]
+    assert poke('2019-06-02') == (False, 0)
+
+    aws.create_partition(table, ['2019-06-02'], f"s3://{Bucket}/{table}/dt=2019-06-02")
+    assert poke('2019-06-02', index_ttl=0) == (True, 1)
+    assert waiters() == []
@@ -1,6 +1,454 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+from botocore.exceptions import ClientError
+from airflow.exceptions import AirflowException
+from airflow.exceptions import AirflowRescheduleException
+from airflow.ti_deps.deps.ready_to_reschedule import ReadyToRescheduleDep
+
 import airflow.plugins.glue_presto_apas
+from airflow.operators import glue_presto_apas as glue_presto_apas_operator
+from airflow.hooks.glue_presto_apas import GlueDataCatalogHook
+from airflow.hooks.glue_presto_apas import PrestoError
+from airflow.operators.glue_presto_apas import ConfigError
+from airflow.operators.glue_presto_apas import GluePrestoApasOperator
+from airflow.operators.glue_presto_apas import ResumableTmpTablePrefix
+from airflow.operators.glue_presto_apas import StateParameterKey
+from glue_presto_apas_fakes import AwsConnId, Bucket, Db, PrestoConnId, Region, gen_columns, gen_context
+
+Dt = '2019-06-01'
 
-# TODO: Write tests
 
 def test_sample():
     assert 1 == 1
+
+
+def _gen_operator(table: str, input_tables) -> GluePrestoApasOperator:
+    return GluePrestoApasOperator(task_id='apas_skip_if_unchanged',
+                                  db=Db,
+                                  table=table,
+                                  sql=f"SELECT * FROM {Db}.source WHERE dt = '{Dt}'",
+                                  partition_kv={'dt': Dt},
+                                  save_mode='skip_if_unchanged',
+                                  input_tables=input_tables,
+                                  progress_interval=0,
+                                  catalog_region_name=Region,
+                                  presto_conn_id=PrestoConnId,
+                                  aws_conn_id=AwsConnId)
+
+
+def _run(table: str, input_tables) -> dict:
+    op = _gen_operator(table, input_tables)
+    context = gen_context('apas_skip_if_unchanged')
+    op.pre_execute(context=context)
+    return op.execute(context=context)
+
+
+def test_glue_presto_apas_operator_skip_if_unchanged_requires_input_tables():
+    with pytest.raises(ConfigError):
+        _gen_operator('apas_skip_if_unchanged', input_tables=[])
+
+
+def test_glue_presto_apas_operator_rejects_input_tables_without_partition_keys(aws, presto):
+    table = 'apas_skip_if_unchanged'
+    aws.create_table(table, columns=gen_columns(3))
+    aws.create_table('source', columns=gen_columns(3), partition_keys=['dt', 'hour'])
+    op = _gen_operator(table, input_tables=[f"{Db}.source/dt={Dt}"])
+
+    with pytest.raises(AirflowException, match=r"misses partition keys\['hour'\]"):
+        op.pre_execute(context=gen_context('apas_skip_if_unchanged'))
+    assert not presto.statements
+
+
+def test_glue_presto_apas_operator_skip_if_unchanged(aws, presto):
+    table = 'apas_skip_if_unchanged'
+    aws.create_table(table, columns=gen_columns(3))
+    source_location = aws.create_table('source', columns=gen_columns(3))
+    aws.create_partition('source', [Dt], f"{source_location}dt={Dt}/v1")
+    input_tables = [f"{Db}.source/dt={Dt}"]
+
+    def inserts() -> int:
+        return len([s for s in presto.statements if s.lstrip().startswith('INSERT INTO')])
+
+    assert _run(table, input_tables)['processed']
+    assert inserts() == 1
+
+    # NOTE: The fingerprint stored in the partition is the same when the input partition is not changed.
+    result = _run(table, input_tables)
+    assert not result['processed']
+    assert inserts() == 1
+
+    aws.glue.delete_partition(DatabaseName=Db, TableName='source', PartitionValues=[Dt])
+    aws.create_partition('source', [Dt], f"{source_location}dt={Dt}/v2")
+    assert _run(table, input_tables)['processed']
+    assert inserts() == 2
+
+
+def test_glue_presto_apas_operator_drops_table_left_without_state(aws, presto):
+    table = 'apas_left_table'
+    aws.create_table(table, columns=gen_columns(3))
+    presto.columns = gen_columns(3)
+    op = GluePrestoApasOperator(task_id='apas_left_table',
+                                db=Db,
+                                table=table,
+                                sql=f"SELECT * FROM {Db}.source WHERE dt = '{Dt}'",
+                                partition_kv={'dt': Dt},
+                                progress_interval=0,
+                                catalog_region_name=Region,
+                                presto_conn_id=PrestoConnId,
+                                aws_conn_id=AwsConnId)
+    context = gen_context('apas_left_table', try_number=2, retries=1)
+    # NOTE: A worker killed during the INSERT of the first try leaves the temporary table without the state.
+    aws.glue.create_table(DatabaseName=Db, TableInput={
+        'Name': op._tmp_table_name_for(context),
+        'TableType': 'EXTERNAL_TABLE',
+        'StorageDescriptor': {'Columns': [], 'Location': f"s3://{Bucket}/{table}/dt={Dt}"},
+    })
+
+    op.pre_execute(context=context)
+    result = op.execute(context=context)
+
+    assert result['processed']
+    assert len(aws.get_partitions(table)) == 1
+    assert not [t for t in aws.glue.get_tables(DatabaseName=Db)['TableList'] if t['Name'].startswith('__work_')]
+
+
+def _gen_reschedulable_operator(table: str, poll_timeout: int) -> GluePrestoApasOperator:
+    return GluePrestoApasOperator(task_id='apas_reschedule',
+                                  db=Db,
+                                  table=table,
+                                  sql=f"SELECT * FROM {Db}.source WHERE dt = '{Dt}'",
+                                  partition_kv={'dt': Dt},
+                                  execution_mode='reschedule',
+                                  poke_interval=1,
+                                  poll_timeout=poll_timeout,
+                                  progress_interval=0,
+                                  catalog_region_name=Region,
+                                  presto_conn_id=PrestoConnId,
+                                  aws_conn_id=AwsConnId)
+
+
+def test_glue_presto_apas_operator_waits_for_the_reschedule_date_in_reschedule_mode():
+    op = _gen_reschedulable_operator('apas_reschedule', poll_timeout=30)
+    assert any(isinstance(d, ReadyToRescheduleDep) for d in op.deps)
+    blocking = GluePrestoApasOperator(task_id='apas_blocking',
+                                      db=Db,
+                                      table='apas_blocking',
+                                      sql=f"SELECT * FROM {Db}.source",
+                                      partition_kv={'dt': Dt})
+    assert not any(isinstance(d, ReadyToRescheduleDep) for d in blocking.deps)
+
+
+def test_glue_presto_apas_operator_resumes_the_query_after_reschedule(aws, presto):
+    table = 'apas_reschedule'
+    aws.create_table(table, columns=gen_columns(3))
+    presto.columns = gen_columns(3)
+    context = gen_context('apas_reschedule')
+
+    # NOTE: The first execution submits the query and releases the worker slot without polling it.
+    op = _gen_reschedulable_operator(table, poll_timeout=0)
+    op.pre_execute(context=context)
+    with pytest.raises(AirflowRescheduleException):
+        op.execute(context=context)
+    assert len([s for s in presto.statements if s.startswith('INSERT INTO')]) == 1
+    assert not aws.get_partitions(table)
+
+    # NOTE: The next execution is a new operator instance of the same try like Airflow.
+    op = _gen_reschedulable_operator(table, poll_timeout=30)
+    op.pre_execute(context=context)
+    result = op.execute(context=context)
+
+    assert result['processed']
+    assert result['affected_rows'] == presto.rows
+    assert len([s for s in presto.statements if s.startswith('INSERT INTO')]) == 1
+    assert len(aws.get_partitions(table)) == 1
+    assert not [t for t in aws.glue.get_tables(DatabaseName=Db)['TableList'] if t['Name'].startswith('__work_')]
+
+
+def _gen_statistics_operator(table: str) -> GluePrestoApasOperator:
+    return GluePrestoApasOperator(task_id='apas_statistics',
+                                  db=Db,
+                                  table=table,
+                                  sql=f"SELECT * FROM {Db}.source WHERE dt = '{Dt}'",
+                                  partition_kv={'dt': Dt},
+                                  column_statistics=True,
+                                  progress_interval=0,
+                                  catalog_region_name=Region,
+                                  presto_conn_id=PrestoConnId,
+                                  aws_conn_id=AwsConnId)
+
+
+def test_glue_presto_apas_operator_updates_the_statistics(aws, presto, monkeypatch):
+    table = 'apas_statistics'
+    aws.create_table(table, columns=gen_columns(4))
+    presto.columns = gen_columns(4)
+    updates = []
+
+    def update_partition_column_statistics(self, db, table_name, partition_values, column_statistics):
+        updates.append((table_name, partition_values, column_statistics))
+        return []
+
+    monkeypatch.setattr(GlueDataCatalogHook, 'update_partition_column_statistics', update_partition_column_statistics)
+    op = _gen_statistics_operator(table)
+    context = gen_context('apas_statistics')
+    op.pre_execute(context=context)
+    assert op.execute(context=context)['processed']
+
+    parameters = aws.get_partitions(table)[0]['Parameters']
+    assert parameters['numRows'] == str(presto.rows)
+    assert parameters['numFiles'] == '1'
+    assert int(parameters['totalSize']) > 0
+
+    assert len(updates) == 1
+    table_name, partition_values, column_statistics = updates[0]
+    assert (table_name, partition_values) == (table, [Dt])
+    stats = {s['ColumnName']: s['StatisticsData'] for s in column_statistics}
+    assert set(stats) == {'c0', 'c1', 'c2', 'c3'}
+    assert stats['c0'] == {'Type': 'LONG', 'LongColumnStatisticsData': {
+        'NumberOfNulls': 0, 'NumberOfDistinctValues': presto.rows, 'MinimumValue': 0, 'MaximumValue': presto.rows - 1,
+    }}
+    assert stats['c1']['StringColumnStatisticsData']['MaximumLength'] == len(f"v{presto.rows - 1}")
+    assert stats['c3']['BooleanColumnStatisticsData'] == {
+        'NumberOfTrues': presto.rows // 2, 'NumberOfFalses': presto.rows // 2, 'NumberOfNulls': 0,
+    }
+
+
+@pytest.mark.parametrize('failure', ['compute', 'update'])
+def test_glue_presto_apas_operator_does_not_fail_by_the_statistics(aws, presto, monkeypatch, failure):
+    table = 'apas_statistics'
+    aws.create_table(table, columns=gen_columns(4))
+    presto.columns = gen_columns(4)
+    if failure == 'compute':
+        def fail(self, tmp_table):
+            raise PrestoError(f"Query exceeded the limit: {tmp_table}")
+        monkeypatch.setattr(GluePrestoApasOperator, '_compute_column_statistics', fail)
+    else:
+        def fail(self, db, table_name, partition_values, column_statistics):
+            raise ClientError({'Error': {'Code': 'AccessDeniedException', 'Message': 'denied'}},
+                              'UpdateColumnStatisticsForPartition')
+        monkeypatch.setattr(GlueDataCatalogHook, 'update_partition_column_statistics', fail)
+    op = _gen_statistics_operator(table)
+    context = gen_context('apas_statistics')
+    op.pre_execute(context=context)
+
+    assert op.execute(context=context)['processed']
+    assert len(aws.get_partitions(table)) == 1
+    assert not [t for t in aws.glue.get_tables(DatabaseName=Db)['TableList'] if t['Name'].startswith('__work_')]
+
+
+def test_glue_presto_apas_operator_drops_stale_tables_kept_for_retry(aws, presto):
+    table = 'apas_stale_tables'
+    aws.create_table(table, columns=gen_columns(3))
+    presto.columns = gen_columns(3)
+    op = GluePrestoApasOperator(task_id='apas_stale_tables',
+                                db=Db,
+                                table=table,
+                                sql=f"SELECT * FROM {Db}.source WHERE dt = '{Dt}'",
+                                partition_kv={'dt': Dt},
+                                progress_interval=0,
+                                catalog_region_name=Region,
+                                presto_conn_id=PrestoConnId,
+                                aws_conn_id=AwsConnId)
+    context = gen_context('apas_stale_tables')
+    op.pre_execute(context=context)
+
+    # NOTE: The task instances of other execution dates keep the tables of the partition for their retries.
+    def keep_table(day: int, fingerprint: str) -> str:
+        other = gen_context('apas_stale_tables')
+        other['ti'].execution_date = datetime(2019, 5, day, tzinfo=timezone.utc)
+        name = op._tmp_table_name_for(other)
+        state = {'query_id': 'q', 'affected_rows': 1, 'try_number': 1, 'fingerprint': fingerprint,
+                 'location': f"s3://{Bucket}/{table}/dt={Dt}/"}
+        aws.glue.create_table(DatabaseName=Db, TableInput={
+            'Name': name,
+            'TableType': 'EXTERNAL_TABLE',
+            'Parameters': {StateParameterKey: json.dumps(state)},
+            'StorageDescriptor': {'Columns': [], 'Location': f"s3://{Bucket}/{table}/dt={Dt}"},
+        })
+        return name
+
+    stale = keep_table(30, fingerprint='stale')
+    resumable = keep_table(31, fingerprint=op._gen_fingerprint())
+    assert stale.startswith(ResumableTmpTablePrefix)
+
+    assert op.execute(context=context)['processed']
+
+    names = [t['Name'] for t in aws.glue.get_tables(DatabaseName=Db)['TableList']]
+    assert stale not in names
+    assert resumable in names
+
+
+def test_glue_presto_apas_operator_does_not_clean_up_when_skipped(aws, presto):
+    table = 'apas_skip_if_exists'
+    location = aws.create_table(table, columns=gen_columns(3))
+    aws.put_objects(f"{location}dt={Dt}/", count=1)
+    op = GluePrestoApasOperator(task_id='apas_skip_if_exists',
+                                db=Db,
+                                table=table,
+                                sql=f"SELECT * FROM {Db}.source WHERE dt = '{Dt}'",
+                                partition_kv={'dt': Dt},
+                                save_mode='skip_if_exists',
+                                progress_interval=0,
+                                catalog_region_name=Region,
+                                presto_conn_id=PrestoConnId,
+                                aws_conn_id=AwsConnId)
+    context = gen_context('apas_skip_if_exists')
+    op.pre_execute(context=context)
+
+    assert not op.execute(context=context)['processed']
+    assert 'cleanup' not in op._metrics.phases
+    # NOTE: The fingerprint is not used without input_tables in the skipped execution.
+    assert op._fingerprint is None
+    assert not [s for s in presto.statements if s.startswith('CREATE TABLE')]
+
+
+def test_glue_presto_apas_operator_inherits_the_bucketing_and_the_compression(aws, presto):
+    table = 'apas_bucketed'
+    columns = gen_columns(3)
+    aws.glue.create_table(DatabaseName=Db, TableInput={
+        'Name': table,
+        'TableType': 'EXTERNAL_TABLE',
+        'Parameters': {'parquet.compression': 'snappy'},
+        'StorageDescriptor': {
+            'Columns': [{'Name': c['name'], 'Type': c['type']} for c in columns],
+            'Location': f"s3://{Bucket}/{table}/",
+            'NumberOfBuckets': 8,
+            # NOTE: Hive keeps the case of the column names, and Presto lowercases them.
+            'BucketColumns': ['C0'],
+            'SortColumns': [{'Column': 'c1', 'SortOrder': 0}],
+        },
+        'PartitionKeys': [{'Name': 'dt', 'Type': 'string'}],
+    })
+    presto.columns = columns
+    op = GluePrestoApasOperator(task_id='apas_bucketed',
+                                db=Db,
+                                table=table,
+                                sql=f"SELECT * FROM {Db}.source WHERE dt = '{Dt}'",
+                                partition_kv={'dt': Dt},
+                                progress_interval=0,
+                                catalog_region_name=Region,
+                                presto_conn_id=PrestoConnId,
+                                aws_conn_id=AwsConnId)
+    context = gen_context('apas_bucketed')
+    op.pre_execute(context=context)
+    assert op.execute(context=context)['processed']
+
+    create_table = [s for s in presto.statements if s.startswith('CREATE TABLE')][0]
+    assert "bucketed_by = ARRAY['c0']" in create_table
+    assert "bucket_count = 8" in create_table
+    assert "sorted_by = ARRAY['c1 DESC']" in create_table
+    insert = [i for i, s in enumerate(presto.statements) if s.startswith('INSERT INTO')][0]
+    assert presto.sessions[insert].get('hive.compression_codec') == 'SNAPPY'
+
+
+@pytest.mark.parametrize('input_bytes,task_writer_count', [
+    pytest.param(3 * 64 * 1024 * 1024, '2', id='3-writers'),
+    pytest.param(1024 * 64 * 1024 * 1024, '64', id='max-writers'),
+    pytest.param(None, None, id='not-estimated'),
+])
+def test_glue_presto_apas_operator_tunes_the_writers_by_the_input_size(aws, presto, input_bytes, task_writer_count):
+    table = 'apas_writers'
+    aws.create_table(table, columns=gen_columns(3))
+    presto.columns = gen_columns(3)
+    presto.input_bytes = input_bytes
+    op = GluePrestoApasOperator(task_id='apas_writers',
+                                db=Db,
+                                table=table,
+                                sql=f"SELECT * FROM {Db}.source WHERE dt = '{Dt}'",
+                                partition_kv={'dt': Dt},
+                                target_bytes_per_writer=64 * 1024 * 1024,
+                                progress_interval=0,
+                                catalog_region_name=Region,
+                                presto_conn_id=PrestoConnId,
+                                aws_conn_id=AwsConnId)
+    context = gen_context('apas_writers')
+    op.pre_execute(context=context)
+    assert op.execute(context=context)['processed']
+
+    assert len([s for s in presto.statements if s.startswith('EXPLAIN (TYPE IO')]) == 1
+    insert = [i for i, s in enumerate(presto.statements) if s.startswith('INSERT INTO')][0]
+    assert presto.sessions[insert].get('task_writer_count') == task_writer_count
+
+
+def _gen_verifying_operator(table: str, **kwargs) -> GluePrestoApasOperator:
+    return GluePrestoApasOperator(task_id='apas_verification',
+                                  db=Db,
+                                  table=table,
+                                  sql=f"SELECT * FROM {Db}.source WHERE dt = '{Dt}'",
+                                  partition_kv={'dt': Dt},
+                                  catalog_region_name=Region,
+                                  presto_conn_id=PrestoConnId,
+                                  aws_conn_id=AwsConnId,
+                                  **kwargs)
+
+
+@pytest.mark.parametrize('written_stats,counts', [
+    pytest.param(True, 0, id='query-stats'),
+    # NOTE: Old Presto versions do not have the written rows, and then the rows are counted.
+    pytest.param(False, 1, id='fallback-to-count'),
+])
+def test_glue_presto_apas_operator_verifies_rows_by_query_stats(aws, presto, written_stats, counts):
+    table = 'apas_verification'
+    aws.create_table(table, columns=gen_columns(3))
+    presto.columns = gen_columns(3)
+    presto.written_stats = written_stats
+    op = _gen_verifying_operator(table, row_verification='query_stats', progress_interval=0)
+    context = gen_context('apas_verification')
+    op.pre_execute(context=context)
+
+    result = op.execute(context=context)
+
+    assert result['processed']
+    assert result['affected_rows'] == presto.rows
+    assert len([s for s in presto.statements if s.startswith('SELECT COUNT(1)')]) == counts
+
+
+def test_glue_presto_apas_operator_reports_the_progress_of_the_insert(aws, presto, monkeypatch):
+    table = 'apas_progress'
+    aws.create_table(table, columns=gen_columns(3))
+    presto.columns = gen_columns(3)
+    presto.running_polls = 5
+    presto.poll_latency = 0.2
+    gauges = []
+
+    class StatsStandIn(object):
+        @staticmethod
+        def gauge(stat, value, *args, **kwargs):
+            gauges.append((stat, value))
+
+    monkeypatch.setattr(glue_presto_apas_operator, 'Stats', StatsStandIn)
+    op = _gen_verifying_operator(table, progress_interval=0.1)
+    context = gen_context('apas_progress')
+    op.pre_execute(context=context)
+    assert op.execute(context=context)['processed']
+
+    prefix = f"glue_presto_apas.query.{op.dag_id}.apas_verification.{Db}.{table}"
+    processed_rows = [v for s, v in gauges if s == f"{prefix}.processed_rows"]
+    # NOTE: The reporter thread reports while the query runs, and once when the query finishes.
+    assert len(processed_rows) >= 3
+    assert max(processed_rows) == presto.rows
+    assert {s for s, _ in gauges} == {f"{prefix}.{n}" for n in ['completed_splits', 'total_splits', 'processed_rows',
+                                                                'processed_bytes', 'cpu_time_millis',
+                                                                'peak_memory_bytes']}
+
+
+def test_glue_presto_apas_operator_emits_the_metrics_of_the_failed_run(aws, presto, monkeypatch):
+    table = 'apas_failed'
+    aws.create_table(table, columns=gen_columns(3))
+    presto.columns = gen_columns(3)
+
+    def fail(self, result, tmp_table, state):
+        raise glue_presto_apas_operator.StateError(f"Table[{tmp_table}] is broken.")
+
+    monkeypatch.setattr(GluePrestoApasOperator, '_complete_partition', fail)
+    op = _gen_verifying_operator(table, progress_interval=0)
+    context = gen_context('apas_failed')
+    op.pre_execute(context=context)
+
+    with pytest.raises(glue_presto_apas_operator.StateError):
+        op.execute(context=context)
+
+    metrics = context['ti'].xcoms['metrics']
+    assert metrics['calls']['presto.get_first'] >= 1
+    assert {'validation', 'insert', 'cleanup'} <= set(metrics['phases'])
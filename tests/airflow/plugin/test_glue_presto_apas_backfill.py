@@ -0,0 +1,30 @@
+from airflow.operators.glue_presto_apas_backfill import GluePrestoApasBackfillOperator
+from airflow.operators.glue_presto_apas_backfill import SuccessState
+from glue_presto_apas_fakes import AwsConnId, Db, PrestoConnId, Region, gen_columns, gen_context
+
+
+def test_glue_presto_apas_backfill_operator(aws, presto):
+    table = 'apas_backfill'
+    aws.create_table(table, columns=gen_columns(3))
+    presto.columns = gen_columns(3)
+    op = GluePrestoApasBackfillOperator(task_id='apas_backfill',
+                                        db=Db,
+                                        table=table,
+                                        sql=f"SELECT * FROM {Db}.source WHERE dt = '{{{{ partition_kv.dt }}}}'",
+                                        partition_range={'key': 'dt', 'start': '2019-06-01', 'end': '2019-06-02'},
+                                        max_concurrency=2,
+                                        catalog_region_name=Region,
+                                        presto_conn_id=PrestoConnId,
+                                        aws_conn_id=AwsConnId,
+                                        apas_options={'progress_interval': 0})
+    context = gen_context('apas_backfill')
+
+    op.pre_execute(context=context)
+    op.execute(context=context)
+
+    results = context['ti'].xcoms['partition_results']
+    assert [r['state'] for r in results] == [SuccessState, SuccessState], [r['error'] for r in results]
+    assert sorted(p['Values'] for p in aws.get_partitions(table)) == [['2019-06-01'], ['2019-06-02']]
+    # NOTE: `sql` is rendered for each partition with `partition_kv` in the context.
+    inserts = [s for s in presto.statements if s.startswith('INSERT INTO')]
+    assert sorted(s.rsplit(' WHERE ', 1)[1] for s in inserts) == ["dt = '2019-06-01'", "dt = '2019-06-02'"]
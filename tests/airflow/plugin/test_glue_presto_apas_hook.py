@@ -0,0 +1,254 @@
+import csv
+import gzip
+import json
+import math
+import threading
+
+import boto3
+import pytest
+from botocore.awsrequest import AWSResponse
+
+from airflow.hooks import glue_presto_apas
+from airflow.hooks.glue_presto_apas import GlueDataCatalogHook
+from airflow.hooks.glue_presto_apas import PrestoHook
+from airflow.hooks.glue_presto_apas import RateLimiter
+from airflow.hooks.glue_presto_apas import call_counter
+from airflow.hooks.glue_presto_apas import hook_registry
+from airflow.hooks.glue_presto_apas import rate_limiter
+from airflow.hooks.glue_presto_apas import throttle_counter
+from glue_presto_apas_fakes import AwsConnId, Db, PrestoConnId, Region, gen_columns
+
+GlueRate = 1000.0
+# NOTE: More than the max attempts of the retry handler of botocore, so that the throttling handler decides.
+ThrottleMaxAttempts = 6
+
+
+@pytest.mark.parametrize('rows,rows_per_file', [
+    pytest.param(10, 1000, id='r10'),
+    pytest.param(2500, 1000, id='r2500-f1000'),
+])
+def test_presto_hook_export_csv(presto, tmpdir, rows, rows_per_file):
+    presto.columns = gen_columns(5)
+    presto.rows = rows
+    hook: PrestoHook = hook_registry.get_hook(PrestoHook, presto_conn_id=PrestoConnId)
+
+    paths = hook.export(f"SELECT * FROM {Db}.source", path_prefix=str(tmpdir.join('export')),
+                        rows_per_file=rows_per_file, batch_size=300)
+
+    assert len(paths) == math.ceil(rows / rows_per_file)
+    exported = []
+    for path in paths:
+        with gzip.open(path, 'rt', newline='') as f:
+            records = list(csv.reader(f))
+        assert records[0] == [c['name'] for c in presto.columns]
+        assert len(records) - 1 <= rows_per_file
+        exported.extend(records[1:])
+    assert [int(r[0]) for r in exported] == list(range(rows))
+
+
+def test_presto_hook_export_parquet(presto, tmpdir):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    presto.columns = gen_columns(5)
+    presto.rows = 2500
+    hook: PrestoHook = hook_registry.get_hook(PrestoHook, presto_conn_id=PrestoConnId)
+
+    paths = hook.export(f"SELECT * FROM {Db}.source", path_prefix=str(tmpdir.join('export')), fmt='parquet',
+                        rows_per_file=2000)
+
+    tables = [parquet.read_table(p) for p in paths]
+    assert [t.num_rows for t in tables] == [2000, 500]
+    assert tables[0].column_names == [c['name'] for c in presto.columns]
+
+
+def test_presto_hook_iter_batches_fetches_pages_lazily(presto):
+    presto.columns = gen_columns(3)
+    presto.rows = 10000
+    hook: PrestoHook = hook_registry.get_hook(PrestoHook, presto_conn_id=PrestoConnId)
+
+    batches = hook.iter_batches(f"SELECT * FROM {Db}.source", batch_size=100)
+    assert len(next(batches)) == 100
+    batches.close()
+    # NOTE: 10 pages have the rows, and only the first one is needed for the first batch.
+    assert presto.served_pages < math.ceil(presto.rows / presto.page_rows)
+
+    assert sum(1 for _ in hook.iter_records(f"SELECT * FROM {Db}.source")) == presto.rows
+
+
+def test_presto_hook_get_result_columns_with_trailing_comment(presto):
+    presto.columns = gen_columns(3)
+    hook: PrestoHook = hook_registry.get_hook(PrestoHook, presto_conn_id=PrestoConnId)
+
+    columns = hook.get_result_columns(f"SELECT * FROM {Db}.source -- the source table")
+
+    assert [c['name'] for c in columns] == [c['name'] for c in presto.columns]
+    assert presto.statements[-1].endswith('-- the source table\n) LIMIT 0')
+
+
+class _RawStream(object):
+    def __init__(self, body: bytes):
+        self._body = body
+
+    def stream(self, **kwargs):
+        yield self._body
+
+
+def _inject_throttling(client, times: int) -> list:
+    """Makes the first `times` requests of `client` respond ThrottlingException, and returns the sent requests."""
+    sent = []
+
+    def respond(request, **kwargs):
+        sent.append(request)
+        if len(sent) > times:
+            return None
+        body = json.dumps({'__type': 'ThrottlingException', 'message': 'Rate exceeded'}).encode('utf-8')
+        return AWSResponse(request.url, 400, {'Content-Type': 'application/x-amz-json-1.1'}, _RawStream(body))
+
+    # NOTE: Respond before moto does.
+    client.meta.events.register_first('before-send', respond)
+    return sent
+
+
+@pytest.fixture
+def sleeps(monkeypatch) -> list:
+    """Records the seconds to sleep instead of sleeping. The full jitter returns its cap to check it."""
+    recorded = []
+    monkeypatch.setattr(glue_presto_apas.time, 'sleep', recorded.append)
+    monkeypatch.setattr(glue_presto_apas.random, 'uniform', lambda a, b: b)
+    return recorded
+
+
+@pytest.fixture
+def glue(aws, sleeps, monkeypatch):
+    monkeypatch.setattr(rate_limiter, '_buckets', {})
+    client = boto3.client('glue', region_name=Region)
+    glue_presto_apas._register_throttling_handlers(client, {'rate_limits': {'glue': GlueRate},
+                                                            'throttle_max_attempts': ThrottleMaxAttempts})
+    return client
+
+
+def test_throttled_request_is_retried_with_the_halved_rate(aws, glue, sleeps):
+    aws.create_table('throttled', columns=gen_columns(3))
+    sent = _inject_throttling(glue, times=1)
+    since = throttle_counter.snapshot()
+
+    assert glue.get_table(DatabaseName=Db, Name='throttled')['Table']['Name'] == 'throttled'
+
+    assert len(sent) == 2
+    assert sleeps == [glue_presto_apas.ThrottleBaseBackoffSeconds * 2]
+    assert throttle_counter.diff(since).get('glue.throttled') == 1
+    state = rate_limiter._buckets[f"glue.{Region}"]
+    assert state['throttled_rate'] == pytest.approx(GlueRate / 2, rel=0.05)
+
+
+def test_throttled_request_fails_after_max_attempts(aws, glue, sleeps):
+    aws.create_table('throttled', columns=gen_columns(3))
+    sent = _inject_throttling(glue, times=ThrottleMaxAttempts * 2)
+    since = throttle_counter.snapshot()
+
+    with pytest.raises(glue.exceptions.ThrottlingException):
+        glue.get_table(DatabaseName=Db, Name='throttled')
+
+    assert len(sent) == ThrottleMaxAttempts
+    assert sleeps == [min(glue_presto_apas.ThrottleMaxBackoffSeconds,
+                          glue_presto_apas.ThrottleBaseBackoffSeconds * 2 ** a)
+                      for a in range(1, ThrottleMaxAttempts)]
+    assert throttle_counter.diff(since).get('glue.throttled') == ThrottleMaxAttempts
+    # NOTE: The rate is halved in each throttled response down to ThrottleMinRateRatio of the configured rate.
+    state = rate_limiter._buckets[f"glue.{Region}"]
+    assert state['throttled_rate'] == pytest.approx(GlueRate * glue_presto_apas.ThrottleMinRateRatio, rel=0.05)
+
+
+def test_rate_limiter_shares_the_bucket_in_files(tmpdir):
+    limiter_dir = str(tmpdir.join('rate_limiter'))
+    key = f"glue.{Region}"
+
+    # NOTE: The bucket starts with the tokens of one second, and another limiter in the same host shares them.
+    assert RateLimiter().acquire(key, rate=2, limiter_dir=limiter_dir) == 0
+    assert RateLimiter().acquire(key, rate=2, limiter_dir=limiter_dir) == 0
+    assert RateLimiter().acquire(key, rate=2, limiter_dir=limiter_dir) > 0
+
+    RateLimiter().throttle(key, rate=2, limiter_dir=limiter_dir)
+    with RateLimiter()._state(key, limiter_dir) as state:
+        assert state['throttled_rate'] == pytest.approx(1, rel=0.05)
+
+
+def test_presto_hook_poll_fails_after_max_attempts_of_unavailable_responses(presto, monkeypatch):
+    monkeypatch.setenv(f"AIRFLOW_CONN_{PrestoConnId.upper()}",
+                       f"presto://test@127.0.0.1:{presto.port}/{Db}?max_attempts=3")
+    presto.rows = 10
+    presto.page_rows = 5
+    presto.unavailable_from_page = 2
+    hook: PrestoHook = hook_registry.get_hook(PrestoHook, presto_conn_id=PrestoConnId)
+
+    query = hook.submit(f"SELECT * FROM {Db}.source")
+    since = call_counter.snapshot()
+    # NOTE: The first page has rows, so the poll drains the rest regardless of the timeout.
+    with pytest.raises(glue_presto_apas.PrestoError):
+        hook.poll(next_uri=query['next_uri'], timeout=60)
+
+    assert call_counter.diff(since)['presto.poll'] == 1 + 3
+
+
+def test_client_of_assumed_role_is_rebuilt_before_the_credentials_expire(aws, monkeypatch):
+    assert glue_presto_apas._client_expires_at({}) is None
+    now = glue_presto_apas.time.monotonic()
+    expires_at = glue_presto_apas._client_expires_at({'role_arn': 'arn:aws:iam::123456789012:role/test',
+                                                      'assume_role_kwargs': {'DurationSeconds': 900}})
+    assert expires_at == pytest.approx(now + 900 * glue_presto_apas.AssumedRoleClientTtlRatio, abs=1)
+
+    hook: GlueDataCatalogHook = hook_registry.get_hook(GlueDataCatalogHook, aws_conn_id=AwsConnId,
+                                                       region_name=Region)
+    client = hook.get_conn()
+    assert hook.get_conn() is client
+    hook._conn_expires_at = glue_presto_apas.time.monotonic() - 1
+    assert hook.get_conn() is not client
+
+
+def test_glue_hook_keeps_the_table_snapshots_by_thread(aws):
+    aws.create_table('snapshot', columns=gen_columns(3))
+    hook: GlueDataCatalogHook = hook_registry.get_hook(GlueDataCatalogHook, aws_conn_id=AwsConnId,
+                                                       region_name=Region)
+    hook.clear_snapshots()
+    since = call_counter.snapshot()
+    hook.get_table(db=Db, name='snapshot')
+
+    # NOTE: Clearing the snapshots in another run does not clear the snapshots of this run.
+    thread = threading.Thread(target=hook.clear_snapshots)
+    thread.start()
+    thread.join()
+    hook.get_table(db=Db, name='snapshot')
+    assert call_counter.diff(since).get('glue.GetTable') == 1
+
+    # NOTE: Invalidation by a mutation in another run invalidates the snapshots of all runs.
+    thread = threading.Thread(target=hook.invalidate_table, args=(Db, 'snapshot'))
+    thread.start()
+    thread.join()
+    hook.get_table(db=Db, name='snapshot')
+    assert call_counter.diff(since).get('glue.GetTable') == 2
+
+
+def test_run_metrics_count_the_calls_of_their_own_run():
+    summaries = {}
+    started = threading.Barrier(2)
+
+    def run(name: str, calls: int) -> None:
+        metrics = glue_presto_apas.RunMetrics()
+        started.wait()
+        with metrics.phase('work'):
+            for _ in range(calls):
+                call_counter.count(f"test.{name}")
+            # NOTE: The threads working for the run count the calls in the run.
+            worker = threading.Thread(target=call_counter.bind(lambda: call_counter.count(f"test.{name}")))
+            worker.start()
+            worker.join()
+        summaries[name] = metrics.summary()
+
+    threads = [threading.Thread(target=run, args=(name, calls)) for name, calls in [('a', 2), ('b', 3)]]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert summaries['a']['calls'] == {'test.a': 3}
+    assert summaries['b']['calls'] == {'test.b': 4}
+    assert summaries['b']['phases']['work']['calls'] == {'test.b': 4}
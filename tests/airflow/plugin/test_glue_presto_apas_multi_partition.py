@@ -0,0 +1,39 @@
+import pytest
+
+from airflow.operators.glue_presto_apas_multi_partition import GluePrestoApasMultiPartitionOperator
+from glue_presto_apas_fakes import AwsConnId, Db, PrestoConnId, Region, gen_columns
+
+Dt = '2019-06-01'
+
+
+@pytest.mark.parametrize('save_mode', ['overwrite', 'skip_if_exists'])
+def test_glue_presto_apas_multi_partition_operator_keeps_sibling_partitions(aws, presto, save_mode):
+    table = f"multi_partition_{save_mode}"
+    location = aws.create_table(table, columns=gen_columns(3), partition_keys=['dt', 'hour'])
+    # NOTE: 'hour=1' is a prefix of 'hour=10' and 'hour=11' without the trailing '/'.
+    for hour in ['1', '10', '11']:
+        aws.put_objects(f"{location}dt={Dt}/hour={hour}/", count=1)
+        aws.create_partition(table, [Dt, hour], f"{location}dt={Dt}/hour={hour}")
+    presto.columns = gen_columns(3) + [{'name': 'dt', 'type': 'varchar'}, {'name': 'hour', 'type': 'varchar'}]
+    presto.partitions = [[Dt, '1'], [Dt, '12']]
+
+    op = GluePrestoApasMultiPartitionOperator(task_id='multi_partition',
+                                              db=Db,
+                                              table=table,
+                                              sql=f"SELECT * FROM {Db}.source",
+                                              save_mode=save_mode,
+                                              progress_interval=0,
+                                              catalog_region_name=Region,
+                                              presto_conn_id=PrestoConnId,
+                                              aws_conn_id=AwsConnId)
+    op.pre_execute(context={})
+    result = op.execute(context={})
+
+    assert result['created'] == [[Dt, '12']]
+    partitions = {tuple(p['Values']): p['StorageDescriptor']['Location'] for p in aws.get_partitions(table)}
+    assert sorted(partitions) == [(Dt, '1'), (Dt, '10'), (Dt, '11'), (Dt, '12')]
+    for values, partition_location in partitions.items():
+        assert aws.list_keys(partition_location.rstrip('/') + '/'), f"Partition{list(values)} has no objects."
+    if save_mode == 'overwrite':
+        assert not aws.list_keys(f"{location}dt={Dt}/hour=1/")
+    assert not [t for t in aws.glue.get_tables(DatabaseName=Db)['TableList'] if t['Name'].startswith('__work_')]
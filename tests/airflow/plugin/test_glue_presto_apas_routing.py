@@ -0,0 +1,93 @@
+from typing import Dict
+
+import pytest
+
+from airflow.operators.glue_presto_apas import GluePrestoApasOperator
+from airflow.operators.glue_presto_apas import StateError
+from glue_presto_apas_fakes import AwsConnId, Db, FakePrestoCoordinator, PrestoConnId, Region, gen_columns, gen_context
+
+Dt = '2019-06-01'
+LargeConnId = PrestoConnId
+SmallConnId = 'presto_small'
+DeadConnId = 'presto_dead'
+EmptyConnId = 'presto_empty'
+HeavyQueryBytes = 1024 * 1024 * 1024
+
+
+@pytest.fixture
+def clusters(aws, presto, monkeypatch) -> Dict[str, FakePrestoCoordinator]:
+    """Presto clusters of 8 and 2 idle workers, an unhealthy coordinator and a cluster without workers."""
+    coordinators = {LargeConnId: presto}
+    for conn_id in [SmallConnId, DeadConnId, EmptyConnId]:
+        coordinators[conn_id] = FakePrestoCoordinator(aws)
+        coordinators[conn_id].start()
+        monkeypatch.setenv(f"AIRFLOW_CONN_{conn_id.upper()}",
+                           f"presto://test@127.0.0.1:{coordinators[conn_id].port}/{Db}")
+    presto.cluster['activeWorkers'] = 8
+    coordinators[SmallConnId].cluster['activeWorkers'] = 2
+    coordinators[DeadConnId].cluster = None
+    coordinators[EmptyConnId].cluster['activeWorkers'] = 0
+    yield coordinators
+    for conn_id, c in coordinators.items():
+        if conn_id != LargeConnId:
+            c.stop()
+
+
+def _run(table: str, input_bytes: float, clusters: Dict[str, FakePrestoCoordinator]) -> dict:
+    for c in clusters.values():
+        c.input_bytes = input_bytes
+    op = GluePrestoApasOperator(task_id='apas_routing',
+                                db=Db,
+                                table=table,
+                                sql=f"SELECT * FROM {Db}.source WHERE dt = '{Dt}'",
+                                partition_kv={'dt': Dt},
+                                presto_conn_ids=[DeadConnId, EmptyConnId, SmallConnId, LargeConnId],
+                                heavy_query_bytes=HeavyQueryBytes,
+                                progress_interval=0,
+                                catalog_region_name=Region,
+                                aws_conn_id=AwsConnId)
+    context = gen_context('apas_routing')
+    op.pre_execute(context=context)
+    return op.execute(context=context)
+
+
+def _inserted(clusters: Dict[str, FakePrestoCoordinator]) -> Dict[str, int]:
+    return {conn_id: len([s for s in c.statements if s.startswith('INSERT INTO')]) for conn_id, c in clusters.items()}
+
+
+@pytest.mark.parametrize('input_bytes,routed', [
+    pytest.param(HeavyQueryBytes, LargeConnId, id='heavy'),
+    pytest.param(HeavyQueryBytes - 1, SmallConnId, id='light'),
+    pytest.param(None, SmallConnId, id='not-estimated'),
+])
+def test_glue_presto_apas_operator_routes_the_query(aws, clusters, input_bytes, routed):
+    table = 'apas_routing'
+    aws.create_table(table, columns=gen_columns(3))
+
+    result = _run(table, input_bytes, clusters)
+
+    assert result['processed']
+    assert result['presto_conn_id'] == routed
+    assert _inserted(clusters) == {c: 1 if c == routed else 0 for c in clusters}
+    # NOTE: The unhealthy coordinator and the cluster without workers run no queries.
+    assert not clusters[DeadConnId].statements
+    assert not clusters[EmptyConnId].statements
+
+
+def test_glue_presto_apas_operator_routes_heavy_query_to_the_cluster_without_queued_queries(aws, clusters):
+    table = 'apas_routing'
+    aws.create_table(table, columns=gen_columns(3))
+    clusters[LargeConnId].cluster['queuedQueries'] = 1
+
+    assert _run(table, HeavyQueryBytes, clusters)['presto_conn_id'] == SmallConnId
+
+
+def test_glue_presto_apas_operator_fails_without_healthy_clusters(aws, clusters):
+    table = 'apas_routing'
+    aws.create_table(table, columns=gen_columns(3))
+    clusters[LargeConnId].cluster = None
+    clusters[SmallConnId].cluster['activeWorkers'] = 0
+
+    with pytest.raises(StateError):
+        _run(table, HeavyQueryBytes, clusters)
+    assert not any(_inserted(clusters).values())
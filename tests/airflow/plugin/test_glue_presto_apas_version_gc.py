@@ -0,0 +1,69 @@
+from datetime import timedelta
+
+from airflow.operators.glue_presto_apas import GluePrestoApasOperator
+from airflow.operators.glue_presto_apas import VersionedLocationPattern
+from airflow.operators.glue_presto_apas_version_gc import GluePrestoApasVersionGcOperator
+from glue_presto_apas_fakes import AwsConnId, Db, PrestoConnId, Region, gen_columns, gen_context
+
+Dt = '2019-06-01'
+
+
+def _run_version_gc(table: str, retention: timedelta) -> dict:
+    op = GluePrestoApasVersionGcOperator(task_id='version_gc',
+                                         db=Db,
+                                         table=table,
+                                         retention=retention,
+                                         catalog_region_name=Region,
+                                         aws_conn_id=AwsConnId)
+    context = gen_context('version_gc')
+    op.pre_execute(context=context)
+    return op.execute(context=context)
+
+
+def test_glue_presto_apas_version_gc_operator(aws, presto):
+    table = 'apas_versioned'
+    location = aws.create_table(table, columns=gen_columns(3))
+    root = f"{location}dt={Dt}/"
+    # NOTE: The objects written before `overwrite_versioned` mode is used.
+    aws.put_objects(root, count=2)
+    aws.put_objects(f"{root}nested/", count=1)
+    aws.create_partition(table, [Dt], root)
+    unversioned_keys = aws.list_keys(root)
+
+    versions = []
+    for i in range(2):
+        op = GluePrestoApasOperator(task_id='apas_versioned',
+                                    db=Db,
+                                    table=table,
+                                    sql=f"SELECT * FROM {Db}.source WHERE dt = '{Dt}'",
+                                    partition_kv={'dt': Dt},
+                                    save_mode='overwrite_versioned',
+                                    progress_interval=0,
+                                    catalog_region_name=Region,
+                                    presto_conn_id=PrestoConnId,
+                                    aws_conn_id=AwsConnId)
+        context = gen_context('apas_versioned', try_number=i + 1)
+        op.pre_execute(context=context)
+        result = op.execute(context=context)
+        assert result['processed']
+        versions.append(result['location'].rstrip('/') + '/')
+
+        partition_location = aws.get_partitions(table)[0]['StorageDescriptor']['Location']
+        assert VersionedLocationPattern.match(partition_location)
+        assert partition_location.rstrip('/') + '/' == versions[-1]
+    assert versions[0] != versions[1]
+    # NOTE: The task switches the partition without deleting any objects.
+    for version in versions:
+        assert aws.list_keys(version)
+    assert set(unversioned_keys) <= set(aws.list_keys(root))
+
+    result = _run_version_gc(table, retention=timedelta(hours=6))
+    assert result['deleted_locations'] == []
+    assert result['deleted_count'] == 0
+
+    result = _run_version_gc(table, retention=timedelta(0))
+    assert result['deleted_locations'] == [versions[0]]
+    assert not aws.list_keys(versions[0])
+    assert aws.list_keys(versions[1])
+    assert not set(unversioned_keys) & set(aws.list_keys(root))
+    assert result['deleted_count'] == len(unversioned_keys) + presto.files